@@ -0,0 +1,80 @@
+"""Associate devices with the pguser and zoomjtapi application users in bulk.
+
+updateAppUser would overwrite every other device already associated, so the
+devices are inserted straight into applicationuserdevicemap. The insert is
+set based, so one statement per application user covers a whole chunk of
+devices; the map is queried afterwards to tell which devices made it.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from zeep.exceptions import Fault
+
+import axl_sql
+
+APP_USERS = ( 'pguser', 'zoomjtapi' )
+
+INSERT_SQL = '''insert into applicationuserdevicemap (fkapplicationuser, fkdevice, tkuserassociation)
+    select au.pkid, d.pkid, 1 from applicationuser au cross join device d
+    where au.name = {app_user} and d.name in ({devices}) and
+    d.pkid not in (select fkdevice from applicationuserdevicemap where fkapplicationuser = au.pkid)'''
+
+MAPPED_SQL = '''select au.name as app_user, d.name as device from applicationuserdevicemap m
+    join applicationuser au on au.pkid = m.fkapplicationuser
+    join device d on d.pkid = m.fkdevice
+    where au.name in ({app_users}) and d.name in ({devices})'''
+
+APP_USER_DEVICES_SQL = '''select au.name as app_user, d.name as device from applicationuserdevicemap m
+    join applicationuser au on au.pkid = m.fkapplicationuser
+    join device d on d.pkid = m.fkdevice
+    where au.name in ({app_users})'''
+
+
+def associate_devices( service, devices, app_users = APP_USERS ):
+    """Associate every device in `devices` with every user in `app_users`.
+
+    Returns { device: set of app users it is now associated with }, checked against
+    applicationuserdevicemap after the inserts."""
+    devices = list( devices )
+    if not devices:
+        return { }
+
+    for app_user in app_users:
+        try:
+            resp = service.executeSQLUpdate( INSERT_SQL.format( app_user = axl_sql.quote( app_user ), devices = axl_sql.in_list( devices ) ) )
+        except Fault as err:
+            print( f'Zeep error: executeSQLUpdate: { err }' )
+        else:
+            print( f"{ app_user }: { resp['return']['rowsUpdated'] } of { len( devices ) } devices added" )
+
+    return mapped_devices( service, devices, app_users )
+
+
+def mapped_devices( service, devices, app_users = APP_USERS ):
+    """Return { device: set of the `app_users` it is associated with } from applicationuserdevicemap."""
+    devices = list( devices )
+    mapped = { device: set() for device in devices }
+    if not devices:
+        return mapped
+    by_name = { device.lower(): device for device in devices }
+    rows = axl_sql.query( service, MAPPED_SQL.format( app_users = axl_sql.in_list( app_users ), devices = axl_sql.in_list( devices ) ) )
+    for row in rows:
+        device = by_name.get( row['device'].lower() )
+        if device is not None:
+            mapped[ device ].add( row['app_user'] )
+    return mapped
@@ -0,0 +1,415 @@
+"""asyncio AXL client and the migration steps as coroutines.
+
+The zeep client in axl_client.py is synchronous: every call holds a thread until
+CUCM answers, so keeping many requests in flight means many threads. This module
+builds the same compiled, cached AXL schema into zeep's AsyncClient on top of
+httpx, whose operations are awaitables; one event loop in one thread can then
+keep hundreds of requests in flight.
+
+    client = create_async_client( max_connections = 200 )
+    service = AsyncLimitedService( create_async_service( client ), max_in_flight = 200 )
+    results = asyncio.run( migrate_agents( service, agents, concurrency = 200 ) )
+
+migrate_agent() runs the steps of bulk_agent_migrator.py for one agent: read the
+EM profile and the CIPC, create the CSF in place, associate it with the end user
+and the app users, and queue the CIPC/profile for cleanup.py. Steps are recorded
+in a MigrationJournal with the same names, so a bulk run can resume them.
+Compare with the threaded client using benchmarks/async_io.py.
+
+Needs httpx (pip install httpx).
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import time
+import random
+import ssl
+import asyncio
+
+import httpx
+from zeep import AsyncClient, Settings, xsd
+from zeep.exceptions import Fault, TransportError
+from zeep.proxy import AsyncServiceProxy
+from zeep.transports import AsyncTransport
+
+import axl_sql
+from axl_client import BINDING_NAME, CACHE_DIR, OPERATIONS, SESSION_COOKIE_PREFIX, WSDL_FILE, compile_wsdl, service_url
+from axl_read import read_async
+from app_users import APP_USERS, INSERT_SQL, MAPPED_SQL
+from cleanup import RETIRE_STEP
+from prefetch import CIPC_TAGS, PROFILE_SUFFIXES, cipc_row, csf_placement
+from throttle import is_throttled
+from tracing import AsyncTracingTransport
+
+# seconds to open a connection to CUCM and to hand it a request, when httpx gives no timeout
+CONNECT_TIMEOUT = 10
+WRITE_TIMEOUT = 10
+
+
+class AsyncSessionCookieAuth( httpx.Auth ):
+    """axl_client.SessionCookieAuth for httpx: basic auth until the client holds a
+    CUCM session cookie, the cookie alone after that, and the credentials once more
+    when CUCM rejects the cookie."""
+
+    def __init__( self, cookies, username, password ):
+        self.cookies = cookies
+        self.basic = httpx.BasicAuth( username, password )
+
+    def auth_flow( self, request ):
+        if SESSION_COOKIE_PREFIX not in request.headers.get( 'Cookie', '' ):
+            yield from self.basic.auth_flow( request )
+            return
+        response = yield request
+        if response.status_code == 401:
+            self.cookies.clear()
+            del request.headers[ 'Cookie' ]
+            yield from self.basic.auth_flow( request )
+
+
+class StreamTransport( httpx.AsyncBaseTransport ):
+    """HTTP/1.1 keep-alive transport for httpx on plain asyncio streams.
+
+    httpcore, httpx's own transport, re-checks every pooled connection for every
+    request; with a few hundred connections that costs more CPU than zeep does. AXL
+    only needs POSTs with a body and a Content-Length or chunked answer, so the
+    connections are kept here in a list per host instead, at most
+    `max_connections` of them busy at once. A connection goes back to the list only
+    after a complete answer; one that failed, timed out or was cancelled halfway is
+    closed."""
+
+    def __init__( self, max_connections = 100, verify = False ):
+        self._slots = asyncio.Semaphore( max_connections )
+        self._idle = { }
+        self._ssl = ssl.create_default_context()
+        if not verify:
+            self._ssl.check_hostname = False
+            self._ssl.verify_mode = ssl.CERT_NONE
+
+    async def handle_async_request( self, request ):
+        key = ( request.url.scheme, request.url.host, request.url.port or ( 443 if request.url.scheme == 'https' else 80 ) )
+        timeouts = request.extensions.get( 'timeout' ) or { }
+        message = b''.join( [ request.method.encode(), b' ', request.url.raw_path, b' HTTP/1.1\r\n' ]
+                            + [ name + b': ' + value + b'\r\n' for name, value in request.headers.raw ]
+                            + [ b'\r\n', await request.aread() ] )
+        async with self._slots:
+            idle = self._idle.setdefault( key, [ ] )
+            while True:
+                reused = bool( idle )
+                reader, writer = idle.pop() if reused else await self._connect( key, timeouts.get( 'connect' ) or CONNECT_TIMEOUT, request )
+                keep = False
+                try:
+                    try:
+                        writer.write( message )
+                        await asyncio.wait_for( writer.drain(), timeouts.get( 'write' ) or WRITE_TIMEOUT )
+                    except asyncio.TimeoutError:
+                        raise httpx.WriteTimeout( 'AXL request timed out', request = request )
+                    try:
+                        status, headers, body, keep = await asyncio.wait_for( self._read_response( reader ), timeouts.get( 'read' ) )
+                    except asyncio.TimeoutError:
+                        raise httpx.ReadTimeout( 'AXL response timed out', request = request )
+                except ( OSError, asyncio.IncompleteReadError ) as err:
+                    # the server closed the kept-alive connection before reading the request, send it again
+                    if reused and isinstance( err, asyncio.IncompleteReadError ) and not err.partial:
+                        continue
+                    raise httpx.ReadError( str( err ) or type( err ).__name__, request = request )
+                finally:
+                    # also runs when the task is cancelled, a half-used connection can't be reused
+                    if keep:
+                        idle.append( ( reader, writer ) )
+                    else:
+                        writer.close()
+                break
+        return httpx.Response( status, headers = headers, stream = httpx.ByteStream( body ), extensions = { 'http_version': b'HTTP/1.1' } )
+
+    async def _connect( self, key, timeout, request ):
+        scheme, host, port = key
+        try:
+            return await asyncio.wait_for( asyncio.open_connection( host, port, ssl = self._ssl if scheme == 'https' else None ), timeout )
+        except asyncio.TimeoutError:
+            raise httpx.ConnectTimeout( f'No connection to { host }:{ port } after { timeout }s', request = request )
+        except OSError as err:
+            raise httpx.ConnectError( str( err ), request = request )
+
+    async def _read_response( self, reader ):
+        status_line = await reader.readuntil( b'\r\n' )
+        version, status = status_line.split( None, 2 )[ :2 ]
+        headers = [ ]
+        while True:
+            line = await reader.readuntil( b'\r\n' )
+            if line == b'\r\n':
+                break
+            name, _, value = line.partition( b':' )
+            headers.append( ( name.strip(), value.strip() ) )
+        fields = { name.lower(): value.lower() for name, value in headers }
+        keep = version == b'HTTP/1.1' and fields.get( b'connection' ) != b'close'
+        if fields.get( b'transfer-encoding' ) == b'chunked':
+            chunks = [ ]
+            while True:
+                size = int( ( await reader.readuntil( b'\r\n' ) ).split( b';' )[0], 16 )
+                if size == 0:
+                    # trailers, if any, end with an empty line
+                    while await reader.readuntil( b'\r\n' ) != b'\r\n':
+                        pass
+                    break
+                chunks.append( await reader.readexactly( size ) )
+                await reader.readexactly( 2 )
+            body = b''.join( chunks )
+        elif b'content-length' in fields:
+            body = await reader.readexactly( int( fields[ b'content-length' ] ) )
+        else:
+            body = await reader.read()
+            keep = False
+        return int( status ), headers, body, keep
+
+    async def aclose( self ):
+        for idle in self._idle.values():
+            for reader, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+
+def create_async_client( max_connections = 100, tracer = None, operations = OPERATIONS, cache_dir = CACHE_DIR ):
+    """zeep AsyncClient from the compiled, cached schema (see axl_client.create_client).
+
+    `max_connections` is how many HTTP connections to CUCM may be open at once."""
+    if operations is None or os.getenv( 'AXL_FULL_WSDL' ):
+        wsdl_file = WSDL_FILE
+    else:
+        wsdl_file = compile_wsdl( WSDL_FILE, operations, cache_dir )
+
+    http = httpx.AsyncClient( transport = StreamTransport( max_connections ), timeout = 10 )
+    http.auth = AsyncSessionCookieAuth( http.cookies, os.getenv( 'AXL_USERNAME' ), os.getenv( 'AXL_PASSWORD' ) )
+    # the WSDL is read from disk, the sync client is only there because zeep wants one
+    if tracer is not None:
+        transport = AsyncTracingTransport( tracer, client = http, wsdl_client = httpx.Client( verify = False ) )
+    else:
+        transport = AsyncTransport( client = http, wsdl_client = httpx.Client( verify = False ) )
+
+    settings = Settings( strict=False, xml_huge_tree=True )
+    return AsyncClient( wsdl_file, settings = settings, transport = transport,
+                        plugins = [ tracer ] if tracer is not None else [ ] )
+
+
+def create_async_service( client, address = None ):
+    """Bind `client` to the AXL endpoint, see axl_client.service_url(). Every
+    operation of the returned service is a coroutine function."""
+    return AsyncServiceProxy( client, client.wsdl.bindings[ BINDING_NAME ], address = service_url( address ) )
+
+
+class AsyncLimitedService:
+    """Wraps the async service proxy: at most `max_in_flight` requests at once, and
+    requests CUCM rejected because it is overloaded are retried `retries` times with
+    growing pauses (see throttle.AimdController for the threaded version). With a
+    throttle.RateLimiter `limiter` every request also waits for its budget."""
+
+    def __init__( self, service, max_in_flight = 100, retries = 4, backoff = 0.5, limiter = None ):
+        self._service = service
+        self._slots = asyncio.Semaphore( max_in_flight )
+        self._limiter = limiter
+        self.retries = retries
+        self.backoff = backoff
+
+    def __getattr__( self, name ):
+        operation = getattr( self._service, name )
+
+        async def call( *args, **kwargs ):
+            for attempt in range( self.retries + 1 ):
+                try:
+                    async with self._slots:
+                        if self._limiter is not None:
+                            await self._limiter.acquire_async()
+                        return await operation( *args, **kwargs )
+                except ( Fault, TransportError, httpx.HTTPError ) as err:
+                    if not is_throttled( err ) or attempt == self.retries:
+                        raise
+                await asyncio.sleep( self.backoff * 2 ** attempt * random.uniform( 0.5, 1.5 ) )
+
+        return call
+
+
+def csf_phone( device_name, owner_user_name, description, lines, placement ):
+    """addPhone argument for the agent's CSF, see fill_phone_info in bulk_agent_migrator.py."""
+    return {
+        'name': device_name,
+        'product': 'Cisco Unified Client Services Framework',
+        'model': 'Cisco Unified Client Services Framework',
+        'description': f'{description}',
+        'class': 'Phone',
+        'protocol': 'SIP',
+        'protocolSide': 'User',
+        'devicePoolName': placement['devicePoolName'],
+        'locationName': placement['locationName'],
+        'mediaResourceListName': placement['mediaResourceListName'],
+        'callingSearchSpaceName': placement['callingSearchSpaceName'],
+        'sipProfileName': 'Standard SIP Profile',
+        'commonPhoneConfigName': xsd.SkipValue,
+        'commonDeviceConfigName': 'Agent_CDC',
+        'phoneTemplateName': xsd.SkipValue,
+        'primaryPhoneName': xsd.SkipValue,
+        'useTrustedRelayPoint': xsd.SkipValue,
+        'builtInBridgeStatus': 'On',
+        'packetCaptureMode': xsd.SkipValue,
+        'certificateOperation': xsd.SkipValue,
+        'deviceMobilityMode': xsd.SkipValue,
+        'ownerUserName': owner_user_name,
+        'lines': lines,
+    }
+
+
+async def read_profile( service, enumber ):
+    """( name, record ) of the agent's EM profile, None when there is none."""
+    for suffix in PROFILE_SUFFIXES:
+        name = enumber.capitalize() + suffix
+        try:
+            return name, await read_async( service, 'migrate', 'getDeviceProfile', name = name )
+        except Fault:
+            continue
+    return None
+
+
+async def lookup_cipc( service, name ):
+    """prefetch.lookup_cipc() as a coroutine."""
+    return cipc_row( await service.listPhone( searchCriteria = { 'name': name }, returnedTags = CIPC_TAGS ) )
+
+
+async def mapped_app_users( service, device_name ):
+    """The APP_USERS `device_name` is associated with, app_users.mapped_devices() for
+    one device as a coroutine."""
+    resp = await service.executeSQLQuery( MAPPED_SQL.format( app_users = axl_sql.in_list( APP_USERS ), devices = axl_sql.quote( device_name ) ) )
+    return { row[ 'app_user' ] for row in axl_sql.rows( resp ) }
+
+
+async def resolve_agent( service, enumber ):
+    """Read phase of one agent: the EM profile and the CIPC, looked up at the same
+    time. Returns ( profile name, profile record, CIPC row ), the first two None
+    when the agent has no EM profile."""
+    found, cipc = await asyncio.gather( read_profile( service, enumber ), lookup_cipc( service, enumber.capitalize() ) )
+    name, profile = found or ( None, None )
+    return name, profile, cipc
+
+
+async def migrate_agent( service, enumber, device_pool = None, journal = None ):
+    """Migrate one agent and return its result row (agent, device, status, completed,
+    failed, seconds) like bulk_agent_migrator.py does. The CIPC and the EM profile are
+    left for cleanup.py; with `journal` every finished step is recorded in it, and the
+    steps it already has for the agent are skipped. Journals written here and by
+    bulk_agent_migrator.py can be resumed by either."""
+    started = time.perf_counter()
+    journaled = journal.steps( enumber ) if journal is not None else { }
+    result = { 'agent': enumber, 'device': journaled.get( 'addPhone', { } ).get( 'device', '' ), 'status': 'ok',
+               'completed': list( journaled ), 'failed': [ ], 'seconds': 0 }
+
+    def done( step, **data ):
+        result[ 'completed' ].append( step )
+        if journal is not None:
+            journal.done( enumber, step, **data )
+
+    def failed( step, err ):
+        result[ 'failed' ].append( step )
+        print( f'{ enumber }: Zeep error: { step }: { err }' )
+
+    # journals from before the CSF was created in place still have the updatePhone to do
+    legacy = 'addPhone' in journaled and not journaled[ 'addPhone' ].get( 'placed' ) and 'updatePhone' not in journaled
+    try:
+        if 'addPhone' in journaled:
+            # created by an earlier run, carry on after it
+            profile_name = journaled[ 'addPhone' ][ 'profile' ]
+            device_name = journaled[ 'addPhone' ][ 'device' ]
+            cipc = await lookup_cipc( service, enumber.capitalize() ) if RETIRE_STEP not in journaled or legacy else None
+        else:
+            profile_name, profile, cipc = await resolve_agent( service, enumber )
+            if profile is None:
+                print( enumber + ': No EM Profile Found' )
+                result[ 'failed' ].append( 'getDeviceProfile' )
+                result[ 'status' ] = 'failed'
+                return result
+
+            device_name = 'CSF' + enumber.capitalize()
+            result[ 'device' ] = device_name
+            placement = csf_placement( cipc, device_pool )
+            try:
+                await service.addPhone( csf_phone( device_name, enumber.capitalize(), profile.get( 'description' ), profile.get( 'lines' ), placement ) )
+            except Fault as err:
+                # created before the last run stopped, but not journaled yet
+                if 'duplicate' not in str( err ).lower():
+                    failed( 'addPhone', err )
+                    result[ 'status' ] = 'failed'
+                    return result
+                print( enumber + ': ' + device_name + ' already exists' )
+            done( 'addPhone', profile = profile_name, device = device_name, placed = True )
+
+        if legacy:
+            placement = csf_placement( cipc, device_pool )
+            try:
+                await service.updatePhone( name = device_name, devicePoolName = placement[ 'devicePoolName' ],
+                                           mediaResourceListName = placement[ 'mediaResourceListName' ],
+                                           callingSearchSpaceName = placement[ 'callingSearchSpaceName' ] )
+            except Fault as err:
+                failed( 'updatePhone', err )
+            else:
+                done( 'updatePhone' )
+
+        # the end user and the app users only need the CSF to exist, so they go out together
+        calls = { 'updateUser': lambda: service.updateUser( userid = enumber.capitalize(), associatedDevices = device_name, imAndPresenceEnable = False ) }
+        for app_user in APP_USERS:
+            calls[ app_user ] = lambda app_user = app_user: service.executeSQLUpdate(
+                INSERT_SQL.format( app_user = axl_sql.quote( app_user ), devices = axl_sql.quote( device_name ) ) )
+        steps = [ step for step in calls if step not in journaled ]
+        outcomes = await asyncio.gather( *[ calls[ step ]() for step in steps ], return_exceptions = True )
+        for step, outcome in zip( steps, outcomes ):
+            if isinstance( outcome, Exception ):
+                failed( step, outcome )
+            elif step in APP_USERS and outcome[ 'return' ][ 'rowsUpdated' ] != 1:
+                # nothing inserted on a resumed agent may mean the last run already did it
+                if journaled and step in await mapped_app_users( service, device_name ):
+                    done( step )
+                else:
+                    result[ 'failed' ].append( step )
+            else:
+                done( step )
+
+        if RETIRE_STEP not in journaled:
+            if cipc is None and 'removePhone' not in journaled:
+                print( enumber + ": Couldn't find the CIPC to delete." )
+                result[ 'failed' ].append( 'removePhone' )
+            done( RETIRE_STEP, cipc = cipc[ 'name' ] if cipc is not None else '', profile = profile_name )
+    except Exception as err:
+        print( enumber + ': migration stopped: ' + str( err ) )
+        result[ 'failed' ].append( 'unexpected error' )
+        result[ 'status' ] = 'failed'
+    finally:
+        if result[ 'status' ] == 'ok' and result[ 'failed' ]:
+            result[ 'status' ] = 'partial'
+        result[ 'seconds' ] = round( time.perf_counter() - started, 2 )
+    return result
+
+
+async def migrate_agents( service, agents, concurrency = 100, device_pool = None, journal = None ):
+    """migrate_agent() for every E# in `agents`, `concurrency` agents at a time.
+    Returns the result rows in the order of `agents`."""
+    slots = asyncio.Semaphore( max( 1, concurrency ) )
+
+    async def one( enumber ):
+        async with slots:
+            result = await migrate_agent( service, enumber, device_pool, journal )
+        if journal is not None:
+            journal.finish( enumber, result[ 'status' ] )
+        return result
+
+    return await asyncio.gather( *[ one( enumber ) for enumber in agents ] )
@@ -0,0 +1,369 @@
+"""Shared AXL client factory used by all of the migrator scripts.
+
+Parsing the full AXL WSDL (AXLAPI.wsdl + the 3.5 MB AXLSoap.xsd) takes a second or
+two on every launch, while the scripts only ever call a handful of operations. The
+first time a script starts, the schema is compiled down to just those operations
+(plus every type they reference) and written to an on-disk cache keyed by a hash of
+the WSDL files. Every later start loads the small compiled copy instead.
+
+Sessions authenticate with the credentials only until CUCM hands out its session
+cookie; after that the cookie alone is sent, which skips CUCM's backend
+authentication on every call. The cookie is kept (readable by the owner only)
+between runs, so short script invocations don't start from scratch either.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import re
+import json
+import time
+import atexit
+import hashlib
+import shutil
+import tempfile
+from lxml import etree
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.auth import AuthBase, HTTPBasicAuth
+from zeep import Client, Settings
+from zeep.transports import Transport
+from tracing import TracingTransport
+from retry_policy import PolicyService, current_timeout, default_policy
+from urllib3 import disable_warnings
+from urllib3.exceptions import InsecureRequestWarning
+
+BASE_DIR = os.path.dirname( os.path.abspath( __file__ ) )
+
+# The WSDL is a local file
+WSDL_FILE = os.path.join( BASE_DIR, 'schema', 'AXLAPI.wsdl' )
+
+BINDING_NAME = '{http://www.cisco.com/AXLAPIService/}AXLAPIBinding'
+
+# Compiled schemas are kept here, one sub folder per WSDL hash
+CACHE_DIR = os.getenv( 'AXL_CACHE_DIR', os.path.join( BASE_DIR, '.axl_cache' ) )
+
+# Every AXL operation used by the scripts. Anything not listed here is left out of the
+# compiled schema, so add new operations here before calling them.
+OPERATIONS = (
+    'addLine',
+    'addPhone',
+    'doDeviceLogout',
+    'executeSQLQuery',
+    'executeSQLUpdate',
+    'getDeviceProfile',
+    'getLine',
+    'getPhone',
+    'getUser',
+    'listChange',
+    'listCss',
+    'listDevicePool',
+    'listDeviceProfile',
+    'listLine',
+    'listLocation',
+    'listMediaResourceList',
+    'listPhone',
+    'listUser',
+    'removeDeviceProfile',
+    'removeLine',
+    'removePhone',
+    'updatePhone',
+    'updateUser',
+)
+
+WSDL_NS = 'http://schemas.xmlsoap.org/wsdl/'
+XSD_NS = 'http://www.w3.org/2001/XMLSchema'
+
+# <import location="AXLSoap.xsd" .../> in the WSDL, found without parsing the whole file
+IMPORT_RE = re.compile( rb'<(?:\w+:)?import\b[^>]*\blocation="([^"]+)"' )
+
+# CUCM session cookies. Set AXL_SESSION_CACHE=0 to not keep them between runs, and
+# AXL_SESSION_TTL to how many seconds a kept cookie is trusted (CUCM expires idle
+# sessions after a while, an expired cookie costs one retry with the credentials)
+SESSION_COOKIE_PREFIX = 'JSESSIONID'
+SESSION_TTL = int( os.getenv( 'AXL_SESSION_TTL', 20 * 60 ) )
+
+# If you have a pem file certificate for CUCM, uncomment and define it here
+
+#CERT = 'some.pem'
+
+disable_warnings( InsecureRequestWarning )
+
+
+def _schema_files( wsdl_file ):
+    """Return the WSDL plus every schema file it imports."""
+    with open( wsdl_file, 'rb' ) as f:
+        locations = IMPORT_RE.findall( f.read() )
+    folder = os.path.dirname( wsdl_file )
+    return [ wsdl_file ] + [ os.path.join( folder, loc.decode() ) for loc in locations ]
+
+
+def schema_hash( wsdl_file = WSDL_FILE, operations = OPERATIONS ):
+    """Hash of the WSDL files and the operation list, used as the cache key."""
+    digest = hashlib.sha256()
+    for path in _schema_files( wsdl_file ):
+        with open( path, 'rb' ) as f:
+            digest.update( f.read() )
+    digest.update( ','.join( sorted( operations ) ).encode() )
+    return digest.hexdigest()[:16]
+
+
+def _trim_wsdl( root, operations ):
+    """Drop messages and binding operations that are not in `operations`.
+
+    Returns the names of the schema elements still referenced by the WSDL."""
+    keep_messages = { 'AXLError' }
+    for op in operations:
+        keep_messages.update( [ op + 'In', op + 'Out' ] )
+
+    elements = set()
+    for message in root.findall( f'{{{WSDL_NS}}}message' ):
+        if message.get( 'name' ) in keep_messages:
+            for part in message:
+                elements.add( part.get( 'element' ).split( ':' )[-1] )
+        else:
+            root.remove( message )
+
+    for parent in root.findall( f'{{{WSDL_NS}}}portType' ) + root.findall( f'{{{WSDL_NS}}}binding' ):
+        for op in parent.findall( f'{{{WSDL_NS}}}operation' ):
+            if op.get( 'name' ) not in operations:
+                parent.remove( op )
+    return elements
+
+
+def _trim_xsd( root, elements ):
+    """Keep only the top level elements/types reachable from `elements`."""
+    target_ns = root.get( 'targetNamespace' )
+
+    index = {}
+    for node in root:
+        if isinstance( node.tag, str ) and node.get( 'name' ):
+            is_element = etree.QName( node ).localname == 'element'
+            index[ ( is_element, node.get( 'name' ) ) ] = node
+
+    keep = set()
+    pending = [ ( True, name ) for name in elements ]
+    while pending:
+        key = pending.pop()
+        if key in keep or key not in index:
+            continue
+        keep.add( key )
+        for node in index[ key ].iter():
+            if not isinstance( node.tag, str ):
+                continue
+            for attr in ( 'type', 'base', 'ref' ):
+                value = node.get( attr )
+                if not value:
+                    continue
+                prefix, _, name = value.rpartition( ':' )
+                if node.nsmap.get( prefix or None ) == target_ns:
+                    pending.append( ( attr == 'ref', name ) )
+
+    for node in list( root ):
+        if not isinstance( node.tag, str ):
+            root.remove( node )
+        elif node.get( 'name' ) and ( etree.QName( node ).localname == 'element', node.get( 'name' ) ) not in keep:
+            root.remove( node )
+
+
+def compile_wsdl( wsdl_file = WSDL_FILE, operations = OPERATIONS, cache_dir = CACHE_DIR ):
+    """Return the path of a compiled copy of `wsdl_file` that only has `operations`.
+
+    The compiled copy is built on first use and reused as long as the WSDL files and
+    the operation list stay the same."""
+    target = os.path.join( cache_dir, schema_hash( wsdl_file, operations ) )
+    compiled = os.path.join( target, os.path.basename( wsdl_file ) )
+    if os.path.exists( compiled ):
+        return compiled
+
+    os.makedirs( cache_dir, exist_ok = True )
+    work = tempfile.mkdtemp( dir = cache_dir )
+    try:
+        parser = etree.XMLParser( huge_tree = True, remove_blank_text = True )
+        wsdl = etree.parse( wsdl_file, parser )
+        elements = _trim_wsdl( wsdl.getroot(), set( operations ) )
+        wsdl.write( os.path.join( work, os.path.basename( wsdl_file ) ), xml_declaration = True, encoding = 'UTF-8' )
+
+        for path in _schema_files( wsdl_file )[1:]:
+            xsd = etree.parse( path, parser )
+            _trim_xsd( xsd.getroot(), elements )
+            xsd.write( os.path.join( work, os.path.basename( path ) ), xml_declaration = True, encoding = 'UTF-8' )
+
+        # Another script may have compiled the same schema in the meantime
+        try:
+            os.rename( work, target )
+        except OSError:
+            pass
+    finally:
+        shutil.rmtree( work, ignore_errors = True )
+    return compiled
+
+
+class SessionCookieAuth( AuthBase ):
+    """HTTP basic auth until the session holds a CUCM session cookie, the cookie alone
+    after that. When CUCM rejects the cookie (401, the session expired) the cookies
+    are dropped and the request is sent once more with the credentials."""
+
+    def __init__( self, session, username, password ):
+        self.session = session
+        self.basic = HTTPBasicAuth( username, password )
+
+    def __call__( self, request ):
+        if SESSION_COOKIE_PREFIX not in request.headers.get( 'Cookie', '' ):
+            return self.basic( request )
+        request.register_hook( 'response', self._retry_with_credentials )
+        return request
+
+    def _retry_with_credentials( self, response, **kwargs ):
+        if response.status_code != 401:
+            return response
+        response.content
+        response.close()
+        self.session.cookies.clear()
+        request = response.request.copy()
+        request.headers.pop( 'Cookie', None )
+        self.basic( request )
+        retry = response.connection.send( request, **kwargs )
+        retry.history.append( response )
+        retry.request = request
+        return retry
+
+
+class DeadlineAdapter( HTTPAdapter ):
+    """Sends with the deadline retry_policy.py set for the AXL call being made. Without
+    one the transport's timeout stays, which is None for AXL operations (the
+    Transport's timeout=10 only applies to loading the WSDL)."""
+
+    def send( self, request, **kwargs ):
+        timeout = current_timeout()
+        if timeout is not None:
+            kwargs[ 'timeout' ] = timeout
+        return super().send( request, **kwargs )
+
+
+def _session_file( cache_dir = CACHE_DIR ):
+    # one file per CUCM and AXL user, without either in the file name
+    key = f"{ os.getenv( 'AXL_URL' ) or os.getenv( 'CUCM_ADDRESS' ) }|{ os.getenv( 'AXL_USERNAME' ) }"
+    return os.path.join( cache_dir, f'session-{ hashlib.sha256( key.encode() ).hexdigest()[:16] }.json' )
+
+
+def load_session_cookies( session, path, ttl = SESSION_TTL ):
+    """Put the session cookies saved in `path` into `session`, unless they are older than `ttl`."""
+    try:
+        if time.time() - os.path.getmtime( path ) > ttl:
+            return False
+        with open( path ) as f:
+            cookies = json.load( f )
+    except ( OSError, ValueError ):
+        return False
+    for cookie in cookies:
+        session.cookies.set( cookie['name'], cookie['value'], domain = cookie['domain'], path = cookie['path'] )
+    return bool( cookies )
+
+
+def save_session_cookies( session, path ):
+    """Write the CUCM session cookies of `session` to `path`, readable by the owner only."""
+    cookies = [ { 'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path }
+                for c in session.cookies if c.name.upper().startswith( SESSION_COOKIE_PREFIX ) ]
+    if not cookies:
+        return
+    os.makedirs( os.path.dirname( path ), exist_ok = True )
+    # mkstemp creates the file with mode 0600
+    fd, tmp = tempfile.mkstemp( dir = os.path.dirname( path ) )
+    with os.fdopen( fd, 'w' ) as f:
+        json.dump( cookies, f )
+    os.replace( tmp, path )
+
+
+def create_session( pool_size = None, keep_cookies = None ):
+    """requests Session with the AXL credentials from the environment.
+
+    `pool_size` is how many worker threads share the session, so each one keeps its
+    own persistent connection instead of reopening one per call. The CUCM session
+    cookie is loaded from and saved to the cache dir unless `keep_cookies` is False
+    (default: AXL_SESSION_CACHE, on)."""
+    session = Session()
+    adapter = DeadlineAdapter( pool_connections = 1, pool_maxsize = max( pool_size or 1, 10 ) )
+    session.mount( 'https://', adapter )
+    session.mount( 'http://', adapter )
+
+    # We avoid certificate verification by default, but you can uncomment and set
+    # your certificate here, and comment out the False setting
+
+    #session.verify = CERT
+    session.verify = False
+    session.auth = SessionCookieAuth( session, os.getenv( 'AXL_USERNAME' ), os.getenv( 'AXL_PASSWORD' ) )
+
+    if keep_cookies is None:
+        keep_cookies = os.getenv( 'AXL_SESSION_CACHE', '1' ) != '0'
+    if keep_cookies:
+        path = _session_file()
+        load_session_cookies( session, path )
+        atexit.register( save_session_cookies, session, path )
+    return session
+
+
+def create_client( plugins = None, session = None, operations = OPERATIONS, cache_dir = CACHE_DIR, tracer = None ):
+    """Build a zeep Client from the compiled, cached schema.
+
+    Set AXL_FULL_WSDL=1 in the environment (or pass operations=None) to load the full
+    WSDL instead, e.g. when trying out an operation that is not in OPERATIONS yet.
+
+    `tracer` is a tracing.TracingPlugin that records every call made by the client."""
+    if operations is None or os.getenv( 'AXL_FULL_WSDL' ):
+        wsdl_file = WSDL_FILE
+    else:
+        wsdl_file = compile_wsdl( WSDL_FILE, operations, cache_dir )
+
+    # Create a Zeep transport and set a reasonable timeout value
+    if tracer is not None:
+        transport = TracingTransport( tracer, session = session or create_session(), timeout = 10 )
+        plugins = list( plugins or [ ] ) + [ tracer ]
+    else:
+        transport = Transport( session = session or create_session(), timeout = 10 )
+
+    # strict=False is not always necessary, but it allows zeep to parse imperfect XML
+    settings = Settings( strict=False, xml_huge_tree=True )
+
+    return Client( wsdl_file, settings = settings, transport = transport,
+            plugins = plugins or [ ] )
+
+
+def service_url( address = None ):
+    """AXL endpoint of CUCM_ADDRESS (or `address`).
+
+    Without `address`, AXL_URL in the environment overrides the whole URL, e.g. to
+    point the scripts at axl_simulator.py."""
+    if address is None and os.getenv( 'AXL_URL' ):
+        return os.getenv( 'AXL_URL' )
+    address = address or os.getenv( 'CUCM_ADDRESS' )
+    return f'https://{address}:8443/axl/'
+
+
+def create_service( client, address = None ):
+    """Bind `client` to the AXL endpoint of CUCM_ADDRESS (or `address`), see service_url().
+
+    Without `address` and with AXL_READ_NODES set, reads are spread over those nodes
+    and writes still go to CUCM_ADDRESS, see endpoint_pool.py. Calls get deadlines
+    and retries from retry_policy.default_policy()."""
+    policy = default_policy()
+    if address is None and os.getenv( 'AXL_READ_NODES' ):
+        from endpoint_pool import create_pooled_service
+        return create_pooled_service( client, policy = policy )
+    service = client.create_service( BINDING_NAME, service_url( address ) )
+    return PolicyService( service, policy ) if policy else service
@@ -0,0 +1,128 @@
+"""Page through AXL list operations with skip/first.
+
+A listPhone/listLine/listDevicePool call without `first` makes CUCM build, and zeep
+parse, one response holding every match, which on a large cluster is hundreds of
+megabytes of XML in memory at once (and CUCM refuses it with "Query request too
+large" past its own limit). iter_list() asks for `page_size` records at a time and
+yields them as each page arrives, so memory stays at one or two pages however big
+the cluster is. While the caller works through a page the next one is already
+being fetched in the background.
+
+    for phone in iter_list( service, 'listPhone', { 'name': '%' }, { 'name': '', 'currentProfileName': '' } ):
+        ...
+
+Pages are separate requests, so a record added or removed during the walk can
+shift the ones after it into the next or previous page.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from zeep.exceptions import Fault
+
+PAGE_SIZE = int( os.getenv( 'AXL_PAGE_SIZE', 1000 ) )
+
+# "Query request too large. Total rows matched: 52113 rows. Suggestive Row Fetch: less than 26056 rows"
+TOO_LARGE_RE = re.compile( r'Query request too large', re.IGNORECASE )
+SUGGESTED_RE = re.compile( r'Suggestive Row Fetch: less than (\d+)', re.IGNORECASE )
+
+
+def list_element( operation ):
+    """listDevicePool -> devicePool, the element the records come back in."""
+    return operation[ 4 ].lower() + operation[ 5: ]
+
+
+def smaller_page( err, page_size ):
+    """Page size to retry with after CUCM rejected `page_size` rows as too large, or None."""
+    if not TOO_LARGE_RE.search( str( err.message ) ) or page_size <= 1:
+        return None
+    suggested = SUGGESTED_RE.search( str( err.message ) )
+    if suggested:
+        return max( 1, min( page_size // 2, int( suggested.group( 1 ) ) - 1 ) )
+    return page_size // 2
+
+
+class ListPager:
+    """Fetches the pages of one list operation. The page size shrinks when CUCM
+    says a page is too large and stays that way for the rest of the walk."""
+
+    def __init__( self, service, operation, search_criteria, returned_tags, page_size = PAGE_SIZE ):
+        self.service = service
+        self.operation = operation
+        self.search_criteria = search_criteria
+        self.returned_tags = returned_tags
+        self.page_size = page_size
+        self.pages = 0
+
+    def fetch( self, skip ):
+        """Records from `skip` on, at most one page of them."""
+        while True:
+            try:
+                resp = getattr( self.service, self.operation )( searchCriteria = self.search_criteria,
+                                                                 returnedTags = self.returned_tags,
+                                                                 skip = skip, first = self.page_size )
+            except Fault as err:
+                smaller = smaller_page( err, self.page_size )
+                if smaller is None:
+                    raise
+                self.page_size = smaller
+                continue
+            self.pages += 1
+            if resp[ 'return' ] is None:
+                return [ ]
+            return resp[ 'return' ][ list_element( self.operation ) ]
+
+
+def iter_pages( service, operation, search_criteria, returned_tags, page_size = PAGE_SIZE, prefetch = True ):
+    """Yield the matching records one page (a list) at a time."""
+    pager = ListPager( service, operation, search_criteria, returned_tags, page_size )
+    if not prefetch:
+        skip = 0
+        page = pager.fetch( 0 )
+        while page:
+            yield page
+            if len( page ) < pager.page_size:
+                return
+            skip += len( page )
+            page = pager.fetch( skip )
+        return
+
+    executor = ThreadPoolExecutor( max_workers = 1, thread_name_prefix = 'axl-list' )
+    try:
+        page = pager.fetch( 0 )
+        skip = len( page )
+        while True:
+            # a short page is the last one, otherwise start on the next before handing this one out
+            upcoming = executor.submit( pager.fetch, skip ) if len( page ) >= pager.page_size else None
+            if page:
+                yield page
+            if upcoming is None:
+                return
+            page = upcoming.result()
+            skip += len( page )
+    finally:
+        executor.shutdown( wait = True, cancel_futures = True )
+
+
+def iter_list( service, operation, search_criteria, returned_tags, page_size = PAGE_SIZE, prefetch = True ):
+    """Yield every record `operation` matches, fetching `page_size` records per request."""
+    for page in iter_pages( service, operation, search_criteria, returned_tags, page_size, prefetch ):
+        yield from page
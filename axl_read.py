@@ -0,0 +1,108 @@
+"""Minimal AXL reads for the migration flows.
+
+getDeviceProfile/getPhone/getUser return the whole object by default: every
+speed dial, BLF, service URL and the vendor config, all of it turned into zeep
+objects, while each flow only looks at a handful of fields. FLOWS declares per
+flow which tags it needs; read() asks CUCM for just those with returnedTags and
+hands back plain dicts (foreign keys such as devicePoolName flattened to their
+name), which can be passed straight back to addPhone/updatePhone.
+
+    profile = axl_read.read( service, 'migrate', 'getDeviceProfile', name = 'E12345_EM_8841' )
+    profile['lines']['line'][0]['dirn']['pattern']
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from zeep.helpers import serialize_object
+
+# Every line appearance field, so a line copied to the new CSF keeps its settings
+LINE = {
+    'index': None, 'label': None, 'display': None, 'displayAscii': None, 'e164Mask': None,
+    'dirn': { 'pattern': None, 'routePartitionName': None },
+    'ringSetting': None, 'consecutiveRingSetting': None, 'ringSettingIdlePickupAlert': None,
+    'ringSettingActivePickupAlert': None, 'mwlPolicy': None, 'maxNumCalls': None, 'busyTrigger': None,
+    'callInfoDisplay': None, 'recordingProfileName': None, 'recordingFlag': None, 'recordingMediaSource': None,
+    'monitoringCssName': None, 'audibleMwi': None, 'partitionUsage': None, 'missedCallLogging': None,
+    'associatedEndusers': None,
+}
+
+LOCALIZATION = { 'devicePoolName': None, 'locationName': None, 'mediaResourceListName': None, 'callingSearchSpaceName': None }
+
+# flow -> AXL operation -> the tags it reads, None for a leaf, a dict for nested tags
+FLOWS = {
+    # agent_migrator.py / bulk_agent_migrator.py: the EM profile the CSF is copied from
+    'migrate': {
+        'getDeviceProfile': { 'name': None, 'description': None, 'lines': { 'line': LINE } },
+    },
+    # cipc_to_csf.py: the CIPC the CSF is copied from
+    'cipc_to_csf': {
+        'getPhone': dict( LOCALIZATION, name = None, description = None, commonDeviceConfigName = None,
+                          networkHoldMohAudioSourceId = None, userHoldMohAudioSourceId = None, lines = { 'line': LINE } ),
+    },
+    # new_agent.py / onboarding.py: an existing agent CSF to copy localization and line layout from
+    'example_csf': {
+        'getPhone': dict( LOCALIZATION, lines = { 'line': { 'index': None, 'dirn': { 'pattern': None } } } ),
+    },
+    # every script that checks the agent's end user
+    'end_user': {
+        'getUser': { 'firstName': None, 'lastName': None, 'telephoneNumber': None, 'ldapDirectoryName': None },
+    },
+}
+
+# element inside <return> of each get operation
+RETURN_ELEMENTS = {
+    'getDeviceProfile': 'deviceProfile',
+    'getLine': 'line',
+    'getPhone': 'phone',
+    'getUser': 'user',
+}
+
+
+def returned_tags( spec ):
+    """FLOWS spec -> returnedTags argument, '' for every leaf."""
+    return { tag: '' if sub is None else returned_tags( sub ) for tag, sub in spec.items() }
+
+
+def to_record( value ):
+    """zeep response object -> plain dicts/lists. None values are dropped and foreign
+    keys ({ '_value_1': name, 'uuid': ... }) become just the name."""
+    if isinstance( value, dict ):
+        if '_value_1' in value and set( value ) <= { '_value_1', 'uuid' }:
+            return value[ '_value_1' ]
+        return { key: to_record( item ) for key, item in value.items() if item is not None }
+    if isinstance( value, list ):
+        return [ to_record( item ) for item in value ]
+    return value
+
+
+def read( service, flow, operation, **kwargs ):
+    """Run the get `operation` with the returnedTags `flow` needs, return a plain record."""
+    resp = getattr( service, operation )( returnedTags = returned_tags( FLOWS[ flow ][ operation ] ), **kwargs )
+    return to_record( serialize_object( resp[ 'return' ][ RETURN_ELEMENTS[ operation ] ], dict ) )
+
+
+async def read_async( service, flow, operation, **kwargs ):
+    """read() for the asyncio service of axl_async.py."""
+    resp = await getattr( service, operation )( returnedTags = returned_tags( FLOWS[ flow ][ operation ] ), **kwargs )
+    return to_record( serialize_object( resp[ 'return' ][ RETURN_ELEMENTS[ operation ] ], dict ) )
+
+
+def first_line( record ):
+    """First line appearance of a phone/profile record, or None."""
+    lines = ( record.get( 'lines' ) or { } ).get( 'line' ) or [ ]
+    return lines[0] if lines else None
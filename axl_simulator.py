@@ -0,0 +1,737 @@
+"""Local, stateful stand-in for the CUCM AXL API.
+
+Serves the bundled schema/AXLAPI.wsdl over plain HTTP with in-memory phones,
+device profiles, lines, end users, device pools and applicationuserdevicemap, so
+the scripts can be load tested without touching a real cluster. Latency,
+throttling (a concurrency limit answered with HTTP 503, like CUCM does) and
+random faults can be configured per operation. Like CUCM it hands out a
+JSESSIONIDSSO cookie, and --auth-latency makes requests that authenticate with
+credentials instead of the cookie that much slower.
+
+Run it, then point a script at it:
+
+    python3 axl_simulator.py --agents 10000 --write-agents "agent list.csv" --latency default=0.05 --latency addPhone=0.3
+    AXL_URL=http://127.0.0.1:8088/axl/ CUCM_ADDRESS=simulator python3 bulk_agent_migrator.py --workers 8 --rate 0
+
+Responses are built by zeep from the same compiled schema the scripts use.
+executeSQLQuery/executeSQLUpdate only understand the SQL the scripts send
+(app_users.py, prefetch.py, extension_mobility.py, dn_allocator.py), anything
+else gets a fault.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import csv
+import random
+import re
+import secrets
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+from lxml import etree
+from zeep.xsd import ComplexType
+
+import app_users
+import dn_allocator
+import extension_mobility
+import prefetch
+from axl_client import BINDING_NAME, create_client, create_session
+
+SOAP_ENV_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+AXL_NS = 'http://www.cisco.com/AXL/API/11.5'
+
+WRITE_PREFIXES = ( 'add', 'update', 'remove', 'do', 'executeSQLUpdate' )
+
+# 'quoted' values of an SQL statement, with '' as an escaped quote
+QUOTED_RE = re.compile( r"'((?:[^']|'')*)'" )
+
+LOGGED_IN_ERROR = 'Cannot delete a device profile that is currently logged in to a device'
+DUPLICATE_ERROR = 'Could not insert new row - duplicate value in a UNIQUE INDEX column (Unique Index:).'
+
+
+class AxlFault( Exception ):
+    """Turned into a SOAP fault by the simulator. `status` is the HTTP status."""
+
+    def __init__( self, message, code = 5007, status = 500 ):
+        super().__init__( message )
+        self.code = code
+        self.status = status
+
+
+def new_uuid():
+    return '{' + str( uuid.uuid4() ).upper() + '}'
+
+
+def fk_name( value ):
+    """Name of an XFkType value, which may be a plain string or { '_value_1', 'uuid' }."""
+    if isinstance( value, dict ):
+        return value.get( '_value_1' )
+    return value
+
+
+def as_list( value ):
+    if value is None:
+        return [ ]
+    return value if isinstance( value, list ) else [ value ]
+
+
+def like( pattern, value ):
+    """AXL searchCriteria match: case insensitive, % is a wildcard."""
+    regex = '.*'.join( re.escape( part ) for part in pattern.lower().split( '%' ) )
+    return re.fullmatch( regex, ( value or '' ).lower() ) is not None
+
+
+def to_dict( node ):
+    """Request XML as plain dicts/lists/strings. Attributes become keys, a leaf with
+    attributes becomes { '_value_1': text, ... } like zeep's XFkType values."""
+    children = [ child for child in node if isinstance( child.tag, str ) ]
+    attributes = { etree.QName( name ).localname: value for name, value in node.attrib.items() }
+    if not children:
+        if attributes:
+            return dict( attributes, _value_1 = node.text )
+        return node.text
+    result = dict( attributes )
+    for child in children:
+        name = etree.QName( child ).localname
+        value = to_dict( child )
+        if name in result:
+            if not isinstance( result[ name ], list ):
+                result[ name ] = [ result[ name ] ]
+            result[ name ].append( value )
+        else:
+            result[ name ] = value
+    return result
+
+
+def fit( xsd_type, value ):
+    """Drop whatever in `value` the response type `xsd_type` has no place for."""
+    if not isinstance( xsd_type, ComplexType ):
+        return fk_name( value ) if isinstance( value, dict ) else value
+    if not isinstance( value, dict ):
+        return value
+    known = dict( xsd_type.elements )
+    known.update( xsd_type.attributes )
+    fitted = { }
+    for key, item in value.items():
+        if key not in known or item is None:
+            continue
+        child_type = known[ key ].type
+        if isinstance( item, list ):
+            fitted[ key ] = [ fit( child_type, one ) for one in item ]
+        else:
+            fitted[ key ] = fit( child_type, item )
+    return fitted
+
+
+def returned( record, tags ):
+    """`record` limited to the requested returnedTags (always with its uuid), nested
+    tags such as lines/line/dirn included."""
+    if not tags or not isinstance( tags, dict ) or not isinstance( record, dict ):
+        return record
+    result = { key: value for key, value in record.items() if key == 'uuid' }
+    for key, sub in tags.items():
+        if key in record:
+            value = record[ key ]
+            result[ key ] = [ returned( item, sub ) for item in value ] if isinstance( value, list ) else returned( value, sub )
+    return result
+
+
+class AxlState:
+    """The simulated cluster. Names are looked up case insensitively. Every change
+    made through the API is queued for listChange, the last `change_queue` of them."""
+
+    def __init__( self, change_queue = 10000 ):
+        self.lock = threading.RLock()
+        self.phones = { }
+        self.profiles = { }
+        self.lines = { }
+        self.users = { }
+        self.names = { 'devicePool': { }, 'mediaResourceList': { }, 'css': { }, 'location': { } }
+        self.app_user_devices = { name: set() for name in app_users.APP_USERS }
+        self.app_user_uuids = { name: { 'uuid': new_uuid() } for name in app_users.APP_USERS }
+        # device name (lower) -> device profile name logged into it
+        self.em_logins = { }
+        self.queue_id = secrets.token_hex( 8 )
+        self.changes = deque( maxlen = change_queue )
+        self.next_change_id = 1
+
+    def changed( self, object_type, record, action, tags = ( ) ):
+        """Queue a listChange notification for `record` ('a'dded, 'u'pdated or 'r'emoved)."""
+        self.changes.append( { 'id': self.next_change_id, 'type': object_type, 'uuid': record[ 'uuid' ], 'action': action,
+                               'tags': { tag: record.get( tag ) for tag in tags } } )
+        self.next_change_id += 1
+
+    def add_name( self, kind, name ):
+        self.names[ kind ][ name.lower() ] = { 'uuid': new_uuid(), 'name': name }
+
+    def add_line( self, line ):
+        key = ( line[ 'pattern' ], ( fk_name( line.get( 'routePartitionName' ) ) or '' ).lower() )
+        if key in self.lines:
+            raise AxlFault( DUPLICATE_ERROR, code = -239 )
+        line = dict( line, uuid = new_uuid() )
+        self.lines[ key ] = line
+        self.changed( 'Line', line, 'a', line )
+        return line[ 'uuid' ]
+
+    def seed( self, agents, device_pools = 20, logged_in = 0.05, rng = None ):
+        """Create `agents` agents as they look before migration: a CIPC named after the
+        E#, an EM device profile with one line, and an LDAP synced end user. A share of
+        `logged_in` of the profiles is logged into a deskphone. Returns the E#s."""
+        rng = rng or random.Random( 0 )
+        with self.lock:
+            self.add_name( 'devicePool', 'Default' )
+            for n in range( device_pools ):
+                self.add_name( 'devicePool', f'DP_CC{ 1000 + n }' )
+                self.add_name( 'mediaResourceList', f'MRL_CC{ 1000 + n }' )
+                self.add_name( 'location', f'LOC_CC{ 1000 + n }' )
+            for name in ( 'MC_MRGL', 'Hub_None' ):
+                self.add_name( 'mediaResourceList' if name == 'MC_MRGL' else 'location', name )
+            self.add_name( 'css', '06_Device' )
+
+            enumbers = [ ]
+            for n in range( agents ):
+                enumber = f'e{ 100000 + n }'
+                name = enumber.capitalize()
+                pool = 1000 + rng.randrange( device_pools )
+                dn = str( 500000 + n )
+                extras = _device_extras( n )
+                line_uuid = self.add_line( { 'pattern': dn, 'routePartitionName': 'PCCE_DN_PT', 'description': name } )
+                lines = { 'line': [ { 'uuid': new_uuid(), 'index': '1', 'label': name, 'display': name, 'displayAscii': name,
+                                      'dirn': { 'pattern': dn, 'routePartitionName': 'PCCE_DN_PT', 'uuid': line_uuid },
+                                      'ringSetting': 'Use System Default', 'consecutiveRingSetting': 'Use System Default',
+                                      'e164Mask': '713555XXXX', 'mwlPolicy': 'Use System Policy', 'maxNumCalls': '2',
+                                      'busyTrigger': '1', 'recordingFlag': 'Call Recording Disabled',
+                                      'recordingMediaSource': 'Gateway Preferred', 'missedCallLogging': 'true' } ] }
+                self.phones[ name.lower() ] = {
+                    'uuid': new_uuid(), 'name': name, 'description': name + ' CIPC', 'product': 'Cisco IP Communicator',
+                    'model': 'Cisco IP Communicator', 'class': 'Phone', 'protocol': 'SCCP', 'protocolSide': 'User',
+                    'devicePoolName': f'DP_CC{ pool }', 'mediaResourceListName': f'MRL_CC{ pool }',
+                    'callingSearchSpaceName': '06_Device', 'locationName': f'LOC_CC{ pool }', 'ownerUserName': name,
+                    'lines': lines, **extras,
+                }
+                profile = name + rng.choice( prefetch.PROFILE_SUFFIXES )
+                self.profiles[ profile.lower() ] = {
+                    'uuid': new_uuid(), 'name': profile, 'description': 'Agent ' + name, 'product': 'Cisco 8841',
+                    'model': 'Cisco 8841', 'class': 'Device Profile', 'protocol': 'SIP', 'protocolSide': 'User',
+                    'lines': lines, **extras,
+                }
+                self.users[ enumber ] = {
+                    'uuid': new_uuid(), 'userid': name, 'firstName': 'Agent', 'lastName': name, 'telephoneNumber': dn,
+                    'ldapDirectoryName': 'Corp_LDAP', 'associatedDevices': { 'device': [ name ] },
+                }
+                if rng.random() < logged_in:
+                    deskphone = f'SEP{ 0x001122000000 + n:012X}'
+                    self.phones[ deskphone.lower() ] = {
+                        'uuid': new_uuid(), 'name': deskphone, 'description': 'Deskphone', 'product': 'Cisco 8841',
+                        'model': 'Cisco 8841', 'class': 'Phone', 'protocol': 'SIP', 'protocolSide': 'User',
+                        'devicePoolName': f'DP_CC{ pool }', 'currentProfileName': profile,
+                    }
+                    self.em_logins[ deskphone.lower() ] = profile
+                enumbers.append( enumber )
+            # the seed is what the cluster looked like before anyone started polling
+            self.changes.clear()
+        return enumbers
+
+
+def _device_extras( n ):
+    """What makes a real agent phone/profile big: speed dials, BLFs, services, settings."""
+    return {
+        'userHoldMohAudioSourceId': '1', 'networkHoldMohAudioSourceId': '1', 'commonDeviceConfigName': 'Agent_CDC',
+        'phoneTemplateName': 'Standard 8841 SIP', 'softkeyTemplateName': 'Agent Softkeys', 'userLocale': 'English United States',
+        'speeddials': { 'speeddial': [ { 'dirn': str( 7130000000 + n * 10 + i ), 'label': f'Speed dial { i }', 'index': str( i ) }
+                                       for i in range( 1, 11 ) ] },
+        'busyLampFields': { 'busyLampField': [ { 'blfDest': str( 600000 + i ), 'label': f'Supervisor { i }', 'index': str( i ) }
+                                               for i in range( 1, 7 ) ] },
+        'services': { 'service': [ { 'telecasterServiceName': service, 'name': service, 'urlButtonIndex': '0',
+                                     'url': f'http://cucm.example.com:8080/ccmcip/{ service.lower() }.jsp' }
+                                   for service in ( 'Directory', 'Extension Mobility', 'Voicemail', 'Corporate Directory' ) ] },
+    }
+
+
+class AxlSimulator:
+    """Answers AXL requests against an AxlState.
+
+    `latency` maps operation names (or 'default') to seconds, each call sleeps that
+    long +/- `jitter`. More than `max_concurrent` requests in flight are answered
+    with a 503 throttling fault, list pages of more than `max_list_rows` records with
+    CUCM's "Query request too large" fault; `fault_rate` maps operation names (or 'default') to
+    the probability of a random fault. Requests without a valid session cookie
+    take `auth_latency` seconds longer and get a new cookie. `slow_rate` maps
+    operation names (or 'default') to the probability that the answer is held back
+    `slow_seconds` after the operation ran, to make clients time out on calls that
+    did go through. `error_rate` maps operation names (or 'default') to the
+    probability of an HTTP 503 with an empty body before the operation runs, like
+    CUCM's web server answers while the AXL service restarts. A `subscriber` shares
+    the publisher's AxlState but answers writes with a fault."""
+
+    def __init__( self, state = None, latency = None, jitter = 0.2, max_concurrent = 0, fault_rate = None, seed = None,
+                  auth_latency = 0, max_list_rows = 0, subscriber = False, slow_rate = None, slow_seconds = 5, error_rate = None ):
+        self.state = state or AxlState()
+        self.subscriber = subscriber
+        self.slow_rate = slow_rate or { }
+        self.slow_seconds = slow_seconds
+        self.latency = latency or { }
+        self.jitter = jitter
+        self.max_concurrent = max_concurrent
+        self.fault_rate = fault_rate or { }
+        self.error_rate = error_rate or { }
+        self.calls = Counter()
+        self.faults = Counter()
+        self.throttled = 0
+        self.errors = 0
+        self.auth_latency = auth_latency
+        self.max_list_rows = max_list_rows
+        self.logins = 0
+        self._sessions = set()
+        self._random = random.Random( seed )
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._binding = create_client( session = create_session() ).wsdl.bindings[ BINDING_NAME ]
+
+    # request handling
+
+    def authenticate( self, headers ):
+        """Return ( authenticated, new session id or None ) for the request `headers`."""
+        cookies = dict( part.strip().split( '=', 1 ) for part in headers.get( 'Cookie', '' ).split( ';' ) if '=' in part )
+        if cookies.get( 'JSESSIONIDSSO' ) in self._sessions:
+            return True, None
+        if not headers.get( 'Authorization', '' ).startswith( 'Basic ' ):
+            return False, None
+        # the expensive backend check a session cookie skips
+        time.sleep( self.auth_latency )
+        session_id = secrets.token_hex( 16 ).upper()
+        with self._lock:
+            self.logins += 1
+            self._sessions.add( session_id )
+        return True, session_id
+
+    def handle( self, body ):
+        """Return ( HTTP status, response XML ) for the SOAP request `body`. The response
+        is empty for an `error_rate` error."""
+        operation = 'unknown'
+        with self._lock:
+            self._in_flight += 1
+            busy = self.max_concurrent and self._in_flight > self.max_concurrent
+        try:
+            request = etree.fromstring( body )
+            node = next( child for child in request.find( f'{{{SOAP_ENV_NS}}}Body' ) if isinstance( child.tag, str ) )
+            operation = etree.QName( node ).localname
+            self.calls[ operation ] += 1
+            if busy:
+                self.throttled += 1
+                raise AxlFault( 'AXL throttle: the maximum number of concurrent AXL requests has been exceeded, retry later',
+                                code = 503, status = 503 )
+            if self._random.random() < self.error_rate.get( operation, self.error_rate.get( 'default', 0 ) ):
+                with self._lock:
+                    self.errors += 1
+                return 503, b''
+            if self.subscriber and operation.startswith( WRITE_PREFIXES ):
+                raise AxlFault( f'{ operation } has to be sent to the publisher, this node is a subscriber', code = 5002 )
+            delay = self.latency.get( operation, self.latency.get( 'default', 0 ) )
+            if delay:
+                time.sleep( delay * self._random.uniform( 1 - self.jitter, 1 + self.jitter ) )
+            if self._random.random() < self.fault_rate.get( operation, self.fault_rate.get( 'default', 0 ) ):
+                raise AxlFault( f'Simulated fault in { operation }', code = 5000 )
+            response = self._respond( operation, to_dict( node ) or { } )
+            if self._random.random() < self.slow_rate.get( operation, self.slow_rate.get( 'default', 0 ) ):
+                time.sleep( self.slow_seconds )
+            return 200, response
+        except AxlFault as err:
+            self.faults[ operation ] += 1
+            return err.status, self._fault( operation, err )
+        except ( etree.XMLSyntaxError, StopIteration ) as err:
+            return 500, self._fault( operation, AxlFault( f'Invalid request: { err }', code = 5001 ) )
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _respond( self, operation, params ):
+        handler = getattr( self, 'op_' + operation, None )
+        if handler is None:
+            raise AxlFault( f'{ operation } is not implemented by the simulator', code = 5001 )
+        with self.state.lock:
+            result = handler( params )
+        if isinstance( result, bytes ):
+            return result
+        message = self._binding.get( operation ).output
+        return_type = dict( message.body.type.elements )[ 'return' ].type
+        envelope = message.serialize( **{ 'return': fit( return_type, result ) } ).content
+        return etree.tostring( envelope, xml_declaration = True, encoding = 'UTF-8' )
+
+    def _fault( self, operation, err ):
+        return ( '<?xml version="1.0" encoding="UTF-8"?>'
+                 f'<soapenv:Envelope xmlns:soapenv="{SOAP_ENV_NS}"><soapenv:Body><soapenv:Fault>'
+                 f'<faultcode>soapenv:{ "Server" if err.status == 503 else "Client" }</faultcode>'
+                 f'<faultstring>{ escape( str( err ) ) }</faultstring><detail><axlError>'
+                 f'<axlcode>{ err.code }</axlcode><axlmessage>{ escape( str( err ) ) }</axlmessage>'
+                 f'<request>{ operation }</request></axlError></detail>'
+                 '</soapenv:Fault></soapenv:Body></soapenv:Envelope>' ).encode()
+
+    # helpers for the operations
+
+    def _get( self, table, name, what, uuid = None ):
+        if uuid:
+            record = next( ( record for record in table.values() if record[ 'uuid' ].lower() == uuid.lower() ), None )
+        else:
+            record = table.get( ( name or '' ).lower() )
+        if record is None:
+            raise AxlFault( f'Item not valid: The specified { what } was not found' )
+        return record
+
+    def _list( self, records, params, fields = ( 'name', ) ):
+        criteria = params.get( 'searchCriteria' ) or { }
+        tags = params.get( 'returnedTags' )
+        matches = [ record for record in records
+                    if all( like( criteria[ field ], fk_name( record.get( field ) ) ) for field in fields if criteria.get( field ) ) ]
+        matches.sort( key = lambda record: ( record.get( 'name' ) or record.get( 'pattern' ) or '' ).lower() )
+        skip = int( params.get( 'skip' ) or 0 )
+        first = params.get( 'first' )
+        matches = matches[ skip: skip + int( first ) if first else None ]
+        if self.max_list_rows and len( matches ) > self.max_list_rows:
+            raise AxlFault( f'Query request too large. Total rows matched: { len( matches ) } rows. '
+                            f'Suggestive Row Fetch: less than { self.max_list_rows + 1 } rows' )
+        return [ returned( record, tags ) for record in matches ]
+
+    # AXL operations, params are the request children as plain dicts
+
+    def op_getPhone( self, params ):
+        phone = self._get( self.state.phones, params.get( 'name' ), 'Phone', params.get( 'uuid' ) )
+        return { 'phone': returned( phone, params.get( 'returnedTags' ) ) }
+
+    def op_getDeviceProfile( self, params ):
+        profile = self._get( self.state.profiles, params.get( 'name' ), 'Device Profile', params.get( 'uuid' ) )
+        return { 'deviceProfile': returned( profile, params.get( 'returnedTags' ) ) }
+
+    def op_getUser( self, params ):
+        user = self._get( self.state.users, params.get( 'userid' ), 'User', params.get( 'uuid' ) )
+        return { 'user': returned( user, params.get( 'returnedTags' ) ) }
+
+    def op_getLine( self, params ):
+        if params.get( 'uuid' ):
+            return { 'line': returned( self._get( self.state.lines, None, 'Line', params[ 'uuid' ] ), params.get( 'returnedTags' ) ) }
+        key = ( params.get( 'pattern' ), ( fk_name( params.get( 'routePartitionName' ) ) or '' ).lower() )
+        if key not in self.state.lines:
+            raise AxlFault( 'Item not valid: The specified Line was not found' )
+        return { 'line': returned( self.state.lines[ key ], params.get( 'returnedTags' ) ) }
+
+    def op_addPhone( self, params ):
+        phone = dict( params[ 'phone' ] )
+        if phone[ 'name' ].lower() in self.state.phones or phone[ 'name' ].lower() in self.state.profiles:
+            raise AxlFault( DUPLICATE_ERROR, code = -239 )
+        if fk_name( phone.get( 'devicePoolName' ) ).lower() not in self.state.names[ 'devicePool' ]:
+            raise AxlFault( 'Item not valid: The specified Device Pool was not found' )
+        phone[ 'uuid' ] = new_uuid()
+        self.state.phones[ phone[ 'name' ].lower() ] = phone
+        self.state.changed( 'Phone', phone, 'a', phone )
+        return phone[ 'uuid' ]
+
+    def op_addLine( self, params ):
+        return self.state.add_line( params[ 'line' ] )
+
+    def op_updatePhone( self, params ):
+        phone = self._get( self.state.phones, params.get( 'name' ), 'Phone' )
+        for key, value in params.items():
+            if key not in ( 'name', 'uuid', 'newName' ):
+                phone[ key ] = value
+        self.state.changed( 'Phone', phone, 'u', [ key for key in params if key not in ( 'name', 'uuid' ) ] )
+        return phone[ 'uuid' ]
+
+    def op_updateUser( self, params ):
+        user = self._get( self.state.users, params.get( 'userid' ), 'User' )
+        for key, value in params.items():
+            if key == 'associatedDevices':
+                value = { 'device': as_list( value.get( 'device' ) if isinstance( value, dict ) else value ) }
+            if key != 'userid':
+                user[ key ] = value
+        self.state.changed( 'User', user, 'u', [ key for key in params if key != 'userid' ] )
+        return user[ 'uuid' ]
+
+    def op_removePhone( self, params ):
+        phone = self._get( self.state.phones, params.get( 'name' ), 'Phone' )
+        del self.state.phones[ phone[ 'name' ].lower() ]
+        self.state.em_logins.pop( phone[ 'name' ].lower(), None )
+        for devices in self.state.app_user_devices.values():
+            devices.discard( phone[ 'name' ].lower() )
+        self.state.changed( 'Phone', phone, 'r' )
+        return phone[ 'uuid' ]
+
+    def op_removeLine( self, params ):
+        if params.get( 'uuid' ):
+            line = self._get( self.state.lines, None, 'Line', params[ 'uuid' ] )
+        else:
+            line = self.op_getLine( params )[ 'line' ]
+        del self.state.lines[ ( line[ 'pattern' ], ( fk_name( line.get( 'routePartitionName' ) ) or '' ).lower() ) ]
+        self.state.changed( 'Line', line, 'r' )
+        return line[ 'uuid' ]
+
+    def op_removeDeviceProfile( self, params ):
+        profile = self._get( self.state.profiles, params.get( 'name' ), 'Device Profile' )
+        if profile[ 'name' ] in self.state.em_logins.values():
+            raise AxlFault( LOGGED_IN_ERROR, code = 5003 )
+        del self.state.profiles[ profile[ 'name' ].lower() ]
+        self.state.changed( 'DeviceProfile', profile, 'r' )
+        return profile[ 'uuid' ]
+
+    def op_doDeviceLogout( self, params ):
+        phone = self._get( self.state.phones, params.get( 'deviceName' ), 'Device' )
+        self.state.em_logins.pop( phone[ 'name' ].lower(), None )
+        phone.pop( 'currentProfileName', None )
+        self.state.changed( 'Phone', phone, 'u', [ 'currentProfileName' ] )
+        return phone[ 'uuid' ]
+
+    def op_listPhone( self, params ):
+        return { 'phone': self._list( self.state.phones.values(), params, ( 'name', 'description', 'devicePoolName' ) ) }
+
+    def op_listDeviceProfile( self, params ):
+        return { 'deviceProfile': self._list( self.state.profiles.values(), params, ( 'name', 'description' ) ) }
+
+    def op_listUser( self, params ):
+        return { 'user': self._list( self.state.users.values(), params, ( 'userid', 'firstName', 'lastName' ) ) }
+
+    def op_listLine( self, params ):
+        return { 'line': self._list( self.state.lines.values(), params, ( 'pattern', 'description', 'routePartitionName' ) ) }
+
+    def op_listDevicePool( self, params ):
+        return { 'devicePool': self._list( self.state.names[ 'devicePool' ].values(), params ) }
+
+    def op_listMediaResourceList( self, params ):
+        return { 'mediaResourceList': self._list( self.state.names[ 'mediaResourceList' ].values(), params ) }
+
+    def op_listCss( self, params ):
+        return { 'css': self._list( self.state.names[ 'css' ].values(), params ) }
+
+    def op_listLocation( self, params ):
+        return { 'location': self._list( self.state.names[ 'location' ].values(), params ) }
+
+    def op_listChange( self, params ):
+        state = self.state
+        first = state.changes[0][ 'id' ] if state.changes else state.next_change_id
+        start = params.get( 'startChangeId' )
+        # no startChangeId (or one from another queue) just tells the client where the queue is
+        changes = [ ]
+        next_id = state.next_change_id
+        if isinstance( start, dict ) and start.get( 'queueId' ) == state.queue_id:
+            next_id = int( start[ '_value_1' ] )
+            changes = [ change for change in state.changes if change[ 'id' ] >= next_id ][ :1000 ]
+            if changes:
+                next_id = changes[-1][ 'id' ] + 1
+        message = self._binding.get( 'listChange' ).output
+        envelope = message.serialize(
+            queueInfo = { 'firstChangeId': first, 'lastChangeId': state.next_change_id - 1, 'nextStartChangeId': next_id,
+                          'queueId': state.queue_id },
+            changes = { 'change': [ {
+                'id': change[ 'id' ], 'action': change[ 'action' ], 'doGet': 'false', 'type': change[ 'type' ], 'uuid': change[ 'uuid' ],
+                'changedTags': { 'changedTag': [ { 'name': tag, '_value_1': value if isinstance( value, str ) else None }
+                                                 for tag, value in change[ 'tags' ].items() ] } } for change in changes ] } ).content
+        return etree.tostring( envelope, xml_declaration = True, encoding = 'UTF-8' )
+
+    # SQL, only the statements the scripts send
+
+    def op_executeSQLUpdate( self, params ):
+        sql = params.get( 'sql' ) or ''
+        if not _is( sql, app_users.INSERT_SQL ):
+            raise AxlFault( 'The simulator only runs the app user insert from app_users.py', code = -1 )
+        app_user, *devices = _quoted( sql )
+        mapped = self.state.app_user_devices.get( app_user )
+        if mapped is None:
+            return { 'rowsUpdated': 0 }
+        added = { device.lower() for device in devices if device.lower() in self.state.phones } - mapped
+        mapped |= added
+        if added:
+            self.state.changed( 'AppUser', self.state.app_user_uuids[ app_user ], 'u', [ 'associatedDevices' ] )
+        return { 'rowsUpdated': len( added ) }
+
+    def op_executeSQLQuery( self, params ):
+        sql = params.get( 'sql' ) or ''
+        values = [ value.lower() for value in _quoted( sql ) ]
+        state = self.state
+        if _is( sql, prefetch.USERS_SQL ):
+            rows = [ { 'userid': user[ 'userid' ], 'firstname': user.get( 'firstName' ), 'lastname': user.get( 'lastName' ),
+                       'telephonenumber': user.get( 'telephoneNumber' ), 'ldapdirectoryname': fk_name( user.get( 'ldapDirectoryName' ) ) }
+                     for user in map( state.users.get, values ) if user ]
+        elif _is( sql, prefetch.DEVICES_SQL ):
+            rows = [ { 'name': device[ 'name' ], 'devicepool': fk_name( device.get( 'devicePoolName' ) ),
+                       'mediaresourcelist': fk_name( device.get( 'mediaResourceListName' ) ),
+                       'callingsearchspace': fk_name( device.get( 'callingSearchSpaceName' ) ),
+                       'location': fk_name( device.get( 'locationName' ) ) }
+                     for device in ( state.phones.get( value ) or state.profiles.get( value ) for value in values ) if device ]
+        elif _is( sql, app_users.APP_USER_DEVICES_SQL ):
+            rows = [ { 'app_user': app_user, 'device': state.phones[ device ][ 'name' ] }
+                     for app_user, devices in state.app_user_devices.items() if app_user in values
+                     for device in devices if device in state.phones ]
+        elif _is( sql, app_users.MAPPED_SQL ):
+            rows = [ { 'app_user': app_user, 'device': state.phones[ device ][ 'name' ] }
+                     for app_user, devices in state.app_user_devices.items() if app_user in values
+                     for device in devices if device in values and device in state.phones ]
+        elif _is( sql, extension_mobility.LOGGED_IN_SQL ):
+            rows = [ { 'profile': profile, 'device': state.phones[ device ][ 'name' ] }
+                     for device, profile in state.em_logins.items() if profile.lower() in values ]
+        elif _is( sql, dn_allocator.EXISTING_SQL ):
+            rows = [ { 'dnorpattern': pattern } for pattern in sorted( { pattern for pattern, _ in state.lines } ) if pattern in values ]
+        else:
+            raise AxlFault( 'The simulator does not know this query', code = -1 )
+        return _sql_response( rows )
+
+
+@lru_cache( maxsize = None )
+def _template_re( template ):
+    return re.compile( re.sub( r'\\\{\w+\\\}', '.*', re.escape( ' '.join( template.split() ) ) ), re.DOTALL )
+
+
+def _is( sql, template ):
+    """True when `sql` was made from `template`, any text standing in for its {placeholders}."""
+    return _template_re( template ).fullmatch( ' '.join( sql.split() ) ) is not None
+
+
+def _quoted( sql ):
+    return [ value.replace( "''", "'" ) for value in QUOTED_RE.findall( sql ) ]
+
+
+def _sql_response( rows ):
+    # rows are xsd:any content, which zeep won't serialize from plain values
+    body = ''.join( '<row>' + ''.join( f'<{ column }>{ escape( value or "" ) }</{ column }>' for column, value in row.items() ) + '</row>'
+                    for row in rows )
+    return ( '<?xml version="1.0" encoding="UTF-8"?>'
+             f'<soapenv:Envelope xmlns:soapenv="{SOAP_ENV_NS}"><soapenv:Body>'
+             f'<ns:executeSQLQueryResponse xmlns:ns="{AXL_NS}"><return>{ body }</return></ns:executeSQLQueryResponse>'
+             '</soapenv:Body></soapenv:Envelope>' ).encode()
+
+
+class _Handler( BaseHTTPRequestHandler ):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out as separate writes, Nagle would hold the body back ~40 ms
+    disable_nagle_algorithm = True
+
+    def do_POST( self ):
+        body = self.rfile.read( int( self.headers.get( 'Content-Length', 0 ) ) )
+        authenticated, session_id = self.server.simulator.authenticate( self.headers )
+        if not authenticated:
+            self.send_response( 401 )
+            self.send_header( 'WWW-Authenticate', 'Basic realm="Cisco Web Services Realm"' )
+            self.send_header( 'Content-Length', '0' )
+            self.end_headers()
+            return
+        status, response = self.server.simulator.handle( body )
+        self.send_response( status )
+        if session_id:
+            # CUCM marks it Secure, the simulator is plain HTTP
+            self.send_header( 'Set-Cookie', f'JSESSIONIDSSO={ session_id }; Path=/; HttpOnly' )
+        if response:
+            self.send_header( 'Content-Type', 'text/xml; charset=utf-8' )
+        self.send_header( 'Content-Length', str( len( response ) ) )
+        self.end_headers()
+        self.wfile.write( response )
+
+    def log_message( self, format, *args ):
+        pass
+
+
+class _Server( ThreadingHTTPServer ):
+    daemon_threads = True
+    # the asyncio client opens hundreds of connections at once, the default backlog is 5
+    request_queue_size = 1024
+
+
+def serve( simulator, host = '127.0.0.1', port = 8088 ):
+    """Start serving `simulator` in a background thread, returns the server (call
+    .shutdown() to stop it). Its AXL URL is http://host:port/axl/."""
+    server = _Server( ( host, port ), _Handler )
+    server.simulator = simulator
+    threading.Thread( target = server.serve_forever, name = 'axl-simulator', daemon = True ).start()
+    return server
+
+
+def _per_operation( values, kind ):
+    """[ 'addPhone=0.3', 'default=0.05' ] -> { 'addPhone': 0.3, 'default': 0.05 }"""
+    result = { }
+    for value in values or [ ]:
+        operation, _, number = value.partition( '=' )
+        if not number:
+            raise argparse.ArgumentTypeError( f'{ kind } must look like operation=number, got { value }' )
+        result[ operation ] = float( number )
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description = 'Serve a simulated CUCM AXL API for offline load tests.' )
+    parser.add_argument( '--host', default = '127.0.0.1' )
+    parser.add_argument( '--port', type = int, default = 8088 )
+    parser.add_argument( '--agents', type = int, default = 100, help = 'number of agents to create (default: 100)' )
+    parser.add_argument( '--write-agents', metavar = 'CSV', help = 'write the E#s of the created agents to this CSV' )
+    parser.add_argument( '--latency', action = 'append', metavar = 'OP=SECONDS',
+                         help = 'response time of an operation, or default=SECONDS for all of them; repeatable' )
+    parser.add_argument( '--jitter', type = float, default = 0.2, help = 'latency varies by +/- this fraction (default: 0.2)' )
+    parser.add_argument( '--fault-rate', action = 'append', metavar = 'OP=P',
+                         help = 'probability of a random fault for an operation, or default=P; repeatable' )
+    parser.add_argument( '--error-rate', action = 'append', metavar = 'OP=P',
+                         help = 'probability of an HTTP 503 with an empty body for an operation, or default=P; repeatable' )
+    parser.add_argument( '--max-concurrent', type = int, default = 0,
+                         help = 'requests in flight before answering with 503 throttling faults, 0 for no limit' )
+    parser.add_argument( '--auth-latency', type = float, default = 0,
+                         help = 'extra seconds for requests that authenticate without a session cookie (default: 0)' )
+    parser.add_argument( '--max-list-rows', type = int, default = 0,
+                         help = 'largest list page answered, bigger ones get "Query request too large", 0 for no limit' )
+    parser.add_argument( '--logged-in', type = float, default = 0.05,
+                         help = 'share of device profiles logged into a deskphone (default: 0.05)' )
+    parser.add_argument( '--slow-rate', action = 'append', metavar = 'OP=P',
+                         help = 'probability that an operation runs but its answer comes --slow-seconds late, or default=P; repeatable' )
+    parser.add_argument( '--slow-seconds', type = float, default = 5, help = 'how late a --slow-rate answer comes (default: 5)' )
+    parser.add_argument( '--subscriber', action = 'append', metavar = 'PORT[=SECONDS]',
+                         help = 'also serve the same data as a subscriber node on PORT (writes get a fault), '
+                                'SECONDS slower per call than --latency; repeatable' )
+    args = parser.parse_args()
+
+    state = AxlState()
+    enumbers = state.seed( args.agents, logged_in = args.logged_in )
+    if args.write_agents:
+        with open( args.write_agents, 'w', newline = '' ) as f:
+            csv.writer( f ).writerows( [ enumber ] for enumber in enumbers )
+
+    simulator = AxlSimulator( state, latency = _per_operation( args.latency, 'latency' ), jitter = args.jitter,
+                              max_concurrent = args.max_concurrent, fault_rate = _per_operation( args.fault_rate, 'fault rate' ),
+                              auth_latency = args.auth_latency, max_list_rows = args.max_list_rows,
+                              slow_rate = _per_operation( args.slow_rate, 'slow rate' ), slow_seconds = args.slow_seconds,
+                              error_rate = _per_operation( args.error_rate, 'error rate' ) )
+    server = serve( simulator, args.host, args.port )
+    print( f'Simulating { args.agents } agents at http://{ args.host }:{ args.port }/axl/, Ctrl-C to stop' )
+    subscribers = [ ]
+    for value in args.subscriber or [ ]:
+        port, _, slower = value.partition( '=' )
+        latency = _per_operation( args.latency, 'latency' )
+        latency = { operation: seconds + float( slower or 0 ) for operation, seconds in dict( { 'default': 0 }, **latency ).items() }
+        subscribers.append( serve( AxlSimulator( state, latency = latency, jitter = args.jitter, max_concurrent = args.max_concurrent,
+                                                 auth_latency = args.auth_latency, max_list_rows = args.max_list_rows, subscriber = True ),
+                                   args.host, int( port ) ) )
+        print( f'Subscriber at http://{ args.host }:{ port }/axl/' )
+    try:
+        while True:
+            time.sleep( 3600 )
+    except KeyboardInterrupt:
+        server.shutdown()
+        for subscriber in subscribers:
+            subscriber.shutdown()
+    print( f'\n{ sum( simulator.calls.values() ) } requests, { sum( simulator.faults.values() ) } faults, '
+           f'{ simulator.throttled } throttled, { simulator.errors } empty 503s, { simulator.logins } logins' )
+    for operation, count in simulator.calls.most_common():
+        print( f'{ operation:<24}{ count:>8}{ simulator.faults[ operation ]:>8}' )
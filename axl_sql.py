@@ -0,0 +1,49 @@
+"""Helpers for the executeSQLQuery/executeSQLUpdate AXL operations.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+def quote( value ):
+    """Quote `value` as an Informix SQL string literal."""
+    return "'" + str( value ).replace( "'", "''" ) + "'"
+
+
+def in_list( values ):
+    """Comma separated, quoted values for an SQL `in ( ... )` clause."""
+    return ', '.join( quote( value ) for value in values )
+
+
+def chunks( values, size ):
+    """Split `values` into lists of at most `size` items."""
+    values = list( values )
+    return [ values[ i:i + size ] for i in range( 0, len( values ), size ) ]
+
+
+def rows( resp ):
+    """The rows of an executeSQLQuery response as a list of dicts.
+
+    Column names are the keys, empty columns come back as ''."""
+    if resp['return'] is None:
+        return [ ]
+    return [ { column.tag: column.text or '' for column in row } for row in resp['return']['row'] ]
+
+
+def query( service, sql ):
+    """Run `sql` with executeSQLQuery and return the rows, see rows()."""
+    return rows( service.executeSQLQuery( sql ) )
@@ -0,0 +1,169 @@
+"""Migrating agents with threads vs asyncio (axl_async.py).
+
+Runs the migration write path (read the EM profile and the CIPC, addPhone,
+updateUser, the two app user inserts) for --agents agents, with N agents in
+flight at a time:
+
+  threads    the zeep client of axl_client.py, one thread per agent in flight
+  asyncio    axl_async.migrate_agents(), one event loop in one thread
+
+Each run gets a fresh axl_simulator.py (seeded with the same agents, with
+--latency seconds per call) and its own process, so wall time, client CPU and
+memory are measured for that run alone. Memory is how much the process grew
+while migrating, past the loaded client.
+
+    python3 benchmarks/async_io.py --agents 500 --concurrency 16 64 256
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+sys.path.insert( 0, ROOT )
+
+from zeep.exceptions import Fault
+
+import axl_client
+import axl_sql
+from app_users import APP_USERS, INSERT_SQL
+from axl_read import read
+from prefetch import PROFILE_SUFFIXES, csf_placement, lookup_cipc
+
+
+def rss_kib():
+    """Resident set size of this process in KiB, from /proc (Linux only)."""
+    with open( '/proc/self/statm' ) as f:
+        return int( f.read().split()[1] ) * os.sysconf( 'SC_PAGE_SIZE' ) // 1024
+
+
+def migrate_threaded( service, enumber ):
+    """The steps of axl_async.migrate_agent(), one call after the other."""
+    from axl_async import csf_phone
+    for suffix in PROFILE_SUFFIXES:
+        try:
+            profile_name = enumber.capitalize() + suffix
+            profile = read( service, 'migrate', 'getDeviceProfile', name = profile_name )
+            break
+        except Fault:
+            continue
+    else:
+        return False
+    cipc = lookup_cipc( service, enumber.capitalize() )
+    device_name = 'CSF' + enumber.capitalize()
+    service.addPhone( csf_phone( device_name, enumber.capitalize(), profile.get( 'description' ), profile.get( 'lines' ), csf_placement( cipc ) ) )
+    service.updateUser( userid = enumber.capitalize(), associatedDevices = device_name, imAndPresenceEnable = False )
+    for app_user in APP_USERS:
+        service.executeSQLUpdate( INSERT_SQL.format( app_user = axl_sql.quote( app_user ), devices = axl_sql.quote( device_name ) ) )
+    return True
+
+
+def run_threads( agents, concurrency ):
+    service = axl_client.create_service( axl_client.create_client( session = axl_client.create_session( pool_size = concurrency ) ) )
+    before = rss_kib()
+    peak = [ before ]
+    with ThreadPoolExecutor( max_workers = concurrency ) as pool:
+        def one( enumber ):
+            ok = migrate_threaded( service, enumber )
+            peak[0] = max( peak[0], rss_kib() )
+            return ok
+        results = list( pool.map( one, agents ) )
+        threads = threading.active_count()
+    return sum( results ), peak[0] - before, threads
+
+
+def run_asyncio( agents, concurrency ):
+    from axl_async import AsyncLimitedService, create_async_client, create_async_service, migrate_agent
+
+    async def main():
+        client = create_async_client( max_connections = concurrency )
+        service = AsyncLimitedService( create_async_service( client ), max_in_flight = concurrency )
+        before = rss_kib()
+        peak = [ before ]
+        slots = asyncio.Semaphore( concurrency )
+
+        async def one( enumber ):
+            async with slots:
+                result = await migrate_agent( service, enumber )
+            peak[0] = max( peak[0], rss_kib() )
+            return result[ 'status' ] == 'ok'
+
+        results = await asyncio.gather( *[ one( enumber ) for enumber in agents ] )
+        await client.transport.aclose()
+        return sum( results ), peak[0] - before, threading.active_count()
+
+    return asyncio.run( main() )
+
+
+def child( args ):
+    """One run in this process, prints its numbers as a JSON line."""
+    agents = [ f'e{ 100000 + n }' for n in range( args.agents ) ]
+    runner = run_threads if args.child == 'threads' else run_asyncio
+    # the first call compiles/loads the schema, keep that out of the numbers
+    axl_client.compile_wsdl()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    ok, memory, threads = runner( agents, args.concurrency[0] )
+    print( json.dumps( { 'ok': ok, 'wall': time.perf_counter() - wall, 'cpu': time.process_time() - cpu,
+                         'memory': memory, 'threads': threads } ) )
+
+
+def wait_for( port, timeout = 30 ):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection( ( '127.0.0.1', port ), timeout = 1 ).close()
+            return
+        except OSError:
+            time.sleep( 0.1 )
+    raise SystemExit( 'simulator did not start' )
+
+
+def measure( mode, concurrency, args ):
+    with socket.socket() as probe:
+        probe.bind( ( '127.0.0.1', 0 ) )
+        port = probe.getsockname()[1]
+    simulator = subprocess.Popen( [ sys.executable, os.path.join( ROOT, 'axl_simulator.py' ), '--port', str( port ),
+                                    '--agents', str( args.agents ), '--latency', f'default={ args.latency }',
+                                    '--logged-in', '0' ], stdout = subprocess.DEVNULL )
+    try:
+        wait_for( port )
+        env = dict( os.environ, AXL_URL = f'http://127.0.0.1:{ port }/axl/', AXL_SESSION_CACHE = '0' )
+        env.setdefault( 'AXL_USERNAME', 'axl' )
+        env.setdefault( 'AXL_PASSWORD', 'secret' )
+        out = subprocess.run( [ sys.executable, os.path.abspath( __file__ ), '--child', mode, '--agents', str( args.agents ),
+                                '--concurrency', str( concurrency ) ], env = env, capture_output = True, text = True, check = True )
+        run = json.loads( out.stdout.strip().splitlines()[-1] )
+    finally:
+        simulator.terminate()
+        simulator.wait()
+    print( f'{ mode:<10}{ concurrency:>10}{ run["ok"]:>6}{ run["wall"]:>9.2f}{ args.agents / run["wall"]:>12.1f}'
+           f'{ run["cpu"] / args.agents * 1000:>9.2f}{ run["memory"] / 1024:>10.1f}{ run["threads"]:>9}' )
+
+
+def main():
+    parser = argparse.ArgumentParser( description = __doc__.splitlines()[0] )
+    parser.add_argument( '--agents', type = int, default = 500 )
+    parser.add_argument( '--concurrency', type = int, nargs = '+', default = [ 16, 64, 256 ],
+                         help = 'agents in flight at a time, one run per value (default: 16 64 256)' )
+    parser.add_argument( '--latency', type = float, default = 0.05, help = 'seconds per AXL call in the simulator (default: 0.05)' )
+    parser.add_argument( '--child', choices = ( 'threads', 'asyncio' ), help = argparse.SUPPRESS )
+    args = parser.parse_args()
+    if args.child:
+        return child( args )
+
+    print( f'{"mode":<10}{"in flight":>10}{"ok":>6}{"wall s":>9}{"agents/s":>12}{"CPU ms":>9}{"MiB":>10}{"threads":>9}' )
+    for concurrency in args.concurrency:
+        for mode in ( 'threads', 'asyncio' ):
+            measure( mode, concurrency, args )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Time until the operator gets an answer, the scripts vs migrator.py.
+
+Starts each command in a fresh interpreter `--runs` times and prints the best
+wall time, and how many modules it imported (python3 -X importtime). The
+commands only print their help or check their input, nothing talks to CUCM.
+
+    python3 benchmarks/cli_startup.py --runs 10
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+
+def measure( command, runs ):
+    best = None
+    for _ in range( runs ):
+        started = time.perf_counter()
+        subprocess.run( [ sys.executable ] + command, cwd = ROOT, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL )
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min( best, elapsed )
+    imports = subprocess.run( [ sys.executable, '-X', 'importtime' ] + command, cwd = ROOT, stdout = subprocess.DEVNULL,
+                              stderr = subprocess.PIPE, text = True ).stderr
+    return best, sum( line.startswith( 'import time:' ) for line in imports.splitlines() ) - 1
+
+
+def main():
+    parser = argparse.ArgumentParser( description = __doc__.splitlines()[0] )
+    parser.add_argument( '--runs', type = int, default = 10 )
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile( 'w', suffix = '.csv', delete = False ) as csvfile:
+        csvfile.writelines( f'e{ 100000 + n }\n' for n in range( 1000 ) )
+    try:
+        cases = [
+            ( 'python startup', [ '-c', 'pass' ] ),
+            ( 'bulk --help', [ 'bulk_agent_migrator.py', '--help' ] ),
+            ( 'bulk --help', [ 'migrator.py', 'bulk-migrate', '--help' ] ),
+            ( 'new-agent --help', [ 'new_agent.py', '--help' ] ),
+            ( 'new-agent --help', [ 'migrator.py', 'new-agent', '--help' ] ),
+            ( 'migrator --help', [ 'migrator.py', '--help' ] ),
+            ( 'bulk --dry-run', [ 'migrator.py', 'bulk-migrate', '--csv', csvfile.name, '--dry-run', '--journal', os.devnull ] ),
+            ( 'missing CSV', [ 'migrator.py', 'bulk-migrate', '--csv', 'no such file.csv' ] ),
+        ]
+        print( f'{"command":<20}{"entry point":<26}{"best ms":>10}{"modules":>10}' )
+        for label, command in cases:
+            best, modules = measure( command, args.runs )
+            entry = command[0] if command[0].endswith( '.py' ) else 'python3 -c'
+            print( f'{ label:<20}{ entry:<26}{ best * 1000:>10.1f}{ modules:>10}' )
+    finally:
+        os.remove( csvfile.name )
+
+
+if __name__ == '__main__':
+    main()
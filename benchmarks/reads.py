@@ -0,0 +1,118 @@
+"""Bytes on the wire and client CPU per agent, full get* reads vs axl_read.
+
+Reads what one migration needs for each agent (the EM profile, the end user and
+the CIPC) twice: with the full getDeviceProfile/getUser/getPhone responses the
+scripts used to ask for, and through axl_read.read() with the returnedTags of
+each flow. axl_simulator.py runs in a separate process so the CPU time measured
+here is only the client's: building the request, parsing the response and
+turning it into objects.
+
+    python3 benchmarks/reads.py --agents 200
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+sys.path.insert( 0, ROOT )
+
+from zeep.exceptions import Fault
+from zeep.helpers import serialize_object
+
+import axl_client
+from axl_read import read
+from prefetch import PROFILE_SUFFIXES
+from tracing import TracingPlugin
+
+
+def profile_name( service, enumber ):
+    """The seeded profiles end in _EM_8841 or _EM_8851, find out which one once."""
+    for suffix in PROFILE_SUFFIXES:
+        try:
+            service.getDeviceProfile( name = enumber.capitalize() + suffix, returnedTags = { 'name': '' } )
+            return enumber.capitalize() + suffix
+        except Fault:
+            pass
+    raise SystemExit( 'no EM profile for ' + enumber )
+
+
+def full_reads( service, enumber, profile_name ):
+    profile = serialize_object( service.getDeviceProfile( name = profile_name )[ 'return' ][ 'deviceProfile' ], dict )
+    user = serialize_object( service.getUser( userid = enumber.capitalize() )[ 'return' ][ 'user' ], dict )
+    phone = serialize_object( service.getPhone( name = enumber.upper() )[ 'return' ][ 'phone' ], dict )
+    return profile, user, phone
+
+
+def minimal_reads( service, enumber, profile_name ):
+    profile = read( service, 'migrate', 'getDeviceProfile', name = profile_name )
+    user = read( service, 'end_user', 'getUser', userid = enumber.capitalize() )
+    phone = read( service, 'cipc_to_csf', 'getPhone', name = enumber.upper() )
+    return profile, user, phone
+
+
+def measure( label, reads, service, tracer, agents ):
+    tracer.records.clear()
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    for enumber, profile_name in agents:
+        reads( service, enumber, profile_name )
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    received = sum( record.response_bytes or 0 for record in tracer.records )
+    sent = sum( record.request_bytes or 0 for record in tracer.records )
+    print( f'{label:<16}{received / len( agents ) / 1024:>12.1f}{sent / len( agents ) / 1024:>10.1f}'
+           f'{cpu / len( agents ) * 1000:>12.2f}{wall / len( agents ) * 1000:>12.2f}' )
+    return received, cpu
+
+
+def wait_for( port, timeout = 30 ):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection( ( '127.0.0.1', port ), timeout = 1 ).close()
+            return
+        except OSError:
+            time.sleep( 0.1 )
+    raise SystemExit( 'simulator did not start' )
+
+
+def main():
+    parser = argparse.ArgumentParser( description = __doc__.splitlines()[0] )
+    parser.add_argument( '--agents', type = int, default = 200 )
+    args = parser.parse_args()
+
+    with socket.socket() as probe:
+        probe.bind( ( '127.0.0.1', 0 ) )
+        port = probe.getsockname()[1]
+    simulator = subprocess.Popen( [ sys.executable, os.path.join( ROOT, 'axl_simulator.py' ), '--port', str( port ),
+                                    '--agents', str( args.agents ), '--latency', 'default=0', '--jitter', '0',
+                                    '--logged-in', '0' ], stdout = subprocess.DEVNULL )
+    try:
+        wait_for( port )
+        os.environ[ 'AXL_URL' ] = f'http://127.0.0.1:{ port }/axl/'
+        os.environ.setdefault( 'AXL_USERNAME', 'axl' )
+        os.environ.setdefault( 'AXL_PASSWORD', 'secret' )
+        os.environ[ 'AXL_SESSION_CACHE' ] = '0'
+        tracer = TracingPlugin( maxlen = args.agents * 3 )
+        service = axl_client.create_service( axl_client.create_client( tracer = tracer, session = axl_client.create_session() ) )
+        agents = [ ( enumber, profile_name( service, enumber ) ) for enumber in ( f'e{ 100000 + n }' for n in range( args.agents ) ) ]
+        # warm up the connection, the session cookie and zeep's type caches
+        minimal_reads( service, *agents[0] )
+        full_reads( service, *agents[0] )
+
+        print( f'{"per agent":<16}{"KiB in":>12}{"KiB out":>10}{"CPU ms":>12}{"wall ms":>12}' )
+        before_bytes, before_cpu = measure( 'full get*', full_reads, service, tracer, agents )
+        after_bytes, after_cpu = measure( 'axl_read', minimal_reads, service, tracer, agents )
+        print( f'\nreturnedTags cut response bytes by { 1 - after_bytes / before_bytes:.0%} '
+               f'and client CPU by { 1 - after_cpu / before_cpu:.0%}' )
+    finally:
+        simulator.terminate()
+        simulator.wait()
+
+
+if __name__ == '__main__':
+    main()
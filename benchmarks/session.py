@@ -0,0 +1,102 @@
+"""Per-call AXL latency with and without session reuse.
+
+Runs the same cheap read (listDevicePool, first=1) three ways:
+
+  new session per call    a fresh connection and full authentication every call
+  keep-alive, basic auth  one pooled connection, credentials checked every call
+  keep-alive + cookie     what create_session() does: pooled connection, CUCM
+                          session cookie after the first call
+
+By default against axl_simulator.py started in-process with --auth-latency (the
+backend authentication cost CUCM skips for a valid session cookie). Pass --real
+to measure against the CUCM in .env instead (or AXL_URL).
+
+    python3 benchmarks/session.py --calls 50 --auth-latency 0.15
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from requests.auth import HTTPBasicAuth
+
+import axl_client
+
+
+def measure( label, service_for_call, calls ):
+    latencies = [ ]
+    for _ in range( calls ):
+        service = service_for_call()
+        start = time.perf_counter()
+        service.listDevicePool( searchCriteria = { 'name': '%' }, returnedTags = { 'name': '' }, first = 1 )
+        latencies.append( time.perf_counter() - start )
+    latencies.sort()
+    print( f'{label:<26}{statistics.median( latencies ) * 1000:>9.1f}{latencies[ int( len( latencies ) * 0.95 ) - 1 ] * 1000:>9.1f}' )
+    return statistics.median( latencies )
+
+
+def main():
+    parser = argparse.ArgumentParser( description = __doc__.splitlines()[0] )
+    parser.add_argument( '--calls', type = int, default = 50 )
+    parser.add_argument( '--auth-latency', type = float, default = 0.15, help = 'simulated authentication cost in seconds (default: 0.15)' )
+    parser.add_argument( '--latency', type = float, default = 0.01, help = 'simulated listDevicePool time in seconds (default: 0.01)' )
+    parser.add_argument( '--real', action = 'store_true', help = 'measure against the CUCM from the environment' )
+    args = parser.parse_args()
+
+    if not args.real:
+        import axl_simulator
+        state = axl_simulator.AxlState()
+        state.seed( 10 )
+        simulator = axl_simulator.AxlSimulator( state, latency = { 'default': args.latency }, jitter = 0,
+                                                auth_latency = args.auth_latency )
+        server = axl_simulator.serve( simulator, port = 0 )
+        os.environ[ 'AXL_URL' ] = f'http://127.0.0.1:{ server.server_address[1] }/axl/'
+        os.environ.setdefault( 'AXL_USERNAME', 'axl' )
+        os.environ.setdefault( 'AXL_PASSWORD', 'secret' )
+    else:
+        from dotenv import load_dotenv
+        load_dotenv()
+
+    # keep the real session cache out of this
+    os.environ[ 'AXL_SESSION_CACHE' ] = '0'
+    client = axl_client.create_client( session = axl_client.create_session() )
+    auth = HTTPBasicAuth( os.getenv( 'AXL_USERNAME' ), os.getenv( 'AXL_PASSWORD' ) )
+
+    def fresh_session():
+        session = axl_client.create_session()
+        session.auth = auth
+        client.transport.session = session
+        return axl_client.create_service( client )
+
+    basic = axl_client.create_session()
+    basic.auth = auth
+
+    def keep_alive_basic():
+        # no cookie, so every call authenticates
+        basic.cookies.clear()
+        client.transport.session = basic
+        return axl_client.create_service( client )
+
+    reused = axl_client.create_session()
+    reused_service = None
+
+    def keep_alive_cookie():
+        nonlocal reused_service
+        if reused_service is None:
+            client.transport.session = reused
+            reused_service = axl_client.create_service( client )
+        return reused_service
+
+    print( f'{"":<26}{"p50 ms":>9}{"p95 ms":>9}' )
+    before = measure( 'new session per call', fresh_session, args.calls )
+    measure( 'keep-alive, basic auth', keep_alive_basic, args.calls )
+    after = measure( 'keep-alive + cookie', keep_alive_cookie, args.calls )
+    print( f'\nsession reuse makes a call {before / after:.1f}x faster (p50)' )
+
+
+if __name__ == '__main__':
+    main()
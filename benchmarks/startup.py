@@ -0,0 +1,55 @@
+"""Startup benchmark for the AXL client factory.
+
+Compares building the zeep Client from the full WSDL against a cold start (compiling
+the trimmed schema into an empty cache) and a warm start (loading the cached copy).
+No CUCM is needed, nothing is sent over the network.
+
+    python3 benchmarks/startup.py
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+import axl_client
+
+
+def timed( label, func, runs ):
+    best = None
+    for _ in range( runs ):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min( best, elapsed )
+    print( f'{label:<28}{best * 1000:>10.1f} ms' )
+    return best
+
+
+def main():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        def full():
+            axl_client.create_client( operations = None )
+
+        def cold():
+            shutil.rmtree( cache_dir, ignore_errors = True )
+            axl_client.create_client( cache_dir = cache_dir )
+
+        def warm():
+            axl_client.create_client( cache_dir = cache_dir )
+
+        print( f'{"":<28}{"best of 3":>13}' )
+        full_time = timed( 'full WSDL (no cache)', full, 3 )
+        timed( 'cold start (compile)', cold, 3 )
+        warm_time = timed( 'warm start (cached)', warm, 3 )
+        print( f'\nwarm start is {full_time / warm_time:.0f}x faster than parsing the full WSDL' )
+    finally:
+        shutil.rmtree( cache_dir, ignore_errors = True )
+
+
+if __name__ == '__main__':
+    main()
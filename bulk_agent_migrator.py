@@ -1,6 +1,22 @@
 """This script does the same actions as agent_migrator, but takes the input 
 from the "agent list.csv" file instead of providing the info by input.
 
+The EM profile and CIPC of every agent are read first, then each CSF is created
+already in its final device pool, MRL and CSS with a single addPhone.
+
+By default agents are migrated one after another. Use --workers to migrate several
+agents at once; each agent's steps still run in order. How many AXL requests are
+in flight adapts to CUCM: it grows while responses stay fast and is cut when CUCM
+throttles (see throttle.py), --max-in-flight is the ceiling and --rate an optional
+hard cap on requests per second.
+--app-user-batch N associates pguser/zoomjtapi for N agents at a time with a
+single SQL insert per application user instead of two inserts per agent.
+The old CIPCs and EM profiles are deleted after all agents are migrated, in a
+cleanup phase of their own (see cleanup.py); --no-cleanup leaves them for a
+later `python3 cleanup.py`.
+
+    python3 bulk_agent_migrator.py --workers 8 --results "bulk results.csv"
+
 Copyright (c) 2022 Cisco and/or its affiliates.
 Permission is hereby granted, free of charge, to any person obtaining a copy
 of this software and associated documentation files (the "Software"), to deal
@@ -22,324 +38,421 @@ SOFTWARE.
 import csv
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from traceback import print_tb
 from lxml import etree
-from requests import Session
-from zeep.cache import SqliteCache
-from requests.auth import HTTPBasicAuth
-from zeep.plugins import HistoryPlugin
-from zeep import Client, Settings, Plugin, xsd
-from zeep.transports import Transport
+from zeep import xsd
 from zeep.exceptions import Fault
-from urllib3 import disable_warnings
-from urllib3.exceptions import InsecureRequestWarning
+from axl_client import create_client, create_service, create_session
+from tracing import create_tracer
+from metrics import AxlMetrics
+from catalog import load_catalog, select_device_pool
+from app_users import APP_USERS, INSERT_SQL, associate_devices, mapped_devices
+from axl_read import read
+from axl_sql import quote
+from cleanup import RETIRE_STEP, retired, run_cleanup, summary
+from prefetch import PROFILE_SUFFIXES, csf_placement, lookup_cipc, prefetch_agents, read_agents
+from mirror import open_mirror
+from throttle import AdaptiveService, AimdController, RateLimiter, RateLimitedService
+from journal import MigrationJournal
+from migrator import script_parser
+from endpoint_pool import PooledService
+from retry_policy import default_policy
 
 # Edit .env file to specify your Webex site/user details
 from dotenv import load_dotenv
 load_dotenv()
 
-# The WSDL is a local file
-WSDL_FILE = 'schema/AXLAPI.wsdl'
+#the options are defined in migrator.py, which checks them before anything heavy is loaded
+args = script_parser( 'bulk-migrate' ).parse_args()
 
-# Change to true to enable output of request/response headers and XML
+# Change to true to also save the request/response XML of every AXL call to the trace file
 DEBUG = False
 
-# If you have a pem file certificate for CUCM, uncomment and define it here
-
-#CERT = 'some.pem'
-
-# These values should work with a DevNet sandbox
-# You may need to change them if you are working with your own CUCM server
-
-
-disable_warnings(InsecureRequestWarning)
- 
-
-# This class lets you view the incoming and outgoing http headers and/or XML
-class MyLoggingPlugin( Plugin ):
-
-    def egress( self, envelope, http_headers, operation, binding_options ):
-
-        # Format the request body as pretty printed XML
-        xml = etree.tostring( envelope, pretty_print = True, encoding = 'unicode')
-
-        print( f'\nRequest\n-------\nHeaders:\n{http_headers}\n\nBody:\n{xml}' )
-
-    def ingress( self, envelope, http_headers, operation ):
-
-        # Format the response body as pretty printed XML
-        xml = etree.tostring( envelope, pretty_print = True, encoding = 'unicode')
-
-        print( f'\nResponse\n-------\nHeaders:\n{http_headers}\n\nBody:\n{xml}' )
-
-session = Session()
-
-# We avoid certificate verification by default, but you can uncomment and set
-# your certificate here, and comment out the False setting
-
-#session.verify = CERT
-session.verify = False
-session.auth = HTTPBasicAuth( os.getenv( 'AXL_USERNAME' ), os.getenv( 'AXL_PASSWORD' ) )
-
-# Create a Zeep transport and set a reasonable timeout value
-transport = Transport( session = session, timeout = 10 )
-
-# strict=False is not always necessary, but it allows zeep to parse imperfect XML
-settings = Settings( strict=False, xml_huge_tree=True )
-
-# If debug output is requested, add the MyLoggingPlugin callback
-plugin = [ MyLoggingPlugin() ] if DEBUG else [ ]
-
-# Create the Zeep client with the specified settings
-client = Client( WSDL_FILE, settings = settings, transport = transport,
-        plugins = plugin )
-history = HistoryPlugin()
-# service = client.create_service("{http://www.cisco.com/AXLAPIService/}AXLAPIBinding", CUCM_URL)
-service = client.create_service( '{http://www.cisco.com/AXLAPIService/}AXLAPIBinding',
-                                f'https://{os.getenv( "CUCM_ADDRESS" )}:8443/axl/' )
+# Records timing, size and fault code of every AXL call (written to AXL_TRACE_FILE as
+# JSON lines in the background), show_history() prints the last request/response
+history = create_tracer( debug = DEBUG )
+metrics = AxlMetrics( history )
+
+# Create the Zeep client from the cached, pre-compiled AXL schema (see axl_client.py)
+client = create_client( tracer = history, session = create_session( pool_size = args.workers ) )
+#requests in flight adapt to CUCM's throttling, see throttle.py
+controller = AimdController( maximum = args.max_in_flight ) if args.max_in_flight else None
+service = create_service( client )
+#with AXL_READ_NODES set reads are spread over those nodes, see endpoint_pool.py
+nodes = service.pool if isinstance( service, PooledService ) else None
+if controller:
+    service = AdaptiveService( service, controller )
+service = RateLimitedService( service, RateLimiter( args.rate ) )
+
+#answer lookups from the local CUCM mirror when AXL_MIRROR=1 is set, see mirror.py
+mirror = open_mirror( service )
 
 #should output any errors coming from cucm while interacting with the program
 def show_history():
      for hist in [history.last_sent, history.last_received]:
-         print(etree.tostring(hist["envelope"], encoding='unicode', pretty_print=True))
+         if hist:
+             print(etree.tostring(hist["envelope"], encoding='unicode', pretty_print=True))
 
-#retrieve list of all device pools from cucm.
+#retrieve list of all device pools from cucm (cached between runs, see catalog.py).
 #if user input is blank, try to use the soft phone settings.
 #if exact match for dp is found in the list gathered, use that
 #otherwise try to find a match in the list and give user a list to chose from
 
 call_center = input("Enter Cost Center or Device Pool to use for this list of Agents:")
 
-search_again = True
 search_successful = False
 
 try:
     if call_center == "":
         print("No DP given, resorting to CIPC settings.")
     else:
-        device_pool_list = service.listDevicePool(searchCriteria = { 'name': '%' }, returnedTags = { 'name': ''})
-        device_pool_list_names = device_pool_list['return']['devicePool']
-        try:
-            for dp_index_num, dp_data in enumerate(device_pool_list_names):
-                if call_center == dp_data['name']:
-                    print('Found Call Centers match' + dp_data['name'])
-                    dp = dp_data['name']
-                    search_again = False
-                    search_successful = True
-        except:
-            print('The search failed.')
-        if search_again == True:
-            for dp_index_num, dp_data in enumerate(device_pool_list_names):
-                if call_center in dp_data['name']:
-                    print(dp_index_num, ': Found Call Centers ' + dp_data['name'])
-                    search_successful = True
-                    #dp = dp_data['name']
-            if search_successful == True:
-                dp_selection = input('Select the number of the Device Pool you most desire: ')
-                dp = device_pool_list_names[int(dp_selection)]['name']
-                print(dp)
-            else:
-                print('There was no Call Center or DP found. Will try to copy Device Settings.')
+        dp = select_device_pool(load_catalog(service, 'devicePool', mirror = mirror), call_center)
+        search_successful = dp is not None
 except Fault:
         print("Something weird happened, I couldn't look for " + call_center)
         show_history()
 
-#begin going through the list of agents
-
-filename = 'agent list.csv'
-with open(filename, 'r') as csvfile:
-    datareader = csv.reader(csvfile)
-    for row in datareader:
-        enumber = row[0]
-        owner_user_name = enumber.capitalize()
-        deviceprofile = enumber.capitalize() + '_EM_8841'
-        #retrieve device profile
-        try:
-            resp = service.getDeviceProfile(name=deviceprofile)
-        except Fault:
-            deviceprofile = enumber.capitalize() + '_EM_8851'
+#only ask the admin about a missing CIPC when agents are migrated one at a time,
+#concurrent workers can't share the prompt so they record the step as failed instead
+interactive = args.workers <= 1
+
+#create csf template, placed in its final device pool/MRL/CSS right away (see csf_placement in prefetch.py)
+def fill_phone_info(name, product, owner_user_name, description, lines, placement):
+    phone_info = {
+        'name': name,
+        'product': product,
+        'model': product,
+        'description': f'{description}',
+        'class': 'Phone',
+        'protocol': 'SIP',
+        'protocolSide': 'User',
+        'devicePoolName': placement['devicePoolName'],
+        'locationName': placement['locationName'],
+        'mediaResourceListName': placement['mediaResourceListName'],
+        'callingSearchSpaceName': placement['callingSearchSpaceName'],
+        'sipProfileName': 'Standard SIP Profile',
+        'commonPhoneConfigName': xsd.SkipValue,
+        'commonDeviceConfigName': 'Agent_CDC',
+        'phoneTemplateName': xsd.SkipValue,
+        'primaryPhoneName': xsd.SkipValue,
+        'useTrustedRelayPoint': xsd.SkipValue,
+        'builtInBridgeStatus': 'On',
+        'packetCaptureMode': xsd.SkipValue,
+        'certificateOperation': xsd.SkipValue,
+        'deviceMobilityMode': xsd.SkipValue,
+        'ownerUserName': owner_user_name,
+        'lines': lines
+    }
+    return phone_info
+
+def ask_device_id(enumber):
+    if not interactive:
+        return ''
+    return input("Couldn't find the phone with the name of " + enumber + ", try the PC/Device id:").capitalize()
+
+def resolve_agent(enumber):
+    """Read phase: look up everything the agent's CSF is built from before anything is written.
+
+    Returns the plan run_agent_steps works from: the EM profile name, description and
+    lines, the CIPC to delete and where the CSF goes. 'error' names the failed read
+    when there is nothing to migrate from, 'lookup' when a read failed with anything
+    but an AXL fault (connection error, timeout, 5xx) so only this agent fails."""
+    started = time.perf_counter()
+    try:
+        return read_plan(enumber, started)
+    except Exception as err:
+        print(enumber + ': lookup failed: ' + str(err))
+        return {'profile': None, 'description': None, 'lines': None, 'device_id': '', 'placement': None, 'error': 'lookup',
+                'seconds': time.perf_counter() - started}
+
+def read_plan(enumber, started):
+    journaled = journal.steps(enumber)
+    record = prefetched.get(enumber)
+    plan = {'profile': None, 'description': None, 'lines': None, 'device_id': '', 'placement': None, 'error': None}
+
+    if 'addPhone' in journaled:
+        #the CSF was created by an earlier run
+        plan['profile'] = journaled['addPhone']['profile']
+    else:
+        #user, profile and CIPC were looked up for the whole CSV before the run, see prefetch.py
+        names = [record['profile']] if record is not None else [enumber.capitalize() + suffix for suffix in PROFILE_SUFFIXES]
+        for name in filter(None, names):
+            try:
+                profile = read(service, 'migrate', 'getDeviceProfile', name=name)
+            except Fault:
+                continue
+            #only the tags the migration needs were read (see axl_read.py)
+            plan.update(profile = name, description = profile.get('description'), lines = profile.get('lines'))
+            break
+        else:
+            plan['error'] = 'getDeviceProfile'
+            plan['seconds'] = time.perf_counter() - started
+            return plan
+
+    #the CIPC gives the CSF its device pool, MRL and CSS, and is deleted at the end
+    cipc = None
+    needs_cipc = 'removePhone' not in journaled and not (journaled and record is not None and record['phone'] is None)
+    if needs_cipc or 'addPhone' not in journaled:
         try:
-            resp = service.getDeviceProfile(name=deviceprofile)
-        except Fault:
-            print("No EM Profile Found for " + enumber)
-            show_history()
-        #save device profile settings to vars
-        phone_list = resp['return'].deviceProfile
-        description = phone_list['description']
-        lines = phone_list.lines
-        extension1 = phone_list.lines.line[0]['dirn']['pattern']
-        phone_pattern = extension1
-        phone_partition = phone_list.lines.line[0]['dirn']['routePartitionName']['_value_1']
-        phone_caller_id = phone_list.lines.line[0]['e164Mask']
-        phone_busy_trigger = phone_list.lines.line[0]['busyTrigger']
-        uuid1 = phone_list.lines.line[0]['uuid']
+            cipc = record['phone'] if record is not None else lookup_cipc(service, enumber.capitalize())
+            if cipc is None and needs_cipc:
+                device_id = ask_device_id(enumber)
+                if device_id != '':
+                    cipc = lookup_cipc(service, device_id)
+        except Fault as err:
+            print( f'{ enumber }: Zeep error: listPhone: { err }. Resorting to default values for CSF profile.' )
+        if cipc is None:
+            print(enumber + ": Couldn't find the CIPC, resorting to default values for CSF profile.")
+    plan['device_id'] = cipc['name'] if cipc is not None else ''
+    plan['placement'] = csf_placement(cipc, dp if search_successful else None)
+    plan['seconds'] = time.perf_counter() - started
+    return plan
+
+def migrate_agent(enumber):
+    """Write phase: run every migration step for one agent, in order, and return its result row.
+
+    Steps the journal already has for the agent are skipped. 'seconds' is the agent's
+    wall-clock time, read phase ('read_seconds') included."""
+    started = time.perf_counter()
+    journaled = journal.steps(enumber)
+    plan = plans.get(enumber) or {'seconds': 0}
+    result = {'agent': enumber, 'device': journaled.get('addPhone', {}).get('device', ''), 'status': 'ok',
+              'completed': list(journaled), 'failed': [], 'seconds': 0, 'read_seconds': round(plan['seconds'], 2)}
+    if journal.status(enumber) == 'ok':
+        return result
+    try:
+        run_agent_steps(enumber, result, journaled, plan)
+    except Exception as err:
+        print(enumber + ': migration stopped: ' + str(err))
+        result['failed'].append('unexpected error')
+        result['status'] = 'failed'
+    update_status(result)
+    #with --app-user-batch the agent is finished once its batch has been associated
+    if not args.app_user_batch or result['status'] == 'failed':
+        journal.finish(enumber, result['status'])
+    result['seconds'] = round(time.perf_counter() - started + plan['seconds'], 2)
+    return result
+
+def update_status(result):
+    if result['status'] == 'ok' and result['failed']:
+        result['status'] = 'partial'
+
+def associate_app_users(batch):
+    """Associate the CSFs created for a batch of agents with pguser and zoomjtapi in one go."""
+    created = [result for result in batch if 'addPhone' in result['completed']
+               and not all(app_user in result['completed'] for app_user in APP_USERS)]
+    if created:
+        associate_batch(created)
+    for result in batch:
+        if result['status'] != 'failed' and journal.status(result['agent']) != 'ok':
+            journal.finish(result['agent'], result['status'])
+
+def associate_batch(created):
+    """pguser/zoomjtapi for the agents in `created`, recorded in their results and the journal."""
+    print("Updating " + ', '.join(APP_USERS) + " for " + str(len(created)) + " CSFs")
+    try:
+        mapped = associate_devices(service, [result['device'] for result in created])
+    except Exception as err:
+        print('Zeep error: associate_devices: ' + str(err))
+        mapped = {}
+    for result in created:
+        for app_user in APP_USERS:
+            if app_user in result['completed']:
+                continue
+            if app_user in mapped.get(result['device'], ()):
+                result['completed'].append(app_user)
+                journal.done(result['agent'], app_user)
+            else:
+                result['failed'].append(app_user)
+        update_status(result)
+
+def run_agent_steps(enumber, result, journaled, plan):
+    def say(message):
+        print(enumber + ': ' + message)
+
+    def done(step, **data):
+        result['completed'].append(step)
+        journal.done(enumber, step, **data)
+
+    def todo(step):
+        return step not in result['completed']
+
+    def failed(step, err):
+        result['failed'].append(step)
+        say(f'Zeep error: {step}: {err}')
+
+    owner_user_name = enumber.capitalize()
+    record = prefetched.get(enumber)
+    deviceprofile = plan['profile']
+    if plan['error'] == 'lookup':
+        #nothing is known about the agent this run, not even enough to resume it
+        result['failed'].append('lookup')
+        result['status'] = 'failed'
+        return
+    if not todo('addPhone'):
+        #the CSF was created by an earlier run, carry on after it
+        device_name = journaled['addPhone']['device']
+        say("Resuming after " + ', '.join(journaled))
+    else:
+        if plan['error']:
+            say("No EM Profile Found")
+            result['failed'].append(plan['error'])
+            result['status'] = 'failed'
+            return
         device_name = "CSF" + enumber.capitalize()
-        #create csf template
-        def fill_phone_info(name, product, owner_user_name, pattern, partition, caller_id, busy_trigger):
-            phone_info = {
-                'name': name,
-                'product': product,
-                'model': product,
-                'description': f'{description}',
-                'class': 'Phone',
-                'protocol': 'SIP',
-                'protocolSide': 'User',
-                'devicePoolName': 'Default',
-                'locationName': 'Hub_None',
-                'sipProfileName': 'Standard SIP Profile',
-                'commonPhoneConfigName': xsd.SkipValue,
-                'commonDeviceConfigName': 'Agent_CDC',
-                'phoneTemplateName': xsd.SkipValue,
-                'primaryPhoneName': xsd.SkipValue,
-                'useTrustedRelayPoint': xsd.SkipValue,
-                'builtInBridgeStatus': 'On',
-                'packetCaptureMode': xsd.SkipValue,
-                'certificateOperation': xsd.SkipValue,
-                'deviceMobilityMode': xsd.SkipValue,
-                'ownerUserName': owner_user_name,
-                'lines': lines
-            }
-            return phone_info
-
-
-        print("\n")
-        print("-" * 10)
-        print("Creating " + device_name)
-        print("-" * 10)
-        print("\n")
-
-
-        #create csf from device profile
-
-        associated_devices = device_name
+        result['device'] = device_name
+
+        #create csf from device profile, fully configured in one write
+        say("Creating " + device_name)
         new_phone = fill_phone_info(device_name, 'Cisco Unified Client Services Framework'\
-                        ,owner_user_name, phone_pattern, phone_partition, phone_caller_id, phone_busy_trigger)
-        resp = service.addPhone(new_phone)
-
-        print("\n")
-        print("-" * 10)
-        print("Updating EndUser")
-        print("-" * 10)
-        print("\n")
-
-        #update end user and app users
-        resp = service.updateUser(userid=owner_user_name, associatedDevices=associated_devices, imAndPresenceEnable=False)
-
-        print("\n")
-        print("-" * 10)
-        print("Updating pguser")
-        print("-" * 10)
-        print("\n")
-
-        """ here we start updating the app users. sql injection is the best method here 
-        since updateAppUser would overwrite every other device associated """
-
-        sql = '''insert into applicationuserdevicemap (fkapplicationuser, fkdevice, tkuserassociation)
-            select au.pkid, d.pkid, 1 from applicationuser au cross join device d 
-            where au.name = 'pguser' and d.name in ('{device_name}') and 
-            d.pkid not in (select fkdevice from applicationuserdevicemap where fkapplicationuser = au.pkid)'''.format(
-                device_name = device_name
-            )
+                        ,owner_user_name, plan['description'], plan['lines'], plan['placement'])
         try:
-            resp = service.executeSQLUpdate( sql )
+            service.addPhone(new_phone)
         except Fault as err:
-            print('Zeep error: executeSQLUpdate: {err}'.format( err = err ) )
-        else:
-            pguser_update = resp['return']['rowsUpdated']
-            if pguser_update == 1:
-                print('pguser updated successfully!')
-            else:
-                print('pguser update failed!')
-
-        print("\n")
-        print("-" * 10)
-        print("Updating zoomjtapi user")
-        print("-" * 10)
-        print("\n")
-
-        sql = '''insert into applicationuserdevicemap (fkapplicationuser, fkdevice, tkuserassociation)
-            select au.pkid, d.pkid, 1 from applicationuser au cross join device d 
-            where au.name = 'zoomjtapi' and d.name in ('{device_name}') and 
-            d.pkid not in (select fkdevice from applicationuserdevicemap where fkapplicationuser = au.pkid)'''.format(
-                device_name = device_name
-            ) 
+            #created before the last run stopped, but not journaled yet
+            if 'duplicate' not in str(err).lower():
+                failed('addPhone', err)
+                result['status'] = 'failed'
+                return
+            say(device_name + " already exists")
+        done('addPhone', profile = deviceprofile, device = device_name, placed = True)
+
+    #journals from before the CSF was created in place still have the updatePhone to do
+    if 'addPhone' in journaled and not journaled['addPhone'].get('placed') and todo('updatePhone'):
         try:
-            resp = service.executeSQLUpdate( sql )
+            service.updatePhone(name = device_name, devicePoolName = plan['placement']['devicePoolName'],
+                                mediaResourceListName = plan['placement']['mediaResourceListName'],
+                                callingSearchSpaceName = plan['placement']['callingSearchSpaceName'])
         except Fault as err:
-            print('Zeep error: executeSQLUpdate: {err}'.format( err = err ) )
+            say("CSF didn't update with correct Device Pool info")
+            failed('updatePhone', err)
         else:
-            zoom_update = resp['return']['rowsUpdated']
-            if zoom_update == 1:
-                print( 'zoomjtapi updated successfully!' )
-            else:
-                print( 'zoomjtapi update failed!' )
-
-        print("\n")
-        print("-" * 10)
-        print("Deleting " + phone_list['name'] + " and associated users CIPC " + enumber)
-        print("-" * 10)
-        print("\n")
+            done('updatePhone')
 
-        #gather device profile and other info from soft phone. if the entry from the beginning was successful, use that first.
+    #update end user and app users
+    if todo('updateUser'):
+        say("Updating EndUser")
         try:
-            phone_resp = service.listPhone(searchCriteria = { 'name': owner_user_name }, returnedTags = { 'devicePoolName': '', 'mediaResourceListName': '', 'callingSearchSpaceName': ''})
-            DP_from_CIPC = phone_resp['return']['phone'][0]['devicePoolName']['_value_1']
-            MRLN = phone_resp['return']['phone'][0]['mediaResourceListName']['_value_1']
-            CSS = phone_resp['return']['phone'][0]['callingSearchSpaceName']
-        except:
-            device_id = input("Couldn't find the phone with the name of " + enumber + ", try the PC/Device id:").capitalize()
-            try:
-                phone_resp = service.listPhone(searchCriteria = { 'name': device_id }, returnedTags = { 'devicePoolName': '', 'mediaResourceListName': '', 'callingSearchSpaceName': ''})
-                if device_id != '':
-                    DP_from_CIPC = phone_resp['return']['phone'][0]['devicePoolName']['_value_1']
-                    MRLN = phone_resp['return']['phone'][0]['mediaResourceListName']['_value_1']
-                    CSS = phone_resp['return']['phone'][0]['callingSearchSpaceName']
-                else:
-                    DP_from_CIPC = 'Default'
-                    MRLN = 'MC_MRGL'
-                    CSS = '06_Device'
-            except Fault as err:
-                print( f'Zeep error: listPhone: { err }. Resorting to default values for CSF profile.' )
-
-        if search_successful == True:
-            try:
-                resp = service.updatePhone(name = device_name, devicePoolName = dp, mediaResourceListName = MRLN, callingSearchSpaceName = CSS)
-            except:
-                print("CSF didn't update with correct Device Pool info")
-                print( f'Zeep error: updatePhone: { err }' )
+            service.updateUser(userid=owner_user_name, associatedDevices=device_name, imAndPresenceEnable=False)
+        except Fault as err:
+            failed('updateUser', err)
         else:
-            try:
-                resp = service.updatePhone(name = device_name, devicePoolName = DP_from_CIPC, mediaResourceListName = MRLN, callingSearchSpaceName = CSS)
-            except:
-                print("CSF didn't update with correct Device Pool info")
-                print( f'Zeep error: updatePhone: { err }' )
-            
-        try:
-            rp_resp = service.removePhone( name = enumber)
-            print('CIPC deleted.')
-        except:
-            device_id = input("Couldn't find the phone with the name of " + enumber + ", try the PC/Device id:").capitalize()
-            try:
-                rp_resp = service.removePhone( name = device_id)
-                print('CIPC deleted.')
-            except Fault as err:
-                print( f'Zeep error: removePhone: { err }' )
+            done('updateUser')
 
+    #with --app-user-batch the app users are updated for many agents at once, see associate_app_users
+    for app_user in ([] if args.app_user_batch else filter(todo, APP_USERS)):
+        say("Updating " + app_user)
         try:
-            rdp_resp = service.removeDeviceProfile( name = deviceprofile)
-            print('Device Profile deleted.')
+            resp = service.executeSQLUpdate( INSERT_SQL.format( app_user = quote( app_user ), devices = quote( device_name ) ) )
         except Fault as err:
-            # looks like someone forgot to log out of their phone. 
-            # will try to log the agent out of the phone and then delete the dp
-            try:
-                em_check_list = service.listPhone(searchCriteria = { 'name': '%' }, returnedTags = { 'name': '', 'currentProfileName': ''})
-                em_check_list_names = em_check_list['return']['phone']
-                for em_phone_index, em_data in enumerate(em_check_list_names):
-                    if deviceprofile == em_data['currentProfileName']['_value_1']:
-                        print('Agent was logged into their deskphone. Phone log out initiated.')
-                        em_logout = service.doDeviceLogout(deviceName = em_data['name'])
-                        print('Phone log out successful, removing device profile.')
-                        rdp_resp = service.removeDeviceProfile( name = deviceprofile)
-            except:
-                print("couldn't pull list of phones")
-    
\ No newline at end of file
+            failed(app_user, err)
+        else:
+            #nothing inserted on a resumed agent may mean the last run already did it
+            if resp['return']['rowsUpdated'] == 1 or (journaled and app_user in mapped_devices(service, [device_name], [app_user])[device_name]):
+                say(app_user + ' updated successfully!')
+                done(app_user)
+            else:
+                say(app_user + ' update failed!')
+                result['failed'].append(app_user)
+
+    #the last run stopped after deleting the CIPC or the profile but before journaling it
+    if journaled and record is not None:
+        if todo('removePhone') and record['phone'] is None:
+            say('CIPC already deleted.')
+            done('removePhone')
+        if todo('removeDeviceProfile') and record['profile'] is None:
+            say('Device Profile already deleted.')
+            done('removeDeviceProfile')
+
+    #the CIPC and the EM profile are deleted in the cleanup phase once every agent is migrated, see cleanup.py
+    if todo(RETIRE_STEP):
+        if plan['device_id'] == '' and todo('removePhone'):
+            say("Couldn't find the CIPC to delete.")
+            result['failed'].append('removePhone')
+        say("Queueing " + deviceprofile + " and CIPC " + (plan['device_id'] or enumber) + " for deletion")
+        done(RETIRE_STEP, cipc = plan['device_id'] if todo('removePhone') else '',
+             profile = deviceprofile if todo('removeDeviceProfile') else '')
+
+#begin going through the list of agents
+
+agents = read_agents(args.csv)
+
+journal = MigrationJournal(args.journal, resume = not args.no_resume)
+finished = [enumber for enumber in agents if journal.status(enumber) == 'ok']
+if finished:
+    print(str(len(finished)) + " agents were already migrated according to " + args.journal + ", skipping them")
+
+prefetched = {}
+pending = [enumber for enumber in agents if enumber not in finished]
+if pending and not args.no_prefetch:
+    print("Looking up users, device profiles and CIPCs for " + str(len(pending)) + " agents")
+    try:
+        prefetched = prefetch_agents(service, pending, mirror = mirror)
+    except Fault as err:
+        print( f'Zeep error: executeSQLQuery: { err }. Looking agents up one at a time instead.' )
+
+run_started = time.perf_counter()
+results = []
+with ThreadPoolExecutor(max_workers = max(1, args.workers)) as pool:
+    #read phase: resolve every agent's profile and CIPC before anything is written
+    plans = dict(zip(pending, pool.map(resolve_agent, pending)))
+    batch = []
+    for result in pool.map(migrate_agent, agents):
+        results.append(result)
+        if args.app_user_batch:
+            batch.append(result)
+            if len(batch) >= args.app_user_batch:
+                associate_app_users(batch)
+                batch = []
+    if batch:
+        associate_app_users(batch)
+run_seconds = time.perf_counter() - run_started
+
+#cleanup phase: delete the retired CIPCs and device profiles of this and earlier runs
+cleanup_queue = retired(journal)
+if cleanup_queue and args.no_cleanup:
+    print("\n" + str(len(cleanup_queue)) + " agents still have a CIPC or device profile to delete, run cleanup.py to delete them")
+elif cleanup_queue:
+    print("\nDeleting the CIPCs and device profiles of " + str(len(cleanup_queue)) + " agents")
+    cleanup_started = time.perf_counter()
+    cleaned = run_cleanup(service, journal, cleanup_queue, workers = args.cleanup_workers, rate = args.cleanup_rate, mirror = mirror)
+    print(summary(cleaned) + f" in {time.perf_counter() - cleanup_started:.1f}s")
+    for result in results:
+        if result['agent'] in cleaned:
+            result['completed'] += cleaned[result['agent']]['completed']
+            result['failed'] += cleaned[result['agent']]['failed']
+            update_status(result)
+
+#per-agent summary
+print("\n")
+print("-" * 10)
+print("Results")
+print("-" * 10)
+print(f"{'Agent':<12}{'Device':<16}{'Status':<10}{'Read s':>8}{'Seconds':>8}  Failed steps")
+for result in results:
+    print(f"{result['agent']:<12}{result['device']:<16}{result['status']:<10}{result['read_seconds']:>8}{result['seconds']:>8}  {', '.join(result['failed'])}")
+statuses = [result['status'] for result in results]
+print(f"\n{statuses.count('ok')} ok, {statuses.count('partial')} partial, {statuses.count('failed')} failed "
+      f"in {run_seconds:.1f}s with {max(1, args.workers)} worker(s)")
+
+#where the time went, per AXL operation
+metrics.print_table()
+if controller:
+    print("AXL requests in flight: " + controller.describe())
+if nodes:
+    print("AXL read nodes: " + nodes.describe())
+deadlines = default_policy().describe() if default_policy() else ''
+if deadlines:
+    print("AXL deadlines: " + deadlines)
+if args.metrics:
+    metrics.export(args.metrics, agents = len(agents), workers = max(1, args.workers), rate = args.rate,
+                   seconds = round(run_seconds, 2), cucm = os.getenv('CUCM_ADDRESS'))
+
+if args.results:
+    with open(args.results, 'w', newline='') as resultsfile:
+        writer = csv.DictWriter(resultsfile, fieldnames = ['agent', 'device', 'status', 'read_seconds', 'seconds', 'completed', 'failed'])
+        writer.writeheader()
+        for result in results:
+            writer.writerow(dict(result, completed = ' '.join(result['completed']), failed = ' '.join(result['failed'])))
@@ -0,0 +1,148 @@
+"""Cached catalog of CUCM reference data (device pools, MRLs, CSSs and locations).
+
+Every migrator used to download the full device pool list and walk it twice per
+run. The names are now fetched once, indexed for exact, prefix and substring
+lookups, and saved to an on-disk cache so the other scripts run during the same
+migration day can reuse them until the cache expires (AXL_CATALOG_TTL seconds,
+8 hours by default).
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import json
+import time
+import bisect
+import tempfile
+
+from axl_client import CACHE_DIR
+from axl_list import iter_list
+
+CATALOG_TTL = int( os.getenv( 'AXL_CATALOG_TTL', 8 * 60 * 60 ) )
+
+# catalog kind: AXL list operation
+KINDS = {
+    'devicePool': 'listDevicePool',
+    'mediaResourceList': 'listMediaResourceList',
+    'css': 'listCss',
+    'location': 'listLocation',
+}
+
+
+class NameCatalog:
+    """Sorted names of one kind of CUCM object with exact, prefix and substring indexes.
+
+    Lookups are case sensitive, like the name comparisons they replace."""
+
+    def __init__( self, kind, names, fetched_at = None ):
+        self.kind = kind
+        self.names = sorted( set( names ) )
+        self.fetched_at = fetched_at or time.time()
+        self._exact = set( self.names )
+
+        # trigram -> positions in self.names, used to narrow down substring searches
+        self._trigrams = { }
+        for position, name in enumerate( self.names ):
+            for i in range( len( name ) - 2 ):
+                self._trigrams.setdefault( name[ i:i + 3 ], set() ).add( position )
+
+    def __len__( self ):
+        return len( self.names )
+
+    def exact( self, name ):
+        """`name` if it exists, otherwise None."""
+        return name if name in self._exact else None
+
+    def prefix( self, text ):
+        """Every name starting with `text`."""
+        start = bisect.bisect_left( self.names, text )
+        end = start
+        while end < len( self.names ) and self.names[ end ].startswith( text ):
+            end += 1
+        return self.names[ start:end ]
+
+    def search( self, text ):
+        """Every name containing `text`."""
+        if len( text ) < 3:
+            return [ name for name in self.names if text in name ]
+        candidates = None
+        for i in range( len( text ) - 2 ):
+            positions = self._trigrams.get( text[ i:i + 3 ], set() )
+            candidates = positions if candidates is None else candidates & positions
+            if not candidates:
+                return [ ]
+        return [ self.names[ position ] for position in sorted( candidates ) if text in self.names[ position ] ]
+
+
+def _cache_file( kind, cache_dir ):
+    address = ( os.getenv( 'CUCM_ADDRESS' ) or 'default' ).replace( ':', '_' ).replace( os.sep, '_' )
+    return os.path.join( cache_dir, f'catalog-{address}-{kind}.json' )
+
+
+def fetch_names( service, kind ):
+    """Download every name of `kind` from CUCM."""
+    return [ item['name'] for item in iter_list( service, KINDS[ kind ], { 'name': '%' }, { 'name': '' } ) ]
+
+
+def load_catalog( service, kind = 'devicePool', ttl = CATALOG_TTL, cache_dir = CACHE_DIR, refresh = False, mirror = None ):
+    """Return the NameCatalog for `kind`, from the on-disk cache while it is fresh,
+    or from `mirror` (see mirror.py) when there is one."""
+    if mirror is not None:
+        return NameCatalog( kind, mirror.names( kind ) )
+    path = _cache_file( kind, cache_dir )
+    if not refresh:
+        try:
+            with open( path ) as f:
+                cached = json.load( f )
+            if time.time() - cached['fetched_at'] < ttl:
+                return NameCatalog( kind, cached['names'], cached['fetched_at'] )
+        except ( OSError, ValueError, KeyError ):
+            pass
+
+    catalog = NameCatalog( kind, fetch_names( service, kind ) )
+
+    # write to a temp file first so a concurrent reader never sees half a file
+    os.makedirs( cache_dir, exist_ok = True )
+    fd, tmp = tempfile.mkstemp( dir = cache_dir, suffix = '.json' )
+    with os.fdopen( fd, 'w' ) as f:
+        json.dump( { 'fetched_at': catalog.fetched_at, 'names': catalog.names }, f )
+    os.replace( tmp, path )
+    return catalog
+
+
+def select_device_pool( catalog, call_center ):
+    """Pick the device pool for `call_center`, asking the admin when it is ambiguous.
+
+    An exact match is used as is. Otherwise every device pool containing
+    `call_center` is listed to choose from. Returns None when nothing matches."""
+    dp = catalog.exact( call_center )
+    if dp is not None:
+        print( 'Found Call Centers match ' + dp )
+        return dp
+
+    matches = catalog.search( call_center )
+    if not matches:
+        print( 'There was no Call Center or DP found. Will try to copy Device Settings.' )
+        return None
+    for dp_index_num, dp_name in enumerate( matches ):
+        print( dp_index_num, ': Found Call Centers ' + dp_name )
+    while True:
+        dp_selection = input( 'Select the number of the Device Pool you most desire: ' )
+        if dp_selection.isdigit() and int( dp_selection ) < len( matches ):
+            print( matches[ int( dp_selection ) ] )
+            return matches[ int( dp_selection ) ]
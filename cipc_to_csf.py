@@ -24,161 +24,113 @@ SOFTWARE.
 
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from traceback import print_tb
 from lxml import etree
-from requests import Session
-from zeep.cache import SqliteCache
-from requests.auth import HTTPBasicAuth
-from zeep.plugins import HistoryPlugin
-from zeep import Client, Settings, Plugin, xsd
-from zeep.transports import Transport
+from zeep import xsd
 from zeep.exceptions import Fault
-from urllib3 import disable_warnings
-from urllib3.exceptions import InsecureRequestWarning
+from axl_client import create_client, create_service
+from axl_read import first_line, read
+from tracing import create_tracer
+from catalog import load_catalog, select_device_pool
+from mirror import open_mirror
+from prefetch import csf_placement
 
 # Edit .env file to specify your Webex site/user details
 from dotenv import load_dotenv
 load_dotenv()
 
-# The WSDL is a local file
-WSDL_FILE = 'schema/AXLAPI.wsdl'
-
-# Change to true to enable output of request/response headers and XML
+# Change to true to also save the request/response XML of every AXL call to the trace file
 DEBUG = False
 
-# If you have a pem file certificate for CUCM, uncomment and define it here
-
-#CERT = 'some.pem'
-
-# These values should work with a DevNet sandbox
-# You may need to change them if you are working with your own CUCM server
-
-
-disable_warnings(InsecureRequestWarning)
- 
-
-# This class lets you view the incoming and outgoing http headers and/or XML
-class MyLoggingPlugin( Plugin ):
-
-    def egress( self, envelope, http_headers, operation, binding_options ):
-
-        # Format the request body as pretty printed XML
-        xml = etree.tostring( envelope, pretty_print = True, encoding = 'unicode')
-
-        print( f'\nRequest\n-------\nHeaders:\n{http_headers}\n\nBody:\n{xml}' )
-
-    def ingress( self, envelope, http_headers, operation ):
-
-        # Format the response body as pretty printed XML
-        xml = etree.tostring( envelope, pretty_print = True, encoding = 'unicode')
-
-        print( f'\nResponse\n-------\nHeaders:\n{http_headers}\n\nBody:\n{xml}' )
-
-session = Session()
-
-# We avoid certificate verification by default, but you can uncomment and set
-# your certificate here, and comment out the False setting
-
-#session.verify = CERT
-session.verify = False
-session.auth = HTTPBasicAuth( os.getenv( 'AXL_USERNAME' ), os.getenv( 'AXL_PASSWORD' ) )
-
-# Create a Zeep transport and set a reasonable timeout value
-transport = Transport( session = session, timeout = 10 )
-
-# strict=False is not always necessary, but it allows zeep to parse imperfect XML
-settings = Settings( strict=False, xml_huge_tree=True )
+# Records timing, size and fault code of every AXL call (written to AXL_TRACE_FILE as
+# JSON lines in the background), show_history() prints the last request/response
+history = create_tracer( debug = DEBUG )
 
-# If debug output is requested, add the MyLoggingPlugin callback
-plugin = [ MyLoggingPlugin() ] if DEBUG else [ ]
+# Create the Zeep client from the cached, pre-compiled AXL schema (see axl_client.py)
+client = create_client( tracer = history )
+service = create_service( client )
 
-# Create the Zeep client with the specified settings
-client = Client( WSDL_FILE, settings = settings, transport = transport,
-        plugins = plugin )
-history = HistoryPlugin()
-# service = client.create_service("{http://www.cisco.com/AXLAPIService/}AXLAPIBinding", CUCM_URL)
-service = client.create_service( '{http://www.cisco.com/AXLAPIService/}AXLAPIBinding',
-                                f'https://{os.getenv( "CUCM_ADDRESS" )}:8443/axl/' )
+#answer lookups from the local CUCM mirror when AXL_MIRROR=1 is set, see mirror.py
+mirror = open_mirror( service )
 
 #should output any errors coming from cucm while interacting with the program
 def show_history():
      for hist in [history.last_sent, history.last_received]:
-         print(etree.tostring(hist["envelope"], encoding='unicode', pretty_print=True))
+         if hist:
+             print(etree.tostring(hist["envelope"], encoding='unicode', pretty_print=True))
 
 
+#lookups run in the background while the admin is still answering the prompts: the device
+#pool catalog right away, the CIPC as soon as the E# is known
+lookups = ThreadPoolExecutor(max_workers = 2)
+catalog_lookup = lookups.submit(load_catalog, service, 'devicePool', mirror = mirror)
+
+#retrieve the CIPC, named after the E# as typed or capitalized
+def read_cipc(enumber):
+    try:
+        return read(service, 'cipc_to_csf', 'getPhone', name=enumber)
+    except Fault:
+        return read(service, 'cipc_to_csf', 'getPhone', name=enumber.capitalize())
+
 #ask admin for the e# needed, and format it into needed vars
 enumber = input("Enter E# :")
+cipc_lookup = lookups.submit(read_cipc, enumber)
 call_center = input("Enter Cost Center or Device Pool to use for " + enumber + ":")
+reads_started = time.perf_counter()
 owner_user_name = enumber.capitalize()
 deviceprofile = enumber.capitalize() + '_EM_8841'
 
-#retrieve device profile
-try:
-     resp = service.getPhone(name=enumber)
-except Fault:
-    resp = service.getPhone(name=enumber.capitalize())
+phone_list = cipc_lookup.result()
 
-#retrieve list of all device pools from cucm.
+#retrieve list of all device pools from cucm (cached between runs, see catalog.py).
 #if user input is blank, try to use the soft phone settings.
 #if exact match for dp is found in the list gathered, use that
 #otherwise try to find a match in the list and give user a list to chose from
 
 
-search_again = True
 search_successful = False
 
 try:
     if call_center == "":
         print("No DP given, resorting to CIPC settings.")
     else:
-        device_pool_list = service.listDevicePool(searchCriteria = { 'name': '%' }, returnedTags = { 'name': ''})
-        device_pool_list_names = device_pool_list['return']['devicePool']
-        try:
-            for dp_index_num, dp_data in enumerate(device_pool_list_names):
-                if call_center == dp_data['name']:
-                    print('Found Call Centers match' + dp_data['name'])
-                    dp = dp_data['name']
-                    search_again = False
-                    search_successful = True
-        except:
-            print('The search failed.')
-        if search_again == True:
-            for dp_index_num, dp_data in enumerate(device_pool_list_names):
-                if call_center in dp_data['name']:
-                    print(dp_index_num, ': Found Call Centers ' + dp_data['name'])
-                    search_successful = True
-                    #dp = dp_data['name']
-            if search_successful == True:
-                dp_selection = input('Select the number of the Device Pool you most desire: ')
-                dp = device_pool_list_names[int(dp_selection)]['name']
-                print(dp)
-            else:
-                print('There was no Call Center or DP found. Will try to copy Device Settings.')
+        dp = select_device_pool(catalog_lookup.result(), call_center)
+        search_successful = dp is not None
 except Fault:
         print("Something weird happened, I couldn't look for " + call_center)
         show_history()
 
-#save device profile settings to vars
-phone_list = resp['return'].phone
-description = phone_list['description']
-lines = phone_list.lines
-extension1 = phone_list.lines.line[0]['dirn']['pattern']
+#save CIPC settings to vars, only the tags the migration needs were read (see axl_read.py)
+description = phone_list.get('description')
+lines = phone_list.get('lines')
+extension1 = first_line(phone_list)['dirn']['pattern']
 phone_pattern = extension1
-phone_partition = phone_list.lines.line[0]['dirn']['routePartitionName']['_value_1']
-phone_caller_id = phone_list.lines.line[0]['e164Mask']
-phone_busy_trigger = phone_list.lines.line[0]['busyTrigger']
-uuid1 = phone_list.lines.line[0]['uuid']
+phone_partition = first_line(phone_list)['dirn'].get('routePartitionName')
+phone_caller_id = first_line(phone_list).get('e164Mask')
+phone_busy_trigger = first_line(phone_list).get('busyTrigger')
+uuid1 = first_line(phone_list).get('uuid')
 device_name = "CSF" + enumber.capitalize()
-commonDeviceConfig = phone_list['commonDeviceConfigName']['_value_1']
-networkMOH = phone_list['networkHoldMohAudioSourceId']
-userMOH = phone_list['userHoldMohAudioSourceId']
-if phone_list.lines.line[0]['recordingFlag'] == 'Call Recording Disabled':
+commonDeviceConfig = phone_list.get('commonDeviceConfigName')
+networkMOH = phone_list.get('networkHoldMohAudioSourceId')
+userMOH = phone_list.get('userHoldMohAudioSourceId')
+if first_line(phone_list).get('recordingFlag') == 'Call Recording Disabled':
     recording_setting = False
 else:
     recording_setting = True
 
+#the CIPC read above already has its device pool, MRL, CSS and location, so the CSF is
+#created with them (or the device pool picked above) in one addPhone
+placement = csf_placement({'name': phone_list['name'], 'devicepool': phone_list.get('devicePoolName'),
+                           'mediaresourcelist': phone_list.get('mediaResourceListName'),
+                           'callingsearchspace': phone_list.get('callingSearchSpaceName'),
+                           'location': phone_list.get('locationName')},
+                          dp if search_successful else None, keep_location = True)
+print("Waited " + f'{time.perf_counter() - reads_started:.1f}' + "s on lookups after the prompts")
+
 #create csf template
-def fill_phone_info(name, product, commonDeviceConfig, networkMOH, userMOH, owner_user_name, pattern, partition, caller_id, busy_trigger):
+def fill_phone_info(name, product, commonDeviceConfig, networkMOH, userMOH, owner_user_name, pattern, partition, caller_id, busy_trigger, placement):
     phone_info = {
         'name': name,
         'product': product,
@@ -187,8 +139,10 @@ def fill_phone_info(name, product, commonDeviceConfig, networkMOH, userMOH, owne
         'class': 'Phone',
         'protocol': 'SIP',
         'protocolSide': 'User',
-        'devicePoolName': 'Default',
-        'locationName': 'Hub_None',
+        'devicePoolName': placement['devicePoolName'],
+        'locationName': placement['locationName'],
+        'mediaResourceListName': placement['mediaResourceListName'],
+        'callingSearchSpaceName': placement['callingSearchSpaceName'],
         'sipProfileName': 'Standard SIP Profile',
         'commonPhoneConfigName': xsd.SkipValue,
         'commonDeviceConfigName': commonDeviceConfig,
@@ -218,9 +172,10 @@ print("\n")
 
 #create csf from device profile
 
+started = time.perf_counter()
 associated_devices = device_name
 new_phone = fill_phone_info(device_name, 'Cisco Unified Client Services Framework'\
-                , commonDeviceConfig, networkMOH, userMOH, owner_user_name, phone_pattern, phone_partition, phone_caller_id, phone_busy_trigger)
+                , commonDeviceConfig, networkMOH, userMOH, owner_user_name, phone_pattern, phone_partition, phone_caller_id, phone_busy_trigger, placement)
 resp = service.addPhone(new_phone)
 
 print("\n")
@@ -232,42 +187,6 @@ print("\n")
 #update end user
 resp = service.updateUser(userid=owner_user_name, associatedDevices=associated_devices, imAndPresenceEnable=False)
 
-#gather device profile and other info from soft phone. if the entry from the beginning was successful, use that first.
-try:
-    phone_resp = service.listPhone(searchCriteria = { 'name': owner_user_name }, returnedTags = { 'devicePoolName': '', 'mediaResourceListName': '', 'callingSearchSpaceName': '', 'locationName': ''})
-    DP_from_CIPC = phone_resp['return']['phone'][0]['devicePoolName']['_value_1']
-    MRLN = phone_resp['return']['phone'][0]['mediaResourceListName']['_value_1']
-    CSS = phone_resp['return']['phone'][0]['callingSearchSpaceName']['_value_1']
-    location = phone_resp['return']['phone'][0]['locationName']['_value_1']
-except:
-    device_id = input("Couldn't find the phone with the name of " + enumber + ", try the PC/Device id:").capitalize()
-    try:
-        phone_resp = service.listPhone(searchCriteria = { 'name': device_id }, returnedTags = { 'devicePoolName': '', 'mediaResourceListName': '', 'callingSearchSpaceName': '','locationName': ''})
-        if device_id != '':
-            DP_from_CIPC = phone_resp['return']['phone'][0]['devicePoolName']['_value_1']
-            MRLN = phone_resp['return']['phone'][0]['mediaResourceListName']['_value_1']
-            CSS = phone_resp['return']['phone'][0]['callingSearchSpaceName']['_value_1']
-            location = phone_resp['return']['phone'][0]['locationName']['_value_1']
-        else:
-            DP_from_CIPC = 'Default'
-            MRLN = 'MC_MRGL'
-            CSS = '06_Device'
-            location = 'Hub_None'
-    except Fault as err:
-        print( f'Zeep error: listPhone: { err }' )
-if search_successful == True:
-    try:
-        resp = service.updatePhone(name = device_name, devicePoolName = dp, mediaResourceListName = MRLN, callingSearchSpaceName = CSS, locationName = location)
-    except:
-        print("CSF didn't update with correct Device Pool info")
-        print( f'Zeep error: updatePhone: { err }' )
-else:
-    try:
-        resp = service.updatePhone(name = device_name, devicePoolName = DP_from_CIPC, mediaResourceListName = MRLN, callingSearchSpaceName = CSS, locationName = location)
-    except:
-        print("CSF didn't update with correct Device Pool info")
-        print( f'Zeep error: updatePhone: { err }' )
-
 if recording_setting == True:
     print("\n")
     print("-" * 10)
@@ -301,14 +220,12 @@ print("-" * 10)
 print("\n")
 
 try:
-    rp_resp = service.removePhone( name = enumber)
-except:
-    device_id = input("Couldn't find the phone with the name of " + enumber + ", try the PC/Device id:").capitalize()
-    try:
-        rp_resp = service.removePhone( name = device_id)
-    except Fault as err:
-        print( f'Zeep error: removePhone: { err }' )
+    rp_resp = service.removePhone( name = phone_list['name'])
+except Fault as err:
+    print( f'Zeep error: removePhone: { err }' )
+else:
+    print( '\nremovePhone response:' )
+    print( rp_resp, '\n' )
 
-print( '\nremovePhone response:' )
-print( rp_resp, '\n' )
+print(enumber + " migrated in " + f'{time.perf_counter() - started:.1f}' + "s")
 
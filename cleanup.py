@@ -0,0 +1,148 @@
+"""Deferred cleanup: delete the CIPCs and EM device profiles of migrated agents.
+
+Once the CSF is created and associated the agent can work, the old CIPC and the
+EM profile only have to go eventually. bulk_agent_migrator.py records them in the
+journal as a 'retire' step instead of deleting them inline, and deletes them in a
+phase of its own after every agent is migrated: the phones the profiles are still
+logged into are found with one query for all of them, then the logouts and
+removals run on a few workers at a limited rate.
+
+Whatever is left over (--no-cleanup, a failed delete, a stopped run) is deleted
+by running this on the same journal:
+
+    python3 cleanup.py --journal "migration journal.jsonl" --workers 4 --rate 10
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from zeep.exceptions import Fault
+
+from extension_mobility import logged_in_devices
+from throttle import RateLimiter, RateLimitedService
+
+# journal step that queues an agent's CIPC and profile for deletion
+RETIRE_STEP = 'retire'
+
+
+def is_missing( err ):
+    """True when the fault says the object doesn't exist (anymore)."""
+    return 'not found' in str( err.message ).lower()
+
+
+def retired( journal ):
+    """[ { 'agent', 'cipc', 'profile' } ] still to delete for the agents in `journal`.
+
+    'cipc'/'profile' is '' when that one is deleted already (or there is none)."""
+    queue = [ ]
+    for agent in journal.agents():
+        steps = journal.steps( agent )
+        if RETIRE_STEP not in steps:
+            continue
+        cipc = steps[ RETIRE_STEP ].get( 'cipc' ) if 'removePhone' not in steps else ''
+        profile = steps[ RETIRE_STEP ].get( 'profile' ) if 'removeDeviceProfile' not in steps else ''
+        if cipc or profile:
+            queue.append( { 'agent': agent, 'cipc': cipc or '', 'profile': profile or '' } )
+    return queue
+
+
+def run_cleanup( service, journal, queue, workers = 4, rate = 10, mirror = None ):
+    """Delete everything in `queue` (see retired()), recording each delete in `journal`.
+
+    At most `rate` AXL requests per second are sent for it (0 for no limit) from
+    `workers` threads. Returns { agent: { 'completed': [ steps ], 'failed': [ steps ] } }."""
+    service = RateLimitedService( service, RateLimiter( rate ) )
+    results = { item[ 'agent' ]: { 'completed': [ ], 'failed': [ ] } for item in queue }
+    if not queue:
+        return results
+
+    # one lookup for every profile instead of one per failed removeDeviceProfile
+    profiles = [ item[ 'profile' ] for item in queue if item[ 'profile' ] ]
+    try:
+        logins = logged_in_devices( service, profiles, mirror = mirror )
+    except Exception as err:
+        print( f'Zeep error: logged_in_devices: { err }. Profiles still logged in will fail to delete.' )
+        logins = { }
+
+    def retire( item ):
+        agent = item[ 'agent' ]
+        result = results[ agent ]
+
+        def remove( step, operation, name, missing ):
+            try:
+                getattr( service, operation )( name = name )
+            except Exception as err:
+                # connection errors, timeouts and 5xx fail this delete only, not the whole cleanup
+                if not isinstance( err, Fault ) or not is_missing( err ):
+                    print( f'{ agent }: Zeep error: { step }: { err }' )
+                    result[ 'failed' ].append( step )
+                    journal.failed( agent, step, err )
+                    return
+                print( f'{ agent }: { missing }' )
+            result[ 'completed' ].append( step )
+            journal.done( agent, step )
+
+        if item[ 'cipc' ]:
+            remove( 'removePhone', 'removePhone', item[ 'cipc' ], 'CIPC already deleted.' )
+        if item[ 'profile' ]:
+            for device in logins.get( item[ 'profile' ], ( ) ):
+                print( f'{ agent }: Agent was logged into { device }. Phone log out initiated.' )
+                try:
+                    service.doDeviceLogout( deviceName = device )
+                except Exception as err:
+                    print( f'{ agent }: Zeep error: doDeviceLogout: { err }' )
+            remove( 'removeDeviceProfile', 'removeDeviceProfile', item[ 'profile' ], 'Device Profile already deleted.' )
+
+    with ThreadPoolExecutor( max_workers = max( 1, workers ) ) as pool:
+        list( pool.map( retire, queue ) )
+    return results
+
+
+def summary( results ):
+    completed = sum( len( result[ 'completed' ] ) for result in results.values() )
+    failed = [ agent for agent, result in results.items() if result[ 'failed' ] ]
+    text = f'{ completed } CIPCs/profiles deleted for { len( results ) } agents'
+    if failed:
+        text += f', failed for { len( failed ) }: ' + ', '.join( failed )
+    return text
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from axl_client import create_client, create_service
+    from journal import MigrationJournal
+    from mirror import open_mirror
+
+    load_dotenv()
+    parser = argparse.ArgumentParser( description = 'Delete the CIPCs and EM profiles left over by bulk_agent_migrator.py.' )
+    parser.add_argument( '--journal', default = 'migration journal.jsonl', help = 'journal of the bulk run (default: "migration journal.jsonl")' )
+    parser.add_argument( '--workers', type = int, default = 4, help = 'deletes running at the same time (default: 4)' )
+    parser.add_argument( '--rate', type = float, default = 10, help = 'AXL requests per second, 0 for no limit (default: 10)' )
+    args = parser.parse_args()
+
+    journal = MigrationJournal( args.journal )
+    queue = retired( journal )
+    print( f'{ len( queue ) } agents have a CIPC or device profile left to delete' )
+    service = create_service( create_client() )
+    started = time.perf_counter()
+    results = run_cleanup( service, journal, queue, workers = args.workers, rate = args.rate, mirror = open_mirror( service ) )
+    print( summary( results ) + f' in { time.perf_counter() - started:.1f}s' )
+    journal.close()
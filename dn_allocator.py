@@ -0,0 +1,228 @@
+"""Hand out free directory numbers (DNs) from a block, lowest first.
+
+new_agent.py used to download every line in the agent block, sort the patterns
+and take the highest + 1, which never reused gaps and let two admins pick the same
+number at the same time. DnAllocator keeps a bitmap of the used numbers in the
+block (saved to .axl_cache/ as a list of used ranges), checks the numbers it is
+about to hand out against CUCM with one small query, and retries with the next
+free number if addLine still finds the DN taken.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import json
+import time
+import tempfile
+import threading
+
+from zeep.exceptions import Fault
+
+import axl_sql
+from axl_client import CACHE_DIR
+from axl_list import iter_list
+
+DN_INDEX_TTL = int( os.getenv( 'AXL_DN_TTL', 60 * 60 ) )
+
+EXISTING_SQL = '''select dnorpattern from numplan where dnorpattern in ({patterns})'''
+
+
+class NoFreeDnError( Exception ):
+    pass
+
+
+def to_ranges( numbers ):
+    """[ 1, 2, 3, 7 ] -> [ [ 1, 3 ], [ 7, 7 ] ]"""
+    ranges = [ ]
+    for number in sorted( numbers ):
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append( [ number, number ] )
+    return ranges
+
+
+def existing_dns( service, dns ):
+    """The DNs in `dns` that already exist in CUCM, in any partition."""
+    if not dns:
+        return set()
+    rows = axl_sql.query( service, EXISTING_SQL.format( patterns = axl_sql.in_list( dns ) ) )
+    return { int( row['dnorpattern'] ) for row in rows if row['dnorpattern'].isdigit() }
+
+
+class DnAllocator:
+    """Free DNs of the block `prefix` followed by digits, `digits` long in total.
+
+    E.g. prefix '1216053' and 9 digits is 121605300 - 121605399. Safe to share
+    between threads. With a `mirror` (see mirror.py) the used numbers come from its
+    lines instead of listLine and the .axl_cache/ file. reserve() reloads them once
+    they are older than `ttl` seconds, so a long running process (see
+    migration_daemon.py) sees the numbers other tools took since it started."""
+
+    def __init__( self, service, prefix, digits, ttl = DN_INDEX_TTL, cache_dir = CACHE_DIR, mirror = None ):
+        self.service = service
+        self.mirror = mirror
+        self.prefix = prefix
+        self.first = int( prefix.ljust( digits, '0' ) )
+        self.last = int( prefix.ljust( digits, '9' ) )
+        self.ttl = ttl
+        self._path = os.path.join( cache_dir, f'dn-{ ( os.getenv( "CUCM_ADDRESS" ) or "default" ).replace( ":", "_" ) }-{prefix}.json' )
+        self._used = bytearray( self.last - self.first + 1 )
+        # handed out here and maybe not created in CUCM yet, a reload keeps them taken
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._loaded_at = 0
+        self._load()
+
+    def _load( self ):
+        if self.mirror is not None:
+            self.refresh()
+            return
+        try:
+            with open( self._path ) as f:
+                cached = json.load( f )
+            if time.time() - cached['loaded_at'] < self.ttl:
+                for start, end in cached['used']:
+                    self._mark( range( start, end + 1 ) )
+                self._loaded_at = cached['loaded_at']
+                return
+        except ( OSError, ValueError, KeyError ):
+            pass
+        self.refresh()
+
+    def refresh( self ):
+        """Reload the used numbers of the whole block from CUCM."""
+        used = bytearray( len( self._used ) )
+        if self.mirror is not None:
+            patterns = self.mirror.patterns( self.prefix )
+        else:
+            patterns = ( line['pattern'] for line in iter_list( self.service, 'listLine', { 'pattern': self.prefix + '%' }, { 'pattern': '' } ) )
+        for pattern in patterns:
+            if pattern.isdigit() and self.first <= int( pattern ) <= self.last:
+                used[ int( pattern ) - self.first ] = 1
+        with self._lock:
+            for dn in list( self._pending ):
+                if used[ dn - self.first ]:
+                    self._pending.discard( dn )
+                else:
+                    used[ dn - self.first ] = 1
+            self._used = used
+            self._loaded_at = time.time()
+            self._save()
+
+    def _mark( self, dns, value = 1 ):
+        for dn in dns:
+            if self.first <= dn <= self.last:
+                self._used[ dn - self.first ] = value
+
+    def _save( self ):
+        used = [ self.first + i for i, flag in enumerate( self._used ) if flag ]
+        os.makedirs( os.path.dirname( self._path ), exist_ok = True )
+        fd, tmp = tempfile.mkstemp( dir = os.path.dirname( self._path ), suffix = '.json' )
+        with os.fdopen( fd, 'w' ) as f:
+            json.dump( { 'loaded_at': self._loaded_at, 'used': to_ranges( used ) }, f )
+        os.replace( tmp, self._path )
+
+    def free_count( self ):
+        return self._used.count( 0 )
+
+    def mark_used( self, dn ):
+        with self._lock:
+            self._mark( [ dn ] )
+            self._save()
+
+    def release( self, dn ):
+        """Give back a reserved DN that was never created."""
+        with self._lock:
+            self._pending.discard( dn )
+            self._mark( [ dn ], 0 )
+            self._save()
+
+    def reserve( self, count = 1 ):
+        """Reserve and return the `count` lowest free DNs, gaps first.
+
+        The candidates are checked against CUCM before they are handed out, so
+        numbers added since the index was loaded are skipped."""
+        if time.time() - self._loaded_at >= self.ttl:
+            self.refresh()
+        with self._lock:
+            while True:
+                candidates = [ ]
+                position = self._used.find( 0 )
+                while position != -1 and len( candidates ) < count:
+                    candidates.append( self.first + position )
+                    position = self._used.find( 0, position + 1 )
+                if len( candidates ) < count:
+                    raise NoFreeDnError( f'Only {len( candidates )} free DNs left in {self.first} - {self.last}' )
+
+                try:
+                    if self.mirror is not None:
+                        self.mirror.sync()
+                        taken = { int( dn ) for dn in self.mirror.existing_patterns( candidates ) }
+                    else:
+                        taken = existing_dns( self.service, candidates )
+                except Fault:
+                    # no SQL access, add_line still catches a DN that turns out to be taken
+                    taken = set()
+                self._mark( candidates )
+                if not taken:
+                    self._pending.update( candidates )
+                    self._save()
+                    return candidates
+                # someone else created some of them, keep those marked and hand the rest back
+                self._mark( set( candidates ) - taken, 0 )
+
+    def claim( self, dn ):
+        """Mark one specific DN used if it is free, e.g. the secondary line that goes
+        with a primary. Returns False if it is already taken.
+
+        Numbers outside the block are only checked against CUCM."""
+        with self._lock:
+            if self.first <= dn <= self.last and self._used[ dn - self.first ]:
+                return False
+            try:
+                if self.mirror is not None:
+                    self.mirror.sync()
+                    taken = bool( self.mirror.existing_patterns( [ dn ] ) )
+                else:
+                    taken = bool( existing_dns( self.service, [ dn ] ) )
+            except Fault:
+                # no SQL access, the addLine still fails on a duplicate
+                taken = False
+            if self.first <= dn <= self.last:
+                self._mark( [ dn ] )
+                if not taken:
+                    self._pending.add( dn )
+                self._save()
+            return not taken
+
+    def add_line( self, build_line, attempts = 5 ):
+        """Reserve a DN and addLine it, moving on to the next DN if it turns out to be taken.
+
+        `build_line( dn )` returns the line to add. Returns ( dn, uuid of the new line )."""
+        for attempt in range( attempts ):
+            dn = self.reserve()[0]
+            try:
+                resp = self.service.addLine( build_line( dn ) )
+            except Fault as err:
+                # added by someone else between the check and the add
+                if 'duplicate' in str( err ).lower() and attempt < attempts - 1:
+                    continue
+                self.release( dn )
+                raise
+            return dn, resp['return']
@@ -0,0 +1,281 @@
+"""Spreads AXL reads over the CUCM nodes that have AXL enabled.
+
+By default every call goes to CUCM_ADDRESS (the publisher). Set AXL_READ_NODES to
+a comma separated list of nodes (host names, or full AXL URLs) and create_service()
+in axl_client.py returns a PooledService instead: writes still go to the
+publisher, reads (get*, list*, executeSQLQuery, see throttle.is_read) go to one of
+the read nodes, picked by AXL_READ_BALANCE:
+
+  least-outstanding   the node with the fewest reads in flight (default)
+  least-latency       the node with the lowest expected wait, its average read
+                      latency times its reads in flight plus one
+
+A node is taken out of the read rotation for a while when `eject_after` calls in
+a row failed on it (connection errors, timeouts, HTTP errors other than
+throttling) or when it answers `slow_factor` times (and at least `slow_margin`
+seconds) slower than the fastest node.
+A background thread probes every node with a one row listDevicePool and puts
+ejected nodes back once they answer in time again. A failed read is retried once
+on the publisher, and reads through a service that just wrote go to the publisher
+for a few seconds so they see their own writes before the subscribers replicate
+them, whichever thread makes them (e.g. axl_list.py's page prefetch). Give each
+job its own pin with PooledService.for_job().
+With no read node in rotation every read goes to the publisher.
+
+    AXL_READ_NODES=cucm-sub1.example.com,cucm-sub2.example.com python3 bulk_agent_migrator.py
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import time
+import threading
+from itertools import count
+
+from requests.exceptions import RequestException
+from zeep.exceptions import Fault, TransportError
+
+from axl_client import BINDING_NAME, service_url
+from throttle import is_read, is_throttled
+
+BALANCE = os.getenv( 'AXL_READ_BALANCE', 'least-outstanding' )
+
+# reads a node has to answer before its latency is compared with the other nodes
+MIN_SAMPLES = 10
+
+
+class Node:
+    """One CUCM node and the zeep service proxy bound to its AXL endpoint."""
+
+    def __init__( self, url, service ):
+        self.url = url
+        self.service = service
+        self.in_flight = 0
+        self.latency = None
+        self.samples = 0
+        self.probe_latency = None
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.reads = 0
+
+    def in_rotation( self, now ):
+        return now >= self.ejected_until
+
+
+class WritePin:
+    """When the calls sharing it last wrote, see EndpointPool.pin_seconds."""
+
+    def __init__( self ):
+        self.wrote = float( '-inf' )
+
+
+class EndpointPool:
+    """Routes AXL calls to the publisher or to one of `read_urls`, see the module docstring."""
+
+    def __init__( self, client, publisher_url, read_urls, balance = BALANCE, eject_after = 3, slow_factor = 3.0,
+                  slow_margin = 0.05, eject_seconds = 30, health_interval = 10, pin_seconds = 5 ):
+        if balance not in ( 'least-outstanding', 'least-latency' ):
+            raise ValueError( f'unknown AXL_READ_BALANCE { balance }, use least-outstanding or least-latency' )
+        self.publisher = Node( publisher_url, client.create_service( BINDING_NAME, publisher_url ) )
+        self.nodes = [ self.publisher if url == publisher_url else Node( url, client.create_service( BINDING_NAME, url ) )
+                       for url in read_urls ]
+        self.balance = balance
+        self.eject_after = eject_after
+        self.slow_factor = slow_factor
+        self.slow_margin = slow_margin
+        self.eject_seconds = eject_seconds
+        self.pin_seconds = pin_seconds
+        self._rotation = count()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        if self.nodes and health_interval:
+            threading.Thread( target = self._health_loop, args = ( health_interval, ), name = 'axl-health', daemon = True ).start()
+
+    def close( self ):
+        self._stop.set()
+
+    # routing
+
+    def _pick( self, pin ):
+        """The node the next read goes to, counted as in flight."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [ node for node in self.nodes if node.in_rotation( now ) ]
+            if not candidates or now - pin.wrote < self.pin_seconds:
+                node = self.publisher
+            else:
+                # start at a different node every time so ties are spread round robin
+                start = next( self._rotation ) % len( candidates )
+                candidates = candidates[ start: ] + candidates[ :start ]
+                if self.balance == 'least-latency':
+                    # nodes without a measurement yet go first so they get one
+                    node = min( candidates, key = lambda node: -1 if node.latency is None else node.latency * ( node.in_flight + 1 ) )
+                else:
+                    node = min( candidates, key = lambda node: node.in_flight )
+            node.in_flight += 1
+            node.reads += 1
+            return node
+
+    def call( self, name, args, kwargs, pin ):
+        """Run the AXL operation `name` on the node it should go to. `pin` is the
+        WritePin of the service making the call."""
+        if not is_read( name ):
+            with self._lock:
+                self.publisher.in_flight += 1
+            try:
+                return self._run( self.publisher, name, args, kwargs, read = False )
+            finally:
+                pin.wrote = time.monotonic()
+        node = self._pick( pin )
+        try:
+            return self._run( node, name, args, kwargs )
+        except ( RequestException, TransportError ) as err:
+            if node is self.publisher or is_throttled( err ):
+                raise
+        # reads change nothing, so the publisher can answer the one that failed
+        with self._lock:
+            self.publisher.in_flight += 1
+        return self._run( self.publisher, name, args, kwargs )
+
+    def _run( self, node, name, args, kwargs, read = True ):
+        started = time.perf_counter()
+        failed = False
+        try:
+            return getattr( node.service, name )( *args, **kwargs )
+        except Fault:
+            # CUCM answered, the node works
+            raise
+        except ( RequestException, TransportError ) as err:
+            failed = not is_throttled( err )
+            raise
+        finally:
+            self._release( node, time.perf_counter() - started, failed, read )
+
+    # health
+
+    def _release( self, node, seconds, failed, read = True ):
+        with self._lock:
+            node.in_flight -= 1
+            if failed:
+                node.failures += 1
+                if node.failures >= self.eject_after:
+                    self._eject( node )
+                return
+            node.failures = 0
+            if not read:
+                return
+            node.samples += 1
+            node.latency = seconds if node.latency is None else 0.9 * node.latency + 0.1 * seconds
+            others = [ other.latency for other in self.nodes
+                       if other is not node and other.samples >= MIN_SAMPLES and other.in_rotation( time.monotonic() ) ]
+            if node.samples >= MIN_SAMPLES and others and self._slow( node.latency, min( others ) ):
+                self._eject( node )
+
+    def _slow( self, seconds, fastest ):
+        # on a fast network a few ms of jitter can be a big factor, so it also has to be `slow_margin` slower
+        return seconds > max( self.slow_factor * fastest, fastest + self.slow_margin )
+
+    def _eject( self, node ):
+        if node in self.nodes and node.in_rotation( time.monotonic() ):
+            node.ejections += 1
+        node.ejected_until = time.monotonic() + self.eject_seconds
+
+    def probe( self, node ):
+        """Time a one row listDevicePool on `node`, None when it failed."""
+        started = time.perf_counter()
+        try:
+            node.service.listDevicePool( searchCriteria = { 'name': '%' }, returnedTags = { 'name': '' }, first = 1 )
+        except Fault:
+            pass
+        except ( RequestException, TransportError ):
+            return None
+        return time.perf_counter() - started
+
+    def check( self ):
+        """Probe every read node once, eject the ones that fail or are slow and put
+        ejected nodes that are fine again back into the rotation."""
+        results = [ ( node, self.probe( node ) ) for node in self.nodes ]
+        with self._lock:
+            answered = [ seconds for _, seconds in results if seconds is not None ]
+            fastest = min( answered ) if answered else None
+            for node, seconds in results:
+                node.probe_latency = seconds
+                if seconds is None or self._slow( seconds, fastest ):
+                    self._eject( node )
+                elif not node.in_rotation( time.monotonic() ):
+                    # back in, measured again from scratch
+                    node.ejected_until = 0.0
+                    node.failures = 0
+                    node.samples = 0
+                    node.latency = None
+
+    def _health_loop( self, interval ):
+        while not self._stop.wait( interval ):
+            try:
+                self.check()
+            except Exception:
+                pass
+
+    def describe( self ):
+        now = time.monotonic()
+        return ', '.join( f'{ node.url } { node.reads } reads'
+                          + ( f' { node.latency * 1000:.0f} ms' if node.latency is not None else '' )
+                          + ( '' if node.in_rotation( now ) else ' (ejected)' )
+                          + ( f', ejected { node.ejections }x' if node.ejections else '' )
+                          for node in self.nodes )
+
+
+class PooledService:
+    """Wraps an EndpointPool so the scripts keep calling service.getPhone(...) etc.
+    exactly as with a single zeep service proxy. With a retry_policy.CallPolicy a
+    call that failed on every node it was sent to goes through the pool again.
+
+    Reads go to the publisher for a few seconds after any write through the
+    service, from every thread; for_job() is a service with a pin of its own."""
+
+    def __init__( self, pool, policy = None, pin = None ):
+        self.pool = pool
+        self.policy = policy
+        self.pin = pin if pin is not None else WritePin()
+
+    def for_job( self ):
+        """The same pool and policy, pinned to the publisher by its own writes only."""
+        return PooledService( self.pool, self.policy )
+
+    def __getattr__( self, name ):
+        def call( *args, **kwargs ):
+            return self.pool.call( name, args, kwargs, self.pin )
+
+        if self.policy is None:
+            return call
+        # the policy verifies a write with reads that have to see it
+        return lambda *args, **kwargs: self.policy.call( name, call, args, kwargs, PooledService( self.pool, pin = self.pin ) )
+
+
+def node_url( node ):
+    """AXL URL of a node in AXL_READ_NODES, a host name or already a full URL."""
+    return node if '://' in node else service_url( node )
+
+
+def create_pooled_service( client, nodes = None, policy = None, **options ):
+    """PooledService over the publisher (see axl_client.service_url()) and `nodes`
+    (default: AXL_READ_NODES), calls going through `policy` when given."""
+    if nodes is None:
+        nodes = [ node.strip() for node in os.getenv( 'AXL_READ_NODES', '' ).split( ',' ) if node.strip() ]
+    return PooledService( EndpointPool( client, service_url(), [ node_url( node ) for node in nodes ], **options ), policy )
@@ -0,0 +1,77 @@
+"""Find the phones an extension mobility (EM) device profile is logged into.
+
+A device profile can't be removed while someone is logged in with it. Instead of
+downloading every phone in the cluster with listPhone('%') to find where it is logged
+in, this asks the extensionmobilitydynamic table directly.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from zeep.exceptions import Fault
+
+import axl_sql
+from axl_list import iter_list
+
+LOGGED_IN_SQL = '''select dp.name as profile, d.name as device from extensionmobilitydynamic emd
+    join device d on d.pkid = emd.fkdevice
+    join device dp on dp.pkid = emd.fkdevice_currentloginprofile
+    where lower(dp.name) in ({profiles})'''
+
+
+def logged_in_devices( service, profiles, mirror = None, chunk_size = 200 ):
+    """Return { profile: [ device names it is logged into ] } for every profile in `profiles`.
+
+    The profiles are looked up `chunk_size` at a time, CUCM rejects SQL statements
+    that are too long. Falls back to scanning every phone in the cluster only when the SQL query is
+    rejected, e.g. when the AXL user isn't allowed to run executeSQLQuery. With a
+    `mirror` (see mirror.py) it is asked first."""
+    profiles = list( profiles )
+    found = { profile: [ ] for profile in profiles }
+    if not profiles:
+        return found
+
+    if mirror is not None:
+        mirrored = { profile: mirror.logged_in( profile ) for profile in profiles }
+        # a login since the last sync isn't in the mirror yet, so only trust what it did find
+        if all( mirrored.values() ):
+            return mirrored
+
+    # CUCM treats device names as case insensitive, so match them that way too
+    by_name = { profile.lower(): profile for profile in profiles }
+
+    try:
+        rows = [ row for chunk in axl_sql.chunks( by_name, chunk_size )
+                 for row in axl_sql.query( service, LOGGED_IN_SQL.format( profiles = axl_sql.in_list( chunk ) ) ) ]
+    except Fault as err:
+        print( f'Zeep error: executeSQLQuery: { err }. Searching every phone instead.' )
+        return _scan_logged_in_devices( service, found, by_name )
+
+    for row in rows:
+        profile = by_name.get( row['profile'].lower() )
+        if profile is not None:
+            found[ profile ].append( row['device'] )
+    return found
+
+
+def _scan_logged_in_devices( service, found, by_name ):
+    # last resort, this pulls the whole phone inventory
+    for em_data in iter_list( service, 'listPhone', { 'name': '%' }, { 'name': '', 'currentProfileName': '' } ):
+        current = em_data['currentProfileName']['_value_1']
+        if current and current.lower() in by_name:
+            found[ by_name[ current.lower() ] ].append( em_data['name'] )
+    return found
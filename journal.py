@@ -0,0 +1,114 @@
+"""Append-only journal of the migration steps each agent has finished.
+
+Every completed step is written as one JSON line as soon as CUCM accepts it, so a
+bulk run that dies halfway (network blip, AXL timeout, unhandled error) can be
+started again with the same journal: finished agents are skipped and agents that
+were in flight pick up at the first step that wasn't done yet.
+
+A line that was only half written when the process died is ignored on replay.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import json
+import time
+import threading
+
+
+class MigrationJournal:
+    """Steps done per agent, replayed from `path` and appended to it. Thread safe.
+
+    With `resume=False` whatever is already in `path` is ignored (but kept)."""
+
+    def __init__( self, path, resume = True ):
+        self.path = path
+        self._agents = { }
+        self._lock = threading.Lock()
+        if resume and os.path.exists( path ):
+            self._replay()
+        self._file = open( path, 'a', encoding = 'utf-8' )
+        # a run killed halfway through a write leaves a partial last line, start on a new one
+        if self._file.tell() and not self._ends_with_newline():
+            self._file.write( '\n' )
+            self._file.flush()
+
+    def _ends_with_newline( self ):
+        with open( self.path, 'rb' ) as f:
+            f.seek( -1, os.SEEK_END )
+            return f.read( 1 ) == b'\n'
+
+    def _replay( self ):
+        with open( self.path, 'r', encoding = 'utf-8' ) as f:
+            for line in f:
+                try:
+                    entry = json.loads( line )
+                except ValueError:
+                    continue
+                agent = self._agent( entry[ 'agent' ] )
+                if 'error' in entry:
+                    # a failed attempt, the step is still to do
+                    continue
+                if entry[ 'step' ] == 'finished':
+                    agent[ 'status' ] = entry.get( 'status' )
+                else:
+                    agent[ 'steps' ][ entry[ 'step' ] ] = entry.get( 'data' ) or { }
+
+    def _agent( self, agent ):
+        return self._agents.setdefault( agent.lower(), { 'name': agent, 'steps': { }, 'status': None } )
+
+    def _append( self, entry ):
+        entry[ 'time' ] = round( time.time(), 3 )
+        line = json.dumps( entry ) + '\n'
+        with self._lock:
+            self._file.write( line )
+            self._file.flush()
+
+    def steps( self, agent ):
+        """{ step: data } of every step already done for `agent`, in the order they were done."""
+        with self._lock:
+            return dict( self._agent( agent )[ 'steps' ] )
+
+    def agents( self ):
+        """Every agent the journal has a step for, as first written."""
+        with self._lock:
+            return [ agent[ 'name' ] for agent in self._agents.values() ]
+
+    def status( self, agent ):
+        """Status the agent's last run finished with ('ok', 'partial', 'failed') or None."""
+        with self._lock:
+            return self._agent( agent )[ 'status' ]
+
+    def done( self, agent, step, **data ):
+        """Record that `step` is done for `agent`; `data` is handed back by steps() on resume."""
+        with self._lock:
+            self._agent( agent )[ 'steps' ][ step ] = data
+        self._append( { 'agent': agent, 'step': step, 'data': data } )
+
+    def failed( self, agent, step, error ):
+        """Record that `step` failed for `agent`. The step stays to do; the entry is for whoever reads the journal."""
+        self._append( { 'agent': agent, 'step': step, 'error': str( error ) } )
+
+    def finish( self, agent, status ):
+        with self._lock:
+            self._agent( agent )[ 'status' ] = status
+        self._append( { 'agent': agent, 'step': 'finished', 'status': status } )
+
+    def close( self ):
+        with self._lock:
+            self._file.close()
@@ -19,107 +19,76 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import csv
 import os
 import sys
 from traceback import print_tb
 from lxml import etree
-from requests import Session
-from zeep.cache import SqliteCache
-from requests.auth import HTTPBasicAuth
-from zeep.plugins import HistoryPlugin
-from zeep import Client, Settings, Plugin, xsd
-from zeep.transports import Transport
+from zeep import xsd
 from zeep.exceptions import Fault
-from urllib3 import disable_warnings
-from urllib3.exceptions import InsecureRequestWarning
+from axl_client import create_client, create_service
+from axl_read import read
+from tracing import create_tracer
+from prefetch import LDAP_DIRECTORY, prefetch_users, read_agents
+from mirror import open_mirror
+from migrator import script_parser
 
 # Edit .env file to specify your Webex site/user details
 from dotenv import load_dotenv
 load_dotenv()
 
-# The WSDL is a local file
-WSDL_FILE = 'schema/AXLAPI.wsdl'
+#the options are defined in migrator.py, which checks them before anything heavy is loaded
+args = script_parser( 'ldap-check' ).parse_args()
 
-# Change to true to enable output of request/response headers and XML
+# Change to true to also save the request/response XML of every AXL call to the trace file
 DEBUG = False
 
-# If you have a pem file certificate for CUCM, uncomment and define it here
+# Records timing, size and fault code of every AXL call (written to AXL_TRACE_FILE as
+# JSON lines in the background), show_history() prints the last request/response
+history = create_tracer( debug = DEBUG )
 
-#CERT = 'some.pem'
+# Create the Zeep client from the cached, pre-compiled AXL schema (see axl_client.py)
+client = create_client( tracer = history )
+service = create_service( client )
 
-# These values should work with a DevNet sandbox
-# You may need to change them if you are working with your own CUCM server
-
- 
-disable_warnings(InsecureRequestWarning)
-
-
-
-# This class lets you view the incoming and outgoing http headers and/or XML
-class MyLoggingPlugin( Plugin ):
-
-    def egress( self, envelope, http_headers, operation, binding_options ):
-
-        # Format the request body as pretty printed XML
-        xml = etree.tostring( envelope, pretty_print = True, encoding = 'unicode')
-
-        print( f'\nRequest\n-------\nHeaders:\n{http_headers}\n\nBody:\n{xml}' )
-
-    def ingress( self, envelope, http_headers, operation ):
-
-        # Format the response body as pretty printed XML
-        xml = etree.tostring( envelope, pretty_print = True, encoding = 'unicode')
-
-        print( f'\nResponse\n-------\nHeaders:\n{http_headers}\n\nBody:\n{xml}' )
-
-session = Session()
-
-# We avoid certificate verification by default, but you can uncomment and set
-# your certificate here, and comment out the False setting
-
-#session.verify = CERT
-session.verify = False
-session.auth = HTTPBasicAuth( os.getenv( 'AXL_USERNAME' ), os.getenv( 'AXL_PASSWORD' ) )
-
-# Create a Zeep transport and set a reasonable timeout value
-transport = Transport( session = session, timeout = 10 )
-
-# strict=False is not always necessary, but it allows zeep to parse imperfect XML
-settings = Settings( strict=False, xml_huge_tree=True )
-
-# If debug output is requested, add the MyLoggingPlugin callback
-plugin = [ MyLoggingPlugin() ] if DEBUG else [ ]
-
-# Create the Zeep client with the specified settings
-client = Client( WSDL_FILE, settings = settings, transport = transport,
-        plugins = plugin )
-history = HistoryPlugin()
-# service = client.create_service("{http://www.cisco.com/AXLAPIService/}AXLAPIBinding", CUCM_URL)
-service = client.create_service( '{http://www.cisco.com/AXLAPIService/}AXLAPIBinding',
-                                f'https://{os.getenv( "CUCM_ADDRESS" )}:8443/axl/' )
+#answer lookups from the local CUCM mirror when AXL_MIRROR=1 is set, see mirror.py
+mirror = open_mirror( service )
 
 #should output any errors coming from cucm while interacting with the program
 def show_history():
      for hist in [history.last_sent, history.last_received]:
-         print(etree.tostring(hist["envelope"], encoding='unicode', pretty_print=True))
-
-
-filename = 'agent list.csv'
-with open(filename, 'r') as csvfile:
-    datareader = csv.reader(csvfile)
-    for row in datareader:
-        enumber = row[0].capitalize()
-        try:
-            resp = service.getUser(userid=enumber)
-            ldap_status = resp['return']['user']['ldapDirectoryName']['_value_1']
-            first_name = resp['return']['user']['firstName']
-            last_name = resp['return']['user']['lastName']
-            if ldap_status == 'Memorial Hermann Directory Sync':
-                print(first_name + " " + last_name + " " + enumber + " is in Workday and is LDAP enabled.")
-            else:
-                print(first_name + " " + last_name + " " + enumber + " needs to update Workday.")
-
-        except Fault:
-            print("No End User found for " + enumber)
+         if hist:
+             print(etree.tostring(hist["envelope"], encoding='unicode', pretty_print=True))
+
+
+agents = [enumber.capitalize() for enumber in read_agents(args.csv)]
+
+#look every user up in a few queries instead of one getUser per agent
+try:
+    users = prefetch_users(service, agents, mirror = mirror)
+except Fault as err:
+    print( f'Zeep error: executeSQLQuery: { err }. Looking users up one at a time instead.' )
+    users = None
+
+for enumber in agents:
+    try:
+        if users is not None:
+            user = users[enumber]
+            if user is None:
+                raise Fault("No End User found for " + enumber)
+            ldap_status = user['ldapdirectoryname']
+            first_name = user['firstname']
+            last_name = user['lastname']
+        else:
+            user = read(service, 'end_user', 'getUser', userid=enumber)
+            ldap_status = user.get('ldapDirectoryName')
+            first_name = user.get('firstName')
+            last_name = user.get('lastName')
+        if ldap_status == LDAP_DIRECTORY:
+            print(first_name + " " + last_name + " " + enumber + " is in Workday and is LDAP enabled.")
+        else:
+            print(first_name + " " + last_name + " " + enumber + " needs to update Workday.")
+
+    except Fault:
+        print("No End User found for " + enumber)
+        if users is None:
             show_history()
@@ -0,0 +1,148 @@
+"""Per-operation AXL latency metrics.
+
+AxlMetrics listens to the TracingPlugin attached to the client, so it sees every
+call the scripts make through the service proxy. It keeps count, latency
+percentiles, payload sizes and fault counts per AXL operation, prints them as a
+table at the end of a run and exports them as JSON (or CSV) so runs against the
+same cluster can be compared.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import csv
+import json
+import math
+import sys
+import time
+import threading
+from collections import deque
+
+# Latencies kept per operation for the percentiles, count, max and total cover every call
+LATENCY_SAMPLES = 10000
+
+# Columns of the summary table and the CSV export
+FIELDS = ( 'operation', 'count', 'faults', 'errors', 'p50', 'p95', 'p99', 'max', 'total_seconds',
+           'avg_request_bytes', 'avg_response_bytes' )
+
+
+def percentile( values, pct ):
+    """Nearest-rank percentile of the already sorted `values`."""
+    if not values:
+        return None
+    rank = max( 1, math.ceil( pct / 100 * len( values ) ) )
+    return values[ rank - 1 ]
+
+
+class OperationStats:
+    """Everything recorded for one AXL operation. The percentiles are of the last
+    `samples` calls, so a long running process (see migration_daemon.py) doesn't
+    keep every latency it ever saw."""
+
+    def __init__( self, operation, samples = LATENCY_SAMPLES ):
+        self.operation = operation
+        self.latencies = deque( maxlen = samples )
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max = None
+        self.faults = 0
+        self.errors = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+    def add( self, record ):
+        self.latencies.append( record.seconds )
+        self.count += 1
+        self.total_seconds += record.seconds
+        self.max = record.seconds if self.max is None else max( self.max, record.seconds )
+        self.request_bytes += record.request_bytes or 0
+        self.response_bytes += record.response_bytes or 0
+        if record.fault_code:
+            self.faults += 1
+        if record.error:
+            self.errors += 1
+
+    def summary( self ):
+        latencies = sorted( self.latencies )
+        count = self.count
+        return {
+            'operation': self.operation,
+            'count': count,
+            'faults': self.faults,
+            'errors': self.errors,
+            'p50': percentile( latencies, 50 ),
+            'p95': percentile( latencies, 95 ),
+            'p99': percentile( latencies, 99 ),
+            'max': self.max,
+            'total_seconds': self.total_seconds,
+            'avg_request_bytes': round( self.request_bytes / count ) if count else 0,
+            'avg_response_bytes': round( self.response_bytes / count ) if count else 0,
+        }
+
+
+class AxlMetrics:
+    """Collects OperationStats from `tracer` (a tracing.TracingPlugin), thread safe."""
+
+    def __init__( self, tracer = None ):
+        self.started = time.time()
+        self.operations = { }
+        self._lock = threading.Lock()
+        if tracer is not None:
+            tracer.listeners.append( self.record )
+
+    def record( self, record ):
+        with self._lock:
+            stats = self.operations.get( record.operation )
+            if stats is None:
+                stats = self.operations[ record.operation ] = OperationStats( record.operation )
+            stats.add( record )
+
+    def summary( self ):
+        """One dict per operation, the operation with the most total time first."""
+        with self._lock:
+            rows = [ stats.summary() for stats in self.operations.values() ]
+        return sorted( rows, key = lambda row: row[ 'total_seconds' ], reverse = True )
+
+    def print_table( self, file = sys.stdout ):
+        rows = self.summary()
+        if not rows:
+            return
+        print( '\n' + '-' * 10, file = file )
+        print( 'AXL calls', file = file )
+        print( '-' * 10, file = file )
+        print( f"{'Operation':<24}{'Count':>7}{'Faults':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+               f"{'Total s':>9}{'Req B':>9}{'Resp B':>10}", file = file )
+        for row in rows:
+            print( f"{row['operation']:<24}{row['count']:>7}{row['faults'] + row['errors']:>8}"
+                   f"{row['p50'] * 1000:>9.0f}{row['p95'] * 1000:>9.0f}{row['p99'] * 1000:>9.0f}"
+                   f"{row['total_seconds']:>9.1f}{row['avg_request_bytes']:>9}{row['avg_response_bytes']:>10}", file = file )
+
+    def export( self, path, **run_info ):
+        """Write the summary to `path`, as CSV if it ends in .csv and JSON otherwise.
+
+        `run_info` (workers, rate, ...) is stored with the JSON export so runs can be
+        told apart."""
+        rows = self.summary()
+        if path.lower().endswith( '.csv' ):
+            with open( path, 'w', newline = '' ) as f:
+                writer = csv.DictWriter( f, fieldnames = FIELDS )
+                writer.writeheader()
+                writer.writerows( rows )
+            return
+        with open( path, 'w' ) as f:
+            json.dump( { 'started': self.started, 'finished': time.time(), 'run': run_info,
+                         'operations': rows }, f, indent = 2 )
@@ -0,0 +1,502 @@
+"""Resident migration service: one warm AXL client for every operator's jobs.
+
+Every script run loads the AXL schema, builds the zeep client, opens a TLS
+connection and authenticates before its first useful call, and throws all of it
+away at the end. This keeps it loaded: the sync and the asyncio client, their
+connection pools and CUCM session cookie, the mirror (AXL_MIRROR=1), the device
+pool catalog and the DN allocator. Operators submit jobs to it over a local HTTP
+API (or a Unix socket); the jobs wait in one queue and a few run at a time, all
+of their AXL calls drawing from one rate budget, so several operators at once
+don't overload CUCM.
+
+    python3 migration_daemon.py serve --rate 20                 # keep running
+    python3 migration_daemon.py submit migrate --csv "agent list.csv" --wait
+    python3 migration_daemon.py submit onboard --manifest "new agents.csv"
+    python3 migration_daemon.py submit ldap-check --csv "agent list.csv"
+    python3 migration_daemon.py status                           # queue, AXL numbers
+    python3 migration_daemon.py job 3f2a9c1e0b7d                 # one job and its results
+
+Every request carries the token from the daemon's token file (readable by its
+owner only) as "Authorization: Bearer <token>"; give operators a copy of the
+file, or its path with --token-file. The API is JSON: POST /jobs with { "kind": "migrate" | "onboard" | "ldap-check",
+"agents": [ ... ] } and the kind's options, GET /jobs, GET /jobs/<id>, GET /status.
+migrate jobs take "device_pool", "concurrency", "journal" (a file in the daemon's
+--journal-dir) and "cleanup"; their steps are journaled like bulk_agent_migrator.py's,
+so the same journal can be resumed by either. A migrate job is refused while another
+queued or running one has any of its agents. onboard jobs take the manifest rows of new_agent.py --manifest.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import sys
+import json
+import time
+import hmac
+import uuid
+import queue
+import secrets
+import tempfile
+import signal
+import socket
+import asyncio
+import argparse
+import threading
+import http.client
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from axl_async import AsyncLimitedService, create_async_client, create_async_service, migrate_agents
+from axl_client import CACHE_DIR, create_client, create_service, create_session
+from catalog import load_catalog
+from cleanup import retired, run_cleanup
+from dn_allocator import DnAllocator
+from endpoint_pool import PooledService
+from journal import MigrationJournal
+from metrics import AxlMetrics
+from mirror import open_mirror
+from onboarding import AGENT_DN_DIGITS, AGENT_DN_PREFIX, onboard_agents, resolve_device_pool
+from prefetch import LDAP_DIRECTORY, manifest_rows, prefetch_users, read_agents, read_manifest
+from retry_policy import default_policy
+from throttle import AdaptiveService, AimdController, RateLimiter, RateLimitedService
+from tracing import create_tracer
+
+DEFAULT_PORT = 8470
+
+JOB_KINDS = ( 'migrate', 'onboard', 'ldap-check' )
+
+# the API token, created by the first `serve`
+TOKEN_FILE = os.path.join( CACHE_DIR, 'daemon-token' )
+
+DEFAULT_JOURNAL = 'migration journal.jsonl'
+
+# finished jobs are forgotten after JOB_TTL seconds, and beyond the MAX_FINISHED_JOBS newest
+JOB_TTL = 24 * 60 * 60
+MAX_FINISHED_JOBS = 200
+
+
+class Job:
+    """One submitted job, its state and, once it is done, its results."""
+
+    def __init__( self, kind, params ):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.status = 'queued'
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.results = None
+        self.error = None
+
+    def to_dict( self, results = True ):
+        job = { 'id': self.id, 'kind': self.kind, 'status': self.status, 'agents': len( self.params[ 'agents' ] ),
+                'submitted': self.submitted, 'started': self.started, 'finished': self.finished, 'error': self.error }
+        if results:
+            job[ 'results' ] = self.results
+        return job
+
+
+class MigrationDaemon:
+    """The warm clients, the job queue and `workers` threads running jobs from it.
+
+    Every AXL call of every job waits on one RateLimiter of `rate` requests per
+    second (0 for no limit); the sync client also adapts how many requests it has in
+    flight (at most `max_in_flight`) to how CUCM copes, see throttle.py. migrate
+    jobs keep their journals in `journal_dir`."""
+
+    def __init__( self, workers = 2, rate = 20, max_in_flight = 16, journal_dir = '.' ):
+        self.journal_dir = os.path.realpath( journal_dir )
+        self.tracer = create_tracer()
+        self.metrics = AxlMetrics( self.tracer )
+        self.limiter = RateLimiter( rate )
+        self.controller = AimdController( maximum = max_in_flight ) if max_in_flight else None
+
+        # onboarding, LDAP checks and the cleanup phase use the threaded client
+        service = create_service( create_client( tracer = self.tracer, session = create_session( pool_size = max_in_flight or 10 ) ) )
+        # with AXL_READ_NODES set its reads are spread over those nodes, see endpoint_pool.py
+        self.pooled = service if isinstance( service, PooledService ) else None
+        self.nodes = service.pool if self.pooled else None
+        self.service = self._limited( service )
+
+        # migrations run as coroutines on an event loop of their own, see axl_async.py
+        self.loop = asyncio.new_event_loop()
+        threading.Thread( target = self.loop.run_forever, name = 'axl-async', daemon = True ).start()
+        self.async_client = create_async_client( max_connections = max_in_flight or 100, tracer = self.tracer )
+        self.async_service = AsyncLimitedService( create_async_service( self.async_client ), max_in_flight = max_in_flight or 100,
+                                                  limiter = self.limiter )
+
+        self.mirror = open_mirror( self.service )
+        self.allocator = DnAllocator( self.service, AGENT_DN_PREFIX, AGENT_DN_DIGITS, mirror = self.mirror )
+        self.journals = { }
+        self.jobs = { }
+        self.queue = queue.Queue()
+        self._lock = threading.Lock()
+        for n in range( max( 1, workers ) ):
+            threading.Thread( target = self._work, name = f'job-worker-{ n }', daemon = True ).start()
+
+    def _limited( self, service ):
+        if self.controller:
+            service = AdaptiveService( service, self.controller )
+        return RateLimitedService( service, self.limiter )
+
+    def _job_service( self ):
+        """The threaded service for one job. With read nodes each job gets its own
+        pin, so one job's writes don't send the other jobs' reads to the publisher."""
+        return self._limited( self.pooled.for_job() ) if self.pooled else self.service
+
+    def submit( self, kind, params ):
+        """Queue a job, returns it. ValueError when the request doesn't make sense."""
+        if kind not in JOB_KINDS:
+            raise ValueError( f'unknown job kind { kind }, use one of { ", ".join( JOB_KINDS ) }' )
+        agents = params.get( 'agents' )
+        if not isinstance( agents, list ) or not agents:
+            raise ValueError( 'agents must be a non-empty list' )
+        if kind == 'onboard':
+            params[ 'agents' ] = manifest_rows( agents )
+        else:
+            params[ 'agents' ] = [ str( agent ).strip() for agent in agents if str( agent ).strip() ]
+        if kind == 'migrate':
+            params[ 'journal' ] = self.journal_path( params.get( 'journal' ) )
+        job = Job( kind, params )
+        with self._lock:
+            self._forget_old_jobs()
+            if kind == 'migrate':
+                mine = { enumber.lower() for enumber in params[ 'agents' ] }
+                for other in self.jobs.values():
+                    if other.kind == 'migrate' and other.status in ( 'queued', 'running' ):
+                        busy = sorted( mine & { enumber.lower() for enumber in other.params[ 'agents' ] } )
+                        if busy:
+                            raise ValueError( f'job { other.id } is already migrating { ", ".join( busy[:10] ) }'
+                                              + ( f' and { len( busy ) - 10 } more' if len( busy ) > 10 else '' ) )
+            self.jobs[ job.id ] = job
+        print( f'job { job.id }: { kind } for { len( params[ "agents" ] ) } agents queued' )
+        self.queue.put( job )
+        return job
+
+    def journal_path( self, path ):
+        """Where the journal `path` (relative to the journal directory) is. ValueError
+        when it is outside of it, the daemon appends to it with its own rights."""
+        resolved = os.path.realpath( os.path.join( self.journal_dir, path or DEFAULT_JOURNAL ) )
+        if os.path.commonpath( [ resolved, self.journal_dir ] ) != self.journal_dir or resolved == self.journal_dir:
+            raise ValueError( f'journal must be a file in { self.journal_dir }' )
+        return resolved
+
+    def _forget_old_jobs( self ):
+        finished = sorted( ( job for job in self.jobs.values() if job.finished is not None ), key = lambda job: job.finished )
+        expired = time.time() - JOB_TTL
+        for n, job in enumerate( finished ):
+            if job.finished < expired or n < len( finished ) - MAX_FINISHED_JOBS:
+                del self.jobs[ job.id ]
+
+    def job( self, job_id ):
+        with self._lock:
+            return self.jobs.get( job_id )
+
+    def list_jobs( self ):
+        with self._lock:
+            return list( self.jobs.values() )
+
+    def status( self ):
+        jobs = self.list_jobs()
+        return {
+            'jobs': { state: sum( job.status == state for job in jobs ) for state in ( 'queued', 'running', 'done', 'failed' ) },
+            'rate': self.limiter.rate,
+            'in_flight': self.controller.describe() if self.controller else None,
+            'read_nodes': self.nodes.describe() if self.nodes else None,
+            'deadlines': default_policy().describe() if default_policy() else None,
+            'mirror': self.mirror is not None,
+            'free_dns': self.allocator.free_count(),
+            'axl': self.metrics.summary(),
+        }
+
+    def _work( self ):
+        while True:
+            job = self.queue.get()
+            job.status = 'running'
+            job.started = time.time()
+            print( f'job { job.id }: { job.kind } started' )
+            try:
+                if self.mirror is not None:
+                    self.mirror.sync()
+                job.results = getattr( self, 'run_' + job.kind.replace( '-', '_' ) )( job.params )
+                job.status = 'done'
+            except Exception as err:
+                job.error = f'{ type( err ).__name__ }: { err }'
+                job.status = 'failed'
+            job.finished = time.time()
+            print( f'job { job.id }: { job.kind } { job.status } in { job.finished - job.started:.1f}s' )
+            self.queue.task_done()
+
+    def _journal( self, path ):
+        with self._lock:
+            if path not in self.journals:
+                self.journals[ path ] = MigrationJournal( path )
+            return self.journals[ path ]
+
+    def run_migrate( self, params ):
+        """The bulk_agent_migrator.py steps for every agent, then the cleanup phase."""
+        agents = params[ 'agents' ]
+        journal = self._journal( params[ 'journal' ] )
+        device_pool = None
+        if params.get( 'device_pool' ):
+            device_pool = resolve_device_pool( load_catalog( self.service, 'devicePool', mirror = self.mirror ), params[ 'device_pool' ] )
+        pending = [ enumber for enumber in agents if journal.status( enumber ) != 'ok' ]
+        results = asyncio.run_coroutine_threadsafe(
+            migrate_agents( self.async_service, pending, concurrency = int( params.get( 'concurrency', 8 ) ),
+                            device_pool = device_pool, journal = journal ), self.loop ).result()
+
+        if params.get( 'cleanup', True ):
+            mine = { enumber.lower() for enumber in agents }
+            cleanup_queue = [ item for item in retired( journal ) if item[ 'agent' ].lower() in mine ]
+            cleaned = run_cleanup( self._job_service(), journal, cleanup_queue, rate = 0, mirror = self.mirror )
+            for result in results:
+                if result[ 'agent' ] in cleaned:
+                    result[ 'completed' ] += cleaned[ result[ 'agent' ] ][ 'completed' ]
+                    result[ 'failed' ] += cleaned[ result[ 'agent' ] ][ 'failed' ]
+                    if result[ 'failed' ] and result[ 'status' ] == 'ok':
+                        result[ 'status' ] = 'partial'
+        skipped = [ { 'agent': enumber, 'status': 'already migrated' } for enumber in agents if enumber not in pending ]
+        return skipped + results
+
+    def run_onboard( self, params ):
+        """new_agent.py --manifest for the job's manifest rows."""
+        catalog = load_catalog( self.service, 'devicePool', mirror = self.mirror )
+        return onboard_agents( self._job_service(), params[ 'agents' ], self.allocator, catalog,
+                               workers = int( params.get( 'workers', 4 ) ), mirror = self.mirror )
+
+    def run_ldap_check( self, params ):
+        """ldap_check.py: is every agent's end user synced from Workday."""
+        agents = [ enumber.capitalize() for enumber in params[ 'agents' ] ]
+        users = prefetch_users( self._job_service(), agents, mirror = self.mirror )
+        results = [ ]
+        for enumber in agents:
+            user = users[ enumber ]
+            if user is None:
+                status = 'no end user'
+            elif user[ 'ldapdirectoryname' ] == LDAP_DIRECTORY:
+                status = 'ldap'
+            else:
+                status = 'needs workday update'
+            results.append( { 'agent': enumber, 'status': status, 'firstname': user and user[ 'firstname' ],
+                              'lastname': user and user[ 'lastname' ] } )
+        return results
+
+
+class _Handler( BaseHTTPRequestHandler ):
+    protocol_version = 'HTTP/1.1'
+
+    def _reply( self, status, body ):
+        data = json.dumps( body, default = str ).encode()
+        self.send_response( status )
+        self.send_header( 'Content-Type', 'application/json' )
+        self.send_header( 'Content-Length', str( len( data ) ) )
+        self.end_headers()
+        self.wfile.write( data )
+
+    def _authorized( self ):
+        token = self.headers.get( 'Authorization', '' ).partition( 'Bearer ' )[2]
+        if token and hmac.compare_digest( token.encode(), self.server.token.encode() ):
+            return True
+        self._reply( 401, { 'error': 'missing or wrong token' } )
+        return False
+
+    def do_GET( self ):
+        if not self._authorized():
+            return
+        daemon = self.server.migration_daemon
+        if self.path == '/status':
+            return self._reply( 200, daemon.status() )
+        if self.path == '/jobs':
+            return self._reply( 200, [ job.to_dict( results = False ) for job in daemon.list_jobs() ] )
+        if self.path.startswith( '/jobs/' ):
+            job = daemon.job( self.path[ len( '/jobs/' ): ] )
+            if job is not None:
+                return self._reply( 200, job.to_dict() )
+        self._reply( 404, { 'error': 'not found' } )
+
+    def do_POST( self ):
+        if not self._authorized():
+            return
+        if self.path != '/jobs':
+            return self._reply( 404, { 'error': 'not found' } )
+        try:
+            request = json.loads( self.rfile.read( int( self.headers.get( 'Content-Length', 0 ) ) ) or b'{}' )
+            job = self.server.migration_daemon.submit( request.pop( 'kind', None ), request )
+        except ValueError as err:
+            return self._reply( 400, { 'error': str( err ) } )
+        self._reply( 202, job.to_dict() )
+
+    def address_string( self ):
+        # Unix socket clients have no address
+        return str( self.client_address[0] ) if self.client_address else 'local'
+
+    def log_message( self, format, *args ):
+        pass
+
+
+class _TcpServer( ThreadingHTTPServer ):
+    daemon_threads = True
+
+
+class _UnixServer( socketserver.ThreadingMixIn, socketserver.UnixStreamServer ):
+    daemon_threads = True
+
+
+def load_token( path = TOKEN_FILE, create = False ):
+    """The API token in `path`, a new one when `create` and there is none yet.
+
+    The file has to be readable by its owner only."""
+    if create and not os.path.exists( path ):
+        os.makedirs( os.path.dirname( path ) or '.', exist_ok = True )
+        # mkstemp creates the file with mode 0600
+        fd, tmp = tempfile.mkstemp( dir = os.path.dirname( path ) or '.' )
+        with os.fdopen( fd, 'w' ) as f:
+            f.write( secrets.token_urlsafe( 32 ) )
+        os.replace( tmp, path )
+    try:
+        if os.stat( path ).st_mode & 0o077:
+            raise SystemExit( f'{ path } is readable by others, chmod 600 it' )
+        with open( path ) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        raise SystemExit( f'no daemon token in { path }, start the daemon first or pass --token-file' )
+
+
+def serve( daemon, host = '127.0.0.1', port = DEFAULT_PORT, socket_path = None, token_file = TOKEN_FILE ):
+    """Serve the job API of `daemon` until interrupted, on `socket_path` if given."""
+    if socket_path:
+        if os.path.exists( socket_path ):
+            os.unlink( socket_path )
+        # created 0660 right away, operators in the file's group may connect too
+        umask = os.umask( 0o117 )
+        try:
+            server = _UnixServer( socket_path, _Handler )
+        finally:
+            os.umask( umask )
+        where = socket_path
+    else:
+        server = _TcpServer( ( host, port ), _Handler )
+        where = f'http://{ host }:{ port }/'
+    server.migration_daemon = daemon
+    server.token = load_token( token_file, create = True )
+    # stopped by a service manager: clean up like on Ctrl-C
+    signal.signal( signal.SIGTERM, lambda signum, frame: sys.exit( 0 ) )
+    print( f'Migration daemon listening on { where }, Ctrl-C to stop' )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path:
+            os.unlink( socket_path )
+
+
+class _UnixConnection( http.client.HTTPConnection ):
+    def __init__( self, path ):
+        super().__init__( 'localhost' )
+        self.path = path
+
+    def connect( self ):
+        self.sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+        self.sock.connect( self.path )
+
+
+def call( args, method, path, body = None ):
+    """Send one API request to the daemon, returns ( status, decoded JSON )."""
+    connection = _UnixConnection( args.socket ) if args.socket else http.client.HTTPConnection( args.host, args.port )
+    try:
+        connection.request( method, path, body = json.dumps( body ) if body is not None else None,
+                            headers = { 'Content-Type': 'application/json', 'Authorization': 'Bearer ' + load_token( args.token_file ) } )
+        response = connection.getresponse()
+        return response.status, json.loads( response.read() or b'null' )
+    except OSError as err:
+        raise SystemExit( f'migration daemon not reachable ({ err }), start it with: python3 migration_daemon.py serve' )
+    finally:
+        connection.close()
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser( description = 'Run, or submit jobs to, the resident migration service.' )
+    parser.add_argument( '--host', default = '127.0.0.1' )
+    parser.add_argument( '--port', type = int, default = DEFAULT_PORT, help = f'API port (default: { DEFAULT_PORT })' )
+    parser.add_argument( '--socket', metavar = 'PATH', help = 'use a Unix socket instead of the TCP port' )
+    parser.add_argument( '--token-file', default = TOKEN_FILE, help = f'API token, created by serve (default: { TOKEN_FILE })' )
+    commands = parser.add_subparsers( dest = 'command', required = True )
+
+    serve_cmd = commands.add_parser( 'serve', help = 'run the daemon' )
+    serve_cmd.add_argument( '--workers', type = int, default = 2, help = 'jobs running at the same time (default: 2)' )
+    serve_cmd.add_argument( '--rate', type = float, default = 20, help = 'AXL requests per second for all jobs together, 0 for no cap (default: 20)' )
+    serve_cmd.add_argument( '--max-in-flight', type = int, default = 16, help = 'most AXL requests in flight (default: 16)' )
+    serve_cmd.add_argument( '--journal-dir', default = '.', help = 'migrate jobs can only use journals in this directory (default: the current one)' )
+
+    submit = commands.add_parser( 'submit', help = 'queue a job' )
+    submit.add_argument( 'kind', choices = JOB_KINDS )
+    submit.add_argument( '--csv', default = 'agent list.csv', help = 'E#s for migrate/ldap-check (default: "agent list.csv")' )
+    submit.add_argument( '--manifest', help = 'CSV or JSON manifest for onboard, see onboarding.py' )
+    submit.add_argument( '--device-pool', help = 'migrate: device pool (or cost center) for every CSF instead of the CIPC\'s' )
+    submit.add_argument( '--concurrency', type = int, default = 8, help = 'migrate: agents in flight at a time (default: 8)' )
+    submit.add_argument( '--journal', help = f'migrate: journal to record the steps in, a file in the daemon\'s --journal-dir (default: "{ DEFAULT_JOURNAL }")' )
+    submit.add_argument( '--no-cleanup', action = 'store_true', help = 'migrate: leave the CIPCs and profiles for cleanup.py' )
+    submit.add_argument( '--wait', action = 'store_true', help = 'wait for the job to finish and print its results' )
+
+    commands.add_parser( 'status', help = 'queue and AXL numbers' )
+    job_cmd = commands.add_parser( 'job', help = 'show a job and its results' )
+    job_cmd.add_argument( 'id' )
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve( MigrationDaemon( workers = args.workers, rate = args.rate, max_in_flight = args.max_in_flight, journal_dir = args.journal_dir ),
+               args.host, args.port, args.socket, args.token_file )
+        return
+
+    if args.command == 'submit':
+        if args.kind == 'onboard':
+            if not args.manifest:
+                parser.error( 'onboard needs --manifest' )
+            request = { 'kind': 'onboard', 'agents': read_manifest( args.manifest ) }
+        else:
+            request = { 'kind': args.kind, 'agents': read_agents( args.csv ) }
+        if args.kind == 'migrate':
+            request.update( device_pool = args.device_pool, concurrency = args.concurrency, cleanup = not args.no_cleanup )
+            if args.journal:
+                request[ 'journal' ] = args.journal
+        status, job = call( args, 'POST', '/jobs', request )
+        if status != 202:
+            raise SystemExit( job[ 'error' ] )
+        print( f"job { job['id'] }: { job['kind'] } for { job['agents'] } agents { job['status'] }" )
+        while args.wait and job[ 'status' ] in ( 'queued', 'running' ):
+            time.sleep( 1 )
+            status, job = call( args, 'GET', '/jobs/' + job[ 'id' ] )
+        if args.wait:
+            print( json.dumps( job, indent = 2 ) )
+    elif args.command == 'status':
+        print( json.dumps( call( args, 'GET', '/status' )[1], indent = 2 ) )
+    elif args.command == 'job':
+        status, job = call( args, 'GET', '/jobs/' + args.id )
+        if status != 200:
+            raise SystemExit( 'no job ' + args.id )
+        print( json.dumps( job, indent = 2 ) )
+
+
+if __name__ == '__main__':
+    main()
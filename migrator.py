@@ -0,0 +1,226 @@
+"""One command for the migration scripts, quick to start.
+
+    python3 migrator.py migrate          agent_migrator.py: one agent, through prompts
+    python3 migrator.py bulk-migrate     bulk_agent_migrator.py: every agent of a CSV
+    python3 migrator.py cipc-to-csf      cipc_to_csf.py: an agent with a CIPC and no EM profile
+    python3 migrator.py new-agent        new_agent.py: a new agent, or a --manifest of them
+    python3 migrator.py ldap-check       ldap_check.py: which agents of a CSV are LDAP synced
+
+The scripts import zeep, lxml and requests, read .env and build the AXL client as
+soon as they start. This module only imports argparse and the input readers of
+prefetch.py, so --help, a missing or empty input file and --dry-run (check the
+input, say what would be done and stop) answer in milliseconds. The script is
+loaded when the command is about to talk to CUCM. The scripts take their options
+from here too, so running them directly still works and accepts the same ones.
+benchmarks/cli_startup.py measures both ways.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import os
+import re
+import runpy
+import sys
+from collections import Counter
+
+from journal import MigrationJournal
+from prefetch import read_agents, read_manifest
+
+BASE_DIR = os.path.dirname( os.path.abspath( __file__ ) )
+
+# command: ( script, description )
+COMMANDS = {
+    'migrate': ( 'agent_migrator.py', 'Migrate one agent from CIPC to Jabber, asking for the E# and the cost center.' ),
+    'bulk-migrate': ( 'bulk_agent_migrator.py', 'Migrate every agent in a CSV file from CIPC to Jabber.' ),
+    'cipc-to-csf': ( 'cipc_to_csf.py', 'Replace the CIPC of an agent without an EM profile with a CSF.' ),
+    'new-agent': ( 'new_agent.py', 'Onboard a new agent, or a whole manifest of agents with --manifest.' ),
+    'ldap-check': ( 'ldap_check.py', 'Check which agents in a CSV file are LDAP synced from Workday.' ),
+}
+
+# what an E# in the agent CSVs looks like
+ENUMBER_RE = re.compile( r'[eE]\d+' )
+
+
+def bulk_options( parser ):
+    parser.add_argument( '--csv', default = 'agent list.csv', help = 'CSV with one E# per row (default: "agent list.csv")' )
+    parser.add_argument( '--workers', type = int, default = 1, help = 'number of agents migrated at the same time (default: 1)' )
+    parser.add_argument( '--rate', type = float, default = 0, help = 'hard cap on AXL requests per second across all workers, 0 for no cap (default: 0)' )
+    parser.add_argument( '--max-in-flight', type = int, default = 16,
+                         help = 'most AXL requests in flight; how many are actually allowed adapts to how CUCM copes, 0 turns that off (default: 16)' )
+    parser.add_argument( '--results', help = 'also write the per-agent results to this CSV file' )
+    parser.add_argument( '--app-user-batch', type = int, default = 0, metavar = 'N',
+                         help = 'associate pguser/zoomjtapi for N agents at a time with one SQL insert per app user (default: one agent at a time)' )
+    parser.add_argument( '--metrics', metavar = 'FILE',
+                         help = 'write per-operation AXL latency/size/fault numbers to FILE (.json, or .csv)' )
+    parser.add_argument( '--journal', default = 'migration journal.jsonl',
+                         help = 'steps finished per agent are recorded here, re-running with the same journal resumes where it stopped (default: "migration journal.jsonl")' )
+    parser.add_argument( '--no-resume', action = 'store_true',
+                         help = 'ignore what is already in the journal and run every step for every agent' )
+    parser.add_argument( '--no-prefetch', action = 'store_true',
+                         help = 'look every agent up when it is migrated instead of the whole CSV up front' )
+    parser.add_argument( '--cleanup-workers', type = int, default = 4,
+                         help = 'CIPCs/device profiles deleted at the same time in the cleanup phase (default: 4)' )
+    parser.add_argument( '--cleanup-rate', type = float, default = 10,
+                         help = 'AXL requests per second for the cleanup phase, 0 for no limit (default: 10)' )
+    parser.add_argument( '--no-cleanup', action = 'store_true',
+                         help = "don't delete the CIPCs and device profiles now, run cleanup.py on the journal later" )
+
+
+def new_agent_options( parser ):
+    parser.add_argument( '--manifest', help = 'CSV (with a header row) or JSON file of agents to onboard without prompts, see onboarding.py' )
+    parser.add_argument( '--workers', type = int, default = 4, help = 'agents onboarded at the same time with --manifest (default: 4)' )
+    parser.add_argument( '--rate', type = float, default = 0, help = 'hard cap on AXL requests per second across all workers, 0 for no cap (default: 0)' )
+    parser.add_argument( '--max-in-flight', type = int, default = 16,
+                         help = 'most AXL requests in flight; how many are actually allowed adapts to how CUCM copes, 0 turns that off (default: 16)' )
+    parser.add_argument( '--results', default = 'onboarding results.json', help = 'where --manifest writes its results (default: "onboarding results.json")' )
+    parser.add_argument( '--metrics', metavar = 'FILE', help = 'with --manifest, write per-operation AXL latency/size/fault numbers to FILE (.json, or .csv)' )
+
+
+def ldap_check_options( parser ):
+    parser.add_argument( '--csv', default = 'agent list.csv', help = 'CSV with one E# per row (default: "agent list.csv")' )
+
+
+OPTIONS = {
+    'bulk-migrate': bulk_options,
+    'new-agent': new_agent_options,
+    'ldap-check': ldap_check_options,
+}
+
+
+def script_parser( command ):
+    """The argument parser of `command`'s script."""
+    parser = argparse.ArgumentParser( description = COMMANDS[ command ][1] )
+    if command in OPTIONS:
+        OPTIONS[ command ]( parser )
+    return parser
+
+
+# checking the input, before anything talks to CUCM
+
+def _warn_duplicates( agents, where ):
+    repeated = [ agent for agent, count in Counter( agent.lower() for agent in agents ).items() if count > 1 ]
+    if repeated:
+        print( f'{ where } lists { len( repeated ) } E#(s) more than once: { _some( repeated ) }' )
+
+
+def _some( values, shown = 5 ):
+    return ', '.join( values[ :shown ] ) + ( ', ...' if len( values ) > shown else '' )
+
+
+def check_agents( path ):
+    """E#s of the agent CSV `path`. Exits when it can't be read or has none, warns
+    about rows that don't look like an E# and E#s listed twice."""
+    try:
+        agents = read_agents( path )
+    except OSError as err:
+        sys.exit( f"Can't read { path }: { err.strerror }" )
+    if not agents:
+        sys.exit( f'{ path } has no E#s' )
+    odd = [ agent for agent in agents if not ENUMBER_RE.fullmatch( agent ) ]
+    if odd:
+        print( f"{ len( odd ) } row(s) of { path } don't look like an E#: { _some( odd ) }" )
+    _warn_duplicates( agents, path )
+    return agents
+
+
+def check_manifest( path ):
+    """Agent rows of the onboarding manifest `path`, exits when it can't be read or has none."""
+    try:
+        agents = read_manifest( path )
+    except OSError as err:
+        sys.exit( f"Can't read { path }: { err.strerror }" )
+    except ( ValueError, AttributeError, TypeError ) as err:
+        sys.exit( f'{ path } is not a manifest, see onboarding.py: { err }' )
+    if not agents:
+        sys.exit( f'{ path } has no rows with an enumber' )
+    _warn_duplicates( [ agent[ 'enumber' ] for agent in agents ], path )
+    return agents
+
+
+def _check_bulk( args ):
+    agents = check_agents( args.csv )
+    if not args.dry_run:
+        return
+    done = set( )
+    if os.path.exists( args.journal ) and not args.no_resume:
+        journal = MigrationJournal( args.journal )
+        done = { agent.lower() for agent in agents if journal.status( agent ) == 'ok' }
+        journal.close()
+        print( f'{ len( done ) } of them already migrated according to { args.journal }' )
+    print( f'{ len( agents ) } agents in { args.csv }, { len( agents ) - len( done ) } to migrate with { max( 1, args.workers ) } worker(s)' )
+
+
+def _check_new_agent( args ):
+    if not args.manifest:
+        if args.dry_run:
+            sys.exit( '--dry-run needs --manifest, without one new-agent asks for everything through prompts' )
+        return
+    agents = check_manifest( args.manifest )
+    if not args.dry_run:
+        return
+    device_pools = { agent.get( 'device_pool' ) for agent in agents if agent.get( 'device_pool' ) }
+    examples = { agent.get( 'example_csf' ).upper() for agent in agents if agent.get( 'example_csf' ) }
+    without_caller_id = sum( not agent.get( 'caller_id' ) for agent in agents )
+    print( f'{ len( agents ) } agents to onboard from { args.manifest } with { args.workers } worker(s): '
+           f'{ len( device_pools ) } device pool(s), { len( examples ) } example CSF(s) to look up, '
+           f'{ without_caller_id } taking the caller ID from LDAP' )
+
+
+def _check_ldap( args ):
+    agents = check_agents( args.csv )
+    if args.dry_run:
+        print( f'{ len( agents ) } agents in { args.csv } to check' )
+
+
+CHECKS = {
+    'bulk-migrate': _check_bulk,
+    'new-agent': _check_new_agent,
+    'ldap-check': _check_ldap,
+}
+
+
+def run( command, argv ):
+    """Run `command`'s script as if it was started with `argv`."""
+    script = os.path.join( BASE_DIR, COMMANDS[ command ][0] )
+    sys.argv = [ script ] + argv
+    runpy.run_path( script, run_name = '__main__' )
+
+
+def main( argv = None ):
+    argv = sys.argv[ 1: ] if argv is None else argv
+    parser = argparse.ArgumentParser( description = __doc__.splitlines()[0] )
+    commands = parser.add_subparsers( dest = 'command', required = True, metavar = 'command' )
+    for name, ( script, description ) in COMMANDS.items():
+        # no abbreviations, --dry-run has to be recognised before the rest goes to the script
+        command = commands.add_parser( name, help = description, description = description, allow_abbrev = False )
+        if name in OPTIONS:
+            OPTIONS[ name ]( command )
+        if name in CHECKS:
+            command.add_argument( '--dry-run', action = 'store_true',
+                                  help = 'check the input and say what would be done, without connecting to CUCM' )
+    args = parser.parse_args( argv )
+    if args.command in CHECKS:
+        CHECKS[ args.command ]( args )
+    if getattr( args, 'dry_run', False ):
+        return
+    run( args.command, [ arg for arg in argv[ argv.index( args.command ) + 1: ] if arg != '--dry-run' ] )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+"""Local SQLite mirror of the CUCM objects the migration scripts look up.
+
+Every run used to ask CUCM again for users, device profiles, CIPCs, lines, device
+pools and app user device maps. The mirror keeps them in a SQLite file in
+.axl_cache/: built once from paged list calls, then kept current by polling
+listChange, which returns only what changed since the last poll (the change
+queue on the publisher). A poll costs one small request, so the scripts sync at
+start and then answer their lookups locally; writes still go to AXL.
+
+The scripts use it when AXL_MIRROR=1 is set. Build or refresh it by hand with
+
+    python3 mirror.py            # sync, bootstrapping the first time
+    python3 mirror.py --rebuild  # throw it away and start over
+    python3 mirror.py --watch 30 # keep polling every 30 seconds
+
+When the change queue no longer holds the changes since the last poll (the
+publisher restarted or more changes than the queue keeps) the mirror rebuilds
+itself on the next sync.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import time
+import sqlite3
+import argparse
+import threading
+
+from zeep.exceptions import Fault
+from zeep.helpers import serialize_object
+
+import axl_sql
+from app_users import APP_USERS, APP_USER_DEVICES_SQL
+from axl_client import CACHE_DIR
+from axl_list import iter_list
+from axl_read import returned_tags, to_record
+from catalog import KINDS
+
+SCHEMA = '''
+create table if not exists sync ( key text primary key, value );
+create table if not exists phones ( uuid text primary key, name text collate nocase unique, description text,
+    device_pool text, media_resource_list text, css text, location text, current_profile text collate nocase );
+create index if not exists phones_current_profile on phones ( current_profile );
+create table if not exists profiles ( uuid text primary key, name text collate nocase unique, description text );
+create table if not exists lines ( uuid text primary key, pattern text, partition text, description text );
+create index if not exists lines_pattern on lines ( pattern );
+create table if not exists users ( uuid text primary key, userid text collate nocase unique, first_name text,
+    last_name text, telephone_number text, ldap_directory text );
+create table if not exists names ( uuid text primary key, kind text, name text );
+create index if not exists names_kind on names ( kind, name );
+create table if not exists app_user_devices ( app_user text, device text collate nocase, primary key ( app_user, device ) );
+'''
+
+# mirrored object: ( table, list operation, searchCriteria, get operation, { AXL tag: column } )
+OBJECTS = {
+    'Phone': ( 'phones', 'listPhone', { 'name': '%' }, 'getPhone', {
+        'name': 'name', 'description': 'description', 'devicePoolName': 'device_pool',
+        'mediaResourceListName': 'media_resource_list', 'callingSearchSpaceName': 'css',
+        'locationName': 'location', 'currentProfileName': 'current_profile' } ),
+    'DeviceProfile': ( 'profiles', 'listDeviceProfile', { 'name': '%' }, 'getDeviceProfile', {
+        'name': 'name', 'description': 'description' } ),
+    'Line': ( 'lines', 'listLine', { 'pattern': '%' }, 'getLine', {
+        'pattern': 'pattern', 'routePartitionName': 'partition', 'description': 'description' } ),
+    'User': ( 'users', 'listUser', { 'userid': '%' }, 'getUser', {
+        'userid': 'userid', 'firstName': 'first_name', 'lastName': 'last_name',
+        'telephoneNumber': 'telephone_number', 'ldapDirectoryName': 'ldap_directory' } ),
+}
+
+# listChange object type -> catalog kind, small enough to list again when one changes
+NAME_TYPES = { 'DevicePool': 'devicePool', 'MediaResourceList': 'mediaResourceList', 'Css': 'css', 'Location': 'location' }
+
+
+def normalize_uuid( uuid ):
+    """'{ABC-...}' or 'abc-...' -> 'abc-...', AXL writes uuids both ways."""
+    return ( uuid or '' ).strip( '{}' ).lower()
+
+
+def _mirror_file( cache_dir ):
+    address = ( os.getenv( 'CUCM_ADDRESS' ) or 'default' ).replace( ':', '_' ).replace( os.sep, '_' )
+    return os.path.join( cache_dir, f'mirror-{address}.sqlite' )
+
+
+class Mirror:
+    """The SQLite mirror for one cluster. Lookups are safe from several threads."""
+
+    def __init__( self, service, path = None ):
+        self.service = service
+        self.path = path or _mirror_file( CACHE_DIR )
+        os.makedirs( os.path.dirname( self.path ) or '.', exist_ok = True )
+        self._db = sqlite3.connect( self.path, check_same_thread = False )
+        self._db.execute( 'pragma journal_mode = wal' )
+        self._db.executescript( SCHEMA )
+        self._lock = threading.RLock()
+
+    # sync
+
+    def _state( self, key ):
+        row = self._db.execute( 'select value from sync where key = ?', ( key, ) ).fetchone()
+        return row[0] if row else None
+
+    def _set_state( self, **values ):
+        self._db.executemany( 'insert or replace into sync ( key, value ) values ( ?, ? )', values.items() )
+
+    def bootstrapped( self ):
+        return self._state( 'queue_id' ) is not None
+
+    def bootstrap( self ):
+        """Load everything from scratch, then continue from the change queue position
+        taken before the load, so changes made meanwhile are applied on the next sync."""
+        with self._lock:
+            queue = self.service.listChange()['queueInfo']
+            with self._db:
+                for table in ( 'phones', 'profiles', 'lines', 'users', 'names', 'app_user_devices', 'sync' ):
+                    self._db.execute( f'delete from { table }' )
+                for object_type in OBJECTS:
+                    self._load_all( object_type )
+                for kind in KINDS:
+                    self._load_names( kind )
+                self._load_app_user_devices()
+                self._set_state( queue_id = queue['queueId'], next_change_id = int( queue['nextStartChangeId'] ),
+                                 synced_at = time.time() )
+
+    def sync( self ):
+        """Apply the changes CUCM queued since the last sync, bootstrapping when the
+        mirror is new or the queue lost track. Returns the number of changes applied."""
+        with self._lock:
+            if not self.bootstrapped():
+                self.bootstrap()
+                return 0
+            applied = 0
+            while True:
+                start = int( self._state( 'next_change_id' ) )
+                resp = self.service.listChange( startChangeId = { '_value_1': start, 'queueId': self._state( 'queue_id' ) } )
+                queue = resp['queueInfo']
+                if queue['queueId'] != self._state( 'queue_id' ) or int( queue['firstChangeId'] or start ) > start:
+                    # changes were dropped from the queue before we saw them
+                    self.bootstrap()
+                    return applied
+                changes = resp['changes']['change'] if resp['changes'] is not None else [ ]
+                with self._db:
+                    self._apply( changes )
+                    self._set_state( next_change_id = int( queue['nextStartChangeId'] ), synced_at = time.time() )
+                applied += len( changes )
+                if not changes or int( queue['nextStartChangeId'] ) <= start:
+                    return applied
+
+    def _apply( self, changes ):
+        names_changed = set()
+        app_users_changed = False
+        for change in changes:
+            object_type, uuid, action = change['type'], normalize_uuid( change['uuid'] ), change['action']
+            if object_type in NAME_TYPES:
+                names_changed.add( NAME_TYPES[ object_type ] )
+            elif object_type == 'AppUser':
+                app_users_changed = True
+            elif object_type in OBJECTS:
+                table, _, _, _, columns = OBJECTS[ object_type ]
+                if action == 'r':
+                    if object_type == 'Phone':
+                        self._db.execute( 'delete from app_user_devices where device in ( select name from phones where uuid = ? )', ( uuid, ) )
+                    self._db.execute( f'delete from { table } where uuid = ?', ( uuid, ) )
+                    continue
+                # the new values come along unless CUCM says they didn't fit (doGet)
+                values = { tag['name']: tag['_value_1'] for tag in ( change['changedTags']['changedTag'] if change['changedTags'] else [ ] ) }
+                if str( change['doGet'] ).lower() in ( 'true', 't' ):
+                    self._fetch( object_type, uuid )
+                elif action == 'a':
+                    self._store( object_type, dict( values, uuid = uuid ) )
+                elif values.keys() & columns.keys():
+                    # a change to fields the mirror doesn't keep needs nothing
+                    updated = [ tag for tag in values if tag in columns ]
+                    cursor = self._db.execute( f'update { table } set { ", ".join( columns[ tag ] + " = ?" for tag in updated ) } where uuid = ?',
+                                               [ values[ tag ] for tag in updated ] + [ uuid ] )
+                    if not cursor.rowcount:
+                        self._fetch( object_type, uuid )
+        for kind in names_changed:
+            self._db.execute( 'delete from names where kind = ?', ( kind, ) )
+            self._load_names( kind )
+        if app_users_changed:
+            self._db.execute( 'delete from app_user_devices' )
+            self._load_app_user_devices()
+
+    # loading
+
+    def _store( self, object_type, record ):
+        table, _, _, _, columns = OBJECTS[ object_type ]
+        names = [ 'uuid' ] + list( columns.values() )
+        values = [ normalize_uuid( record.get( 'uuid' ) ) ] + [ record.get( tag ) for tag in columns ]
+        self._db.execute( f'insert or replace into { table } ( { ", ".join( names ) } ) values ( { ", ".join( "?" * len( names ) ) } )', values )
+
+    def _load_all( self, object_type ):
+        _, operation, criteria, _, columns = OBJECTS[ object_type ]
+        for item in iter_list( self.service, operation, criteria, returned_tags( dict.fromkeys( columns ) ) ):
+            self._store( object_type, to_record( serialize_object( item, dict ) ) )
+
+    def _fetch( self, object_type, uuid ):
+        table, _, _, operation, columns = OBJECTS[ object_type ]
+        try:
+            resp = getattr( self.service, operation )( uuid = '{' + uuid.upper() + '}', returnedTags = returned_tags( dict.fromkeys( columns ) ) )
+        except Fault:
+            # removed again before we got to it, the 'r' change follows
+            self._db.execute( f'delete from { table } where uuid = ?', ( uuid, ) )
+            return
+        element = next( iter( resp['return'] ) )
+        self._store( object_type, to_record( serialize_object( resp['return'][ element ], dict ) ) )
+
+    def _load_names( self, kind ):
+        for item in iter_list( self.service, KINDS[ kind ], { 'name': '%' }, { 'name': '' } ):
+            self._db.execute( 'insert or replace into names ( uuid, kind, name ) values ( ?, ?, ? )',
+                              ( normalize_uuid( item['uuid'] ), kind, item['name'] ) )
+
+    def _load_app_user_devices( self ):
+        rows = axl_sql.query( self.service, APP_USER_DEVICES_SQL.format( app_users = axl_sql.in_list( APP_USERS ) ) )
+        self._db.executemany( 'insert or ignore into app_user_devices ( app_user, device ) values ( ?, ? )',
+                              ( ( row['app_user'], row['device'] ) for row in rows ) )
+
+    # lookups
+
+    def _query( self, sql, params = ( ) ):
+        with self._lock:
+            return self._db.execute( sql, params ).fetchall()
+
+    def count( self, table ):
+        return self._query( f'select count(*) from { table }' )[0][0]
+
+    def names( self, kind ):
+        """Every name of a catalog kind (devicePool, mediaResourceList, css, location)."""
+        return [ name for name, in self._query( 'select name from names where kind = ?', ( kind, ) ) ]
+
+    def users( self, userids ):
+        """{ userid: prefetch_users() style row or None }"""
+        found = { userid: None for userid in userids }
+        by_userid = { userid.lower(): userid for userid in userids }
+        for chunk in axl_sql.chunks( list( by_userid ), 500 ):
+            for row in self._query( f'select userid, first_name, last_name, telephone_number, ldap_directory from users '
+                                    f'where userid in ( { ", ".join( "?" * len( chunk ) ) } )', chunk ):
+                found[ by_userid[ row[0].lower() ] ] = { 'userid': row[0], 'firstname': row[1], 'lastname': row[2],
+                                                         'telephonenumber': row[3], 'ldapdirectoryname': row[4] or '' }
+        return found
+
+    def device( self, name ):
+        """prefetch_agents() style row for a phone or device profile, or None."""
+        rows = self._query( 'select name, device_pool, media_resource_list, css, location from phones where name = ? '
+                            'union all select name, null, null, null, null from profiles where name = ?', ( name, name ) )
+        if not rows:
+            return None
+        name, pool, mrl, css, location = rows[0]
+        return { 'name': name, 'devicepool': pool, 'mediaresourcelist': mrl, 'callingsearchspace': css, 'location': location }
+
+    def logged_in( self, profile ):
+        """Names of the phones `profile` is logged into."""
+        return [ name for name, in self._query( 'select name from phones where current_profile = ?', ( profile, ) ) ]
+
+    def patterns( self, prefix ):
+        """Every line pattern starting with `prefix`, any partition."""
+        return [ pattern for pattern, in self._query( 'select distinct pattern from lines where substr( pattern, 1, ? ) = ?',
+                                                      ( len( prefix ), prefix ) ) ]
+
+    def existing_patterns( self, patterns ):
+        patterns = [ str( pattern ) for pattern in patterns ]
+        return { pattern for pattern, in self._query( f'select pattern from lines where pattern in ( { ", ".join( "?" * len( patterns ) ) } )', patterns ) }
+
+    def app_user_devices( self, devices, app_users = APP_USERS ):
+        """{ device: set of the `app_users` it is associated with }, like app_users.mapped_devices()."""
+        mapped = { device: set() for device in devices }
+        by_name = { device.lower(): device for device in devices }
+        for chunk in axl_sql.chunks( list( by_name ), 500 ):
+            for app_user, device in self._query( f'select app_user, device from app_user_devices '
+                                                 f'where device in ( { ", ".join( "?" * len( chunk ) ) } )', chunk ):
+                if app_user in app_users:
+                    mapped[ by_name[ device.lower() ] ].add( app_user )
+        return mapped
+
+
+def open_mirror( service ):
+    """The synced Mirror when AXL_MIRROR=1 is set, otherwise None."""
+    if os.getenv( 'AXL_MIRROR', '0' ) in ( '', '0' ):
+        return None
+    mirror = Mirror( service )
+    started = time.perf_counter()
+    if not mirror.bootstrapped():
+        print( 'Building the local CUCM mirror, this only happens once...' )
+    applied = mirror.sync()
+    print( f'Mirror synced in { time.perf_counter() - started:.1f}s ({ applied } changes)' )
+    return mirror
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from axl_client import create_client, create_service
+
+    load_dotenv()
+    parser = argparse.ArgumentParser( description = 'Build and sync the local CUCM mirror.' )
+    parser.add_argument( '--rebuild', action = 'store_true', help = 'load everything again instead of syncing' )
+    parser.add_argument( '--watch', type = float, metavar = 'SECONDS', help = 'keep syncing every SECONDS' )
+    args = parser.parse_args()
+
+    mirror = Mirror( create_service( create_client() ) )
+    while True:
+        started = time.perf_counter()
+        if args.rebuild or not mirror.bootstrapped():
+            mirror.bootstrap()
+            args.rebuild = False
+            print( f'Bootstrapped in { time.perf_counter() - started:.1f}s: '
+                   + ', '.join( f'{ mirror.count( table ) } { table }' for table in ( 'phones', 'profiles', 'lines', 'users', 'names' ) ) )
+        else:
+            print( f'{ mirror.sync() } changes applied in { time.perf_counter() - started:.2f}s' )
+        if not args.watch:
+            break
+        time.sleep( args.watch )
@@ -22,91 +22,96 @@ SOFTWARE.
 """
 
 
+import json
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from itertools import cycle
 from traceback import print_tb
 from lxml import etree
-from requests import Session
-from zeep.cache import SqliteCache
-from requests.auth import HTTPBasicAuth
-from zeep.plugins import HistoryPlugin
-from zeep import Client, Settings, Plugin, xsd
-from zeep.transports import Transport
+from zeep import xsd
 from zeep.exceptions import Fault
-from urllib3 import disable_warnings
-from urllib3.exceptions import InsecureRequestWarning
+from axl_client import create_client, create_service, create_session
+from axl_read import read
+from tracing import create_tracer
+from metrics import AxlMetrics
+from catalog import load_catalog, select_device_pool
+from dn_allocator import DnAllocator, NoFreeDnError
+from mirror import open_mirror
+from onboarding import ACCESS_CONTROL_GROUPS, AGENT_DN_DIGITS, AGENT_DN_PREFIX, fill_csf_info, fill_line_appearance, fill_new_line, onboard_agents
+from prefetch import read_manifest
+from migrator import script_parser
+from throttle import AdaptiveService, AimdController, RateLimiter, RateLimitedService
 
 # Edit .env file to specify your Webex site/user details
 from dotenv import load_dotenv
 load_dotenv()
 
-# The WSDL is a local file
-WSDL_FILE = 'schema/AXLAPI.wsdl'
+#the options are defined in migrator.py, which checks them before anything heavy is loaded
+args = script_parser( 'new-agent' ).parse_args()
 
-# Change to true to enable output of request/response headers and XML
+# Change to true to also save the request/response XML of every AXL call to the trace file
 DEBUG = False
 
-# If you have a pem file certificate for CUCM, uncomment and define it here
+# Records timing, size and fault code of every AXL call (written to AXL_TRACE_FILE as
+# JSON lines in the background), show_history() prints the last request/response
+history = create_tracer( debug = DEBUG )
+metrics = AxlMetrics( history )
 
-#CERT = 'some.pem'
+# Create the Zeep client from the cached, pre-compiled AXL schema (see axl_client.py)
+client = create_client( tracer = history, session = create_session( pool_size = args.workers ) )
+#requests in flight adapt to CUCM's throttling, see throttle.py
+controller = AimdController( maximum = args.max_in_flight ) if args.max_in_flight else None
+service = create_service( client )
+if controller:
+    service = AdaptiveService( service, controller )
+service = RateLimitedService( service, RateLimiter( args.rate ) )
 
-# These values should work with a DevNet sandbox
-# You may need to change them if you are working with your own CUCM server
-
-
-disable_warnings(InsecureRequestWarning)
- 
-
-# This class lets you view the incoming and outgoing http headers and/or XML
-class MyLoggingPlugin( Plugin ):
-
-    def egress( self, envelope, http_headers, operation, binding_options ):
-
-        # Format the request body as pretty printed XML
-        xml = etree.tostring( envelope, pretty_print = True, encoding = 'unicode')
-
-        print( f'\nRequest\n-------\nHeaders:\n{http_headers}\n\nBody:\n{xml}' )
-
-    def ingress( self, envelope, http_headers, operation ):
-
-        # Format the response body as pretty printed XML
-        xml = etree.tostring( envelope, pretty_print = True, encoding = 'unicode')
-
-        print( f'\nResponse\n-------\nHeaders:\n{http_headers}\n\nBody:\n{xml}' )
-
-session = Session()
-
-# We avoid certificate verification by default, but you can uncomment and set
-# your certificate here, and comment out the False setting
-
-#session.verify = CERT
-session.verify = False
-session.auth = HTTPBasicAuth( os.getenv( 'AXL_USERNAME' ), os.getenv( 'AXL_PASSWORD' ) )
-
-# Create a Zeep transport and set a reasonable timeout value
-transport = Transport( session = session, timeout = 10 )
-
-# strict=False is not always necessary, but it allows zeep to parse imperfect XML
-settings = Settings( strict=False, xml_huge_tree=True )
-
-# If debug output is requested, add the MyLoggingPlugin callback
-plugin = [ MyLoggingPlugin() ] if DEBUG else [ ]
-
-# Create the Zeep client with the specified settings
-client = Client( WSDL_FILE, settings = settings, transport = transport,
-        plugins = plugin )
-history = HistoryPlugin()
-# service = client.create_service("{http://www.cisco.com/AXLAPIService/}AXLAPIBinding", CUCM_URL)
-service = client.create_service( '{http://www.cisco.com/AXLAPIService/}AXLAPIBinding',
-                                f'https://{os.getenv( "CUCM_ADDRESS" )}:8443/axl/' )
+#answer lookups from the local CUCM mirror when AXL_MIRROR=1 is set, see mirror.py
+mirror = open_mirror( service )
 
 #should output any errors coming from cucm while interacting with the program
 def show_history():
      for hist in [history.last_sent, history.last_received]:
-         print(etree.tostring(hist["envelope"], encoding='unicode', pretty_print=True))
+         if hist:
+             print(etree.tostring(hist["envelope"], encoding='unicode', pretty_print=True))
+
+#batch mode, no prompts. everything for the manifest is done by onboarding.py
+if args.manifest:
+    agents = read_manifest(args.manifest)
+    print("Onboarding " + str(len(agents)) + " agents from " + args.manifest)
+    results = onboard_agents(service, agents, DnAllocator(service, AGENT_DN_PREFIX, AGENT_DN_DIGITS, mirror = mirror),
+                             load_catalog(service, 'devicePool', mirror = mirror), workers = args.workers, mirror = mirror)
+    with open(args.results, 'w') as resultsfile:
+        json.dump(results, resultsfile, indent = 2)
+    statuses = [result['status'] for result in results]
+    print(f"{statuses.count('ok')} ok, {statuses.count('partial')} partial, {statuses.count('failed')} failed, results in {args.results}")
+    metrics.print_table()
+    if controller:
+        print("AXL requests in flight: " + controller.describe())
+    if args.metrics:
+        metrics.export(args.metrics, agents = len(agents), workers = args.workers, rate = args.rate, cucm = os.getenv('CUCM_ADDRESS'))
+    sys.exit(0 if statuses.count('ok') == len(statuses) else 1)
+
+#lookups run in the background while the admin is still answering the prompts: the device
+#pool catalog and the agent DN block right away, the end user as soon as the E# is known
+lookups = ThreadPoolExecutor(max_workers = 3)
+catalog_lookup = lookups.submit(load_catalog, service, 'devicePool', mirror = mirror)
+#find the lowest open extension in the agent block, 121605300 - 121605399, see dn_allocator.py
+dn_lookup = lookups.submit(DnAllocator, service, AGENT_DN_PREFIX, AGENT_DN_DIGITS, mirror = mirror)
 
 enumber = input("Enter E# :")
+user_lookup = lookups.submit(read, service, 'end_user', 'getUser', userid=enumber)
+
+#retrieve list of all device pools from cucm (cached between runs, see catalog.py).
+#if user input is blank, try to use the soft phone settings.
+#if exact match for dp is found in the list gathered, use that
+#otherwise try to find a match in the list and give user a list to chose from
+
+call_center = input("Enter Cost Center or Device Pool to use for " + enumber + ":")
+#from here on the admin is waiting on AXL
+reads_started = time.perf_counter()
 
 #workday search and local end user check to verify AD status
 
@@ -114,10 +119,10 @@ local_end_user = False
 LDAP_enabled = False
 
 try:
-    resp = service.getUser(userid=enumber)
-    ldap_status = resp['return']['user']['ldapDirectoryName']['_value_1']
-    first_name = resp['return']['user']['firstName']
-    last_name = resp['return']['user']['lastName']
+    user = user_lookup.result()
+    ldap_status = user.get('ldapDirectoryName')
+    first_name = user.get('firstName')
+    last_name = user.get('lastName')
     if ldap_status == None:
         print(first_name + " " + last_name + " " + enumber + " needs to update Workday.")
         answer = input("Are you sure you want to continue? y/n:")
@@ -131,7 +136,7 @@ try:
                 sys.exit(1)
     else:
         LDAP_enabled = True
-        end_user_callerID = resp['return']['user']['telephoneNumber']
+        end_user_callerID = user.get('telephoneNumber')
         if '-' in end_user_callerID:
             end_user_callerID = input('The caller ID has invalid characters in it, please enter it manually: ')
         print(first_name + " " + last_name + " " + enumber + " is in Workday and is LDAP enabled.")
@@ -139,81 +144,37 @@ except Fault:
         print("No End User found for " + enumber)
         show_history()
 
-
-#retrieve list of all device pools from cucm.
-#if user input is blank, try to use the soft phone settings.
-#if exact match for dp is found in the list gathered, use that
-#otherwise try to find a match in the list and give user a list to chose from
-
-call_center = input("Enter Cost Center or Device Pool to use for " + enumber + ":")
-
-search_again = True
 search_successful = False
 
 try:
     if call_center == "":
         print("No DP given, resorting to CIPC settings.")
     else:
-        device_pool_list = service.listDevicePool(searchCriteria = { 'name': '%' }, returnedTags = { 'name': ''})
-        device_pool_list_names = device_pool_list['return']['devicePool']
-        try:
-            for dp_index_num, dp_data in enumerate(device_pool_list_names):
-                if call_center == dp_data['name']:
-                    print('Found Device Pool match ' + dp_data['name'])
-                    dp_search_result = dp_data['name']
-                    search_again = False
-                    search_successful = True
-        except:
-            print('The search failed.')
-        if search_again == True:
-            for dp_index_num, dp_data in enumerate(device_pool_list_names):
-                if call_center in dp_data['name']:
-                    print(dp_index_num, ': Found DPs for Call Center ' + dp_data['name'])
-                    search_successful = True
-                    #dp = dp_data['name']
-            if search_successful == True:
-                dp_selection = input('Select the number of the Device Pool you most desire: ')
-                dp_search_result = device_pool_list_names[int(dp_selection)]['name']
-            else:
-                print('There was no Call Center or DP found. Will try to copy Device Settings.')
+        dp_search_result = select_device_pool(catalog_lookup.result(), call_center)
+        search_successful = dp_search_result is not None
 except Fault:
         print("Something weird happened, I couldn't look for " + call_center)
         show_history()
 
-#start searching for an open extension to assign to the agent, starting at 121605300
 try:
-    new_agent_dn_list_raw = service.listLine(searchCriteria = {'pattern': '1216053%'}, returnedTags = { 'pattern': '' })
-    new_agent_dn_list = new_agent_dn_list_raw['return']['line']
-except:
+    agent_dns = dn_lookup.result()
+except Fault:
     print('no extensions found')
-
-#distill the list and find the last used extension and identify the next 
-agent_DNs = []
-for dn_indx, dn_data in enumerate(new_agent_dn_list):
-    if dn_data['pattern'][0:4] == '1216':
-         agent_DNs.append(dn_data['pattern'])
-agent_DNs.sort()
-new_agent_pri_dn = (int(agent_DNs[-1]) + 1)
-print(str(new_agent_pri_dn))
-agent_description = first_name + " " + last_name + " " + str(new_agent_pri_dn)
+    sys.exit( 1 )
+print("Waited " + f'{time.perf_counter() - reads_started:.1f}' + "s on lookups after the prompts")
 
 #create a simple line template first 
-primary_line = {
-    'pattern': new_agent_pri_dn,
-    'description': agent_description,
-    'usage': 'Device',
-    'routePartitionName': 'PCCE_DN_PT',
-    'voiceMailProfileName': 'NoVoiceMail'
-}
+def fill_primary_line(dn):
+    return fill_new_line(dn, first_name + " " + last_name + " " + str(dn))
 
 # Execute the addLine request for primary line because the cucm api is limited and bad
 try:
-    resp = service.addLine( primary_line )
-except Fault as err:
+    new_agent_pri_dn, primary_line_uuid = agent_dns.add_line( fill_primary_line )
+except (Fault, NoFreeDnError) as err:
     print( f'Zeep error: addLine: { err }' )
     sys.exit( 1 )
-
-primary_line_uuid = resp['return']
+print(str(new_agent_pri_dn))
+agent_description = first_name + " " + last_name + " " + str(new_agent_pri_dn)
 owner_user_name = enumber.capitalize()
 device_name = "CSF" + enumber.capitalize()
 single_line = True
@@ -236,16 +197,16 @@ if csf_example_input == '':
     single_line = True
 else:
     try:
-        phone_resp = service.getPhone(name=csf_example_input)
-        example_line_resp = phone_resp['return']['phone']['lines']['line']
+        example_phone = read(service, 'example_csf', 'getPhone', name=csf_example_input)
+        example_line_resp = example_phone['lines']['line']
         for ex_line_index, ex_line_data in enumerate(example_line_resp):
             if 2 == ex_line_data['index']:
                 double_line = True
                 single_line = False
-        DP_from_CSF = phone_resp['return']['phone']['devicePoolName']['_value_1']
-        Location = phone_resp['return']['phone']['locationName']
-        MRLN = phone_resp['return']['phone']['mediaResourceListName']['_value_1']
-        CSS = phone_resp['return']['phone']['callingSearchSpaceName']
+        DP_from_CSF = example_phone.get('devicePoolName')
+        Location = example_phone.get('locationName')
+        MRLN = example_phone.get('mediaResourceListName')
+        CSS = example_phone.get('callingSearchSpaceName')
     except:
         device_id = input("Couldn't find the phone with the name of " + csf_example_input + ", try again:").upper()
         try:
@@ -274,222 +235,41 @@ if double_line == True:
     if example_line_resp[1]['dirn']['pattern'][0:3] != '121':
         print("This phone will need a DID assigned to it for it's second line.")
         single_line = True
+    elif not agent_dns.claim(new_agent_pri_dn + 1000):
+        print("The secondary DN " + str(new_agent_pri_dn + 1000) + " is already taken, the CSF will only get the primary line.")
+        single_line = True
     else:
         new_agent_sec_dn = (new_agent_pri_dn + 1000)
         print(new_agent_sec_dn)
-        secondary_line = {
-            'pattern': new_agent_sec_dn,
-            'description': agent_description,
-            'usage': 'Device',
-            'routePartitionName': 'PCCE_DN_PT',
-            'voiceMailProfileName': 'NoVoiceMail'
-        }
+        secondary_line = fill_new_line(new_agent_sec_dn, agent_description)
         # Execute the addLine request for secondary line because the cucm api is limited and bad
         try:
             sec_resp = service.addLine( secondary_line )
         except Fault as err:
             print( f'Zeep error: addLine: { err }' )
+            agent_dns.release( new_agent_sec_dn )
+            # take the primary line back out so a rerun starts clean
+            try:
+                service.removeLine( uuid = primary_line_uuid )
+                agent_dns.release( new_agent_pri_dn )
+            except Fault as err:
+                print( f'Zeep error: removeLine: { err }' )
             sys.exit( 1 )
 
         secondary_line_uuid = sec_resp['return']
-        line = {
-                    'line': [
-                        {
-                            'index': 1,
-                            'label': agent_description,
-                            'display': agent_description,
-                            'dirn': {
-                                'pattern': new_agent_pri_dn,
-                                'routePartitionName': {
-                                    '_value_1': 'PCCE_DN_PT',
-                                    'uuid': '{56339E9D-FD62-199F-552F-0E4DE058FD2A}'
-                                },
-                                'uuid': primary_line_uuid
-                            },
-                            'ringSetting': 'Use System Default',
-                            'consecutiveRingSetting': 'Use System Default',
-                            'ringSettingIdlePickupAlert': 'Use System Default',
-                            'ringSettingActivePickupAlert': 'Use System Default',
-                            'displayAscii': agent_description,
-                            'e164Mask': end_user_callerID,
-                            'dialPlanWizardId': None,
-                            'mwlPolicy': 'Use System Policy',
-                            'maxNumCalls': 2,
-                            'busyTrigger': 1,
-                            'callInfoDisplay': {
-                                'callerName': 'true',
-                                'callerNumber': 'false',
-                                'redirectedNumber': 'false',
-                                'dialedNumber': 'true'
-                            },
-                            'recordingProfileName': {
-                                '_value_1': 'ZoomCallRec',
-                                'uuid': 'e0166dbe-918d-3753-0c96-3587f1daeef1'
-                            },
-                            'monitoringCssName': {
-                                '_value_1': None,
-                                'uuid': None
-                            },
-                            'recordingFlag': 'Automatic Call Recording Enabled',
-                            'audibleMwi': 'Default',
-                            'speedDial': None,
-                            'partitionUsage': 'General',
-                            'associatedEndusers': {
-                                'enduser': [
-                                    {
-                                        'userId': enumber
-                                    }
-                                ]
-                            },
-                            'missedCallLogging': 'true',
-                            'recordingMediaSource': 'Phone Preferred',
-                            'ctiid': None,
-                            'uuid': xsd.SkipValue
-                        },
-                        {
-                            'index': 2,
-                            'label': agent_description,
-                            'display': agent_description,
-                            'dirn': {
-                                'pattern': new_agent_sec_dn,
-                                'routePartitionName': {
-                                    '_value_1': 'PCCE_DN_PT',
-                                    'uuid': '{56339E9D-FD62-199F-552F-0E4DE058FD2A}'
-                                },
-                                'uuid': secondary_line_uuid
-                            },
-                            'ringSetting': 'Use System Default',
-                            'consecutiveRingSetting': 'Use System Default',
-                            'ringSettingIdlePickupAlert': 'Use System Default',
-                            'ringSettingActivePickupAlert': 'Use System Default',
-                            'displayAscii': agent_description,
-                            'e164Mask': end_user_callerID,
-                            'dialPlanWizardId': None,
-                            'mwlPolicy': 'Use System Policy',
-                            'maxNumCalls': 2,
-                            'busyTrigger': 1,
-                            'callInfoDisplay': {
-                                'callerName': 'true',
-                                'callerNumber': 'false',
-                                'redirectedNumber': 'false',
-                                'dialedNumber': 'true'
-                            },
-                            'recordingProfileName': {
-                                '_value_1': 'ZoomCallRec',
-                                'uuid': 'e0166dbe-918d-3753-0c96-3587f1daeef1'
-                            },
-                            'monitoringCssName': {
-                                '_value_1': None,
-                                'uuid': None
-                            },
-                            'recordingFlag': 'Automatic Call Recording Enabled',
-                            'audibleMwi': 'Default',
-                            'speedDial': None,
-                            'partitionUsage': 'General',
-                            'associatedEndusers': {
-                                'enduser': [
-                                    {
-                                        'userId': enumber
-                                    }
-                                ]
-                            },
-                            'missedCallLogging': 'true',
-                            'recordingMediaSource': 'Phone Preferred',
-                            'ctiid': None,
-                            'uuid': xsd.SkipValue
-                        }
-                    ],
-                    'lineIdentifier': None
-                }
+        line = [
+            fill_line_appearance(1, new_agent_pri_dn, primary_line_uuid, agent_description, end_user_callerID, enumber),
+            fill_line_appearance(2, new_agent_sec_dn, secondary_line_uuid, agent_description, end_user_callerID, enumber),
+        ]
 
 if single_line == True:
-    line = {
-                    'line': [
-                        {
-                            'index': 1,
-                            'label': agent_description,
-                            'display': agent_description,
-                            'dirn': {
-                                'pattern': new_agent_pri_dn,
-                                'routePartitionName': {
-                                    '_value_1': 'PCCE_DN_PT',
-                                    'uuid': '{56339E9D-FD62-199F-552F-0E4DE058FD2A}'
-                                },
-                                'uuid': primary_line_uuid
-                            },
-                            'ringSetting': 'Use System Default',
-                            'consecutiveRingSetting': 'Use System Default',
-                            'ringSettingIdlePickupAlert': 'Use System Default',
-                            'ringSettingActivePickupAlert': 'Use System Default',
-                            'displayAscii': agent_description,
-                            'e164Mask': end_user_callerID,
-                            'dialPlanWizardId': None,
-                            'mwlPolicy': 'Use System Policy',
-                            'maxNumCalls': 2,
-                            'busyTrigger': 1,
-                            'callInfoDisplay': {
-                                'callerName': 'true',
-                                'callerNumber': 'false',
-                                'redirectedNumber': 'false',
-                                'dialedNumber': 'true'
-                            },
-                            'recordingProfileName': {
-                                '_value_1': 'ZoomCallRec',
-                                'uuid': 'e0166dbe-918d-3753-0c96-3587f1daeef1'
-                            },
-                            'monitoringCssName': {
-                                '_value_1': None,
-                                'uuid': None
-                            },
-                            'recordingFlag': 'Automatic Call Recording Enabled',
-                            'audibleMwi': 'Default',
-                            'speedDial': None,
-                            'partitionUsage': 'General',
-                            'associatedEndusers': {
-                                'enduser': [
-                                    {
-                                        'userId': enumber
-                                    }
-                                ]
-                            },
-                            'missedCallLogging': 'true',
-                            'recordingMediaSource': 'Phone Preferred',
-                            'ctiid': None,
-                            'uuid': xsd.SkipValue
-                        }
-                    ],
-                    'lineIdentifier': None
-                }
+    line = [
+        fill_line_appearance(1, new_agent_pri_dn, primary_line_uuid, agent_description, end_user_callerID, enumber),
+    ]
 
 #the line was added in and created, this will add in the rest of the important details for the CSF. 
 def fill_phone_info(name, owner_user_name):
-    phone_info = {
-        'name': name,
-        'product': 'Cisco Unified Client Services Framework',
-        'model': 'Cisco Unified Client Services Framework',
-        'description': f'{agent_description}',
-        'class': 'Phone',
-        'protocol': 'SIP',
-        'protocolSide': 'User',
-        'devicePoolName': dp,
-        'locationName': Location,
-        'sipProfileName': 'Standard SIP Profile',
-        'mediaResourceListName': MRLN,
-        'callingSearchSpaceName': CSS,
-        'commonPhoneConfigName': xsd.SkipValue,
-        'userLocale': 'English United States',
-        'networkLocale': 'United States',
-        'phoneTemplateName': xsd.SkipValue,
-        'primaryPhoneName': xsd.SkipValue,
-        'useTrustedRelayPoint': xsd.SkipValue,
-        'builtInBridgeStatus': 'On',
-        'packetCaptureMode': xsd.SkipValue,
-        'certificateOperation': xsd.SkipValue,
-        'deviceMobilityMode': xsd.SkipValue,
-        'ownerUserName': owner_user_name,
-        'lines': line,
-    }
-    return phone_info
+    return fill_csf_info(name, owner_user_name, agent_description, dp, Location, MRLN, CSS, line)
 
 
 print("\n")
@@ -514,13 +294,7 @@ print("Updating EndUser")
 
 
 #update end user with ACG and Line info, and ensure that user is a home user. 
-associated_AccessControlGroup = {
-                'userGroup': [
-                    {
-                        'name': 'PCCE Standard User',
-                    },
-                ]
-                }
+associated_AccessControlGroup = ACCESS_CONTROL_GROUPS
 associated_primary_line = {
                 'pattern': new_agent_pri_dn,
                 'routePartitionName': 'PCCE_DN_PT'
@@ -0,0 +1,405 @@
+"""Templates and the batch pipeline for onboarding brand new agents.
+
+new_agent.py onboards one agent through input() prompts. The same steps can run
+without prompts for a whole manifest of agents (CSV with a header row, or a JSON
+list of objects) with these columns:
+
+    enumber        the agent's E#                                   (required)
+    device_pool    cost center or device pool, like the prompt      (optional)
+    caller_id      external mask, overrides the LDAP phone number   (optional)
+    example_csf    CSF to copy the localization settings from       (optional)
+
+Each distinct device pool and example CSF is resolved once, DNs are reserved for
+all agents in one go, and the lines, phones and user updates run on a worker pool.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from zeep import xsd
+from zeep.exceptions import Fault
+
+from app_users import associate_devices
+from axl_read import read
+from axl_sql import chunks
+from dn_allocator import NoFreeDnError
+from prefetch import prefetch_users
+
+AGENT_PARTITION = 'PCCE_DN_PT'
+
+# New agents get the lowest free DN of this block
+AGENT_DN_PREFIX = '1216053'
+AGENT_DN_DIGITS = 9
+
+# used when no example CSF is given
+DEFAULT_SETTINGS = {
+    'devicePool': 'Default',
+    'location': 'Hub_None',
+    'mediaResourceList': 'MC_MRGL',
+    'css': '06_Device',
+    'second_line': False,
+}
+
+# onboard_agent() user argument when the user still has to be looked up
+LOOKUP = object()
+
+ACCESS_CONTROL_GROUPS = {
+    'userGroup': [
+        {
+            'name': 'PCCE Standard User',
+        },
+    ]
+}
+
+
+#create a simple line template first, addLine only takes the basics
+def fill_new_line(dn, description):
+    new_line = {
+        'pattern': dn,
+        'description': description,
+        'usage': 'Device',
+        'routePartitionName': AGENT_PARTITION,
+        'voiceMailProfileName': 'NoVoiceMail'
+    }
+    return new_line
+
+#the line appearance on the CSF for a line created with fill_new_line
+def fill_line_appearance(index, dn, line_uuid, agent_description, caller_id, enumber):
+    line_appearance = {
+        'index': index,
+        'label': agent_description,
+        'display': agent_description,
+        'dirn': {
+            'pattern': dn,
+            'routePartitionName': {
+                '_value_1': AGENT_PARTITION,
+                'uuid': '{56339E9D-FD62-199F-552F-0E4DE058FD2A}'
+            },
+            'uuid': line_uuid
+        },
+        'ringSetting': 'Use System Default',
+        'consecutiveRingSetting': 'Use System Default',
+        'ringSettingIdlePickupAlert': 'Use System Default',
+        'ringSettingActivePickupAlert': 'Use System Default',
+        'displayAscii': agent_description,
+        'e164Mask': caller_id,
+        'dialPlanWizardId': None,
+        'mwlPolicy': 'Use System Policy',
+        'maxNumCalls': 2,
+        'busyTrigger': 1,
+        'callInfoDisplay': {
+            'callerName': 'true',
+            'callerNumber': 'false',
+            'redirectedNumber': 'false',
+            'dialedNumber': 'true'
+        },
+        'recordingProfileName': {
+            '_value_1': 'ZoomCallRec',
+            'uuid': 'e0166dbe-918d-3753-0c96-3587f1daeef1'
+        },
+        'monitoringCssName': {
+            '_value_1': None,
+            'uuid': None
+        },
+        'recordingFlag': 'Automatic Call Recording Enabled',
+        'audibleMwi': 'Default',
+        'speedDial': None,
+        'partitionUsage': 'General',
+        'associatedEndusers': {
+            'enduser': [
+                {
+                    'userId': enumber
+                }
+            ]
+        },
+        'missedCallLogging': 'true',
+        'recordingMediaSource': 'Phone Preferred',
+        'ctiid': None,
+        'uuid': xsd.SkipValue
+    }
+    return line_appearance
+
+#the lines were created, this adds in the rest of the important details for the CSF.
+def fill_csf_info(name, owner_user_name, agent_description, dp, location, mrl, css, lines):
+    phone_info = {
+        'name': name,
+        'product': 'Cisco Unified Client Services Framework',
+        'model': 'Cisco Unified Client Services Framework',
+        'description': f'{agent_description}',
+        'class': 'Phone',
+        'protocol': 'SIP',
+        'protocolSide': 'User',
+        'devicePoolName': dp,
+        'locationName': location,
+        'sipProfileName': 'Standard SIP Profile',
+        'mediaResourceListName': mrl,
+        'callingSearchSpaceName': css,
+        'commonPhoneConfigName': xsd.SkipValue,
+        'userLocale': 'English United States',
+        'networkLocale': 'United States',
+        'phoneTemplateName': xsd.SkipValue,
+        'primaryPhoneName': xsd.SkipValue,
+        'useTrustedRelayPoint': xsd.SkipValue,
+        'builtInBridgeStatus': 'On',
+        'packetCaptureMode': xsd.SkipValue,
+        'certificateOperation': xsd.SkipValue,
+        'deviceMobilityMode': xsd.SkipValue,
+        'ownerUserName': owner_user_name,
+        'lines': {'line': lines, 'lineIdentifier': None},
+    }
+    return phone_info
+
+
+def resolve_device_pool( catalog, call_center ):
+    """Device pool for `call_center` without prompting: an exact match or a single partial match."""
+    dp = catalog.exact( call_center )
+    if dp is not None:
+        return dp
+    matches = catalog.search( call_center )
+    if len( matches ) == 1:
+        return matches[0]
+    if not matches:
+        raise ValueError( 'no device pool matches ' + call_center )
+    raise ValueError( f'{len( matches )} device pools match {call_center}, use the full name' )
+
+
+def example_settings( service, csf_name ):
+    """Localization settings and line layout of an existing agent CSF."""
+    phone = read( service, 'example_csf', 'getPhone', name = csf_name )
+    lines = ( phone.get( 'lines' ) or { } ).get( 'line' ) or [ ]
+    second = [ line for line in lines if line['index'] == 2 ]
+    return {
+        'devicePool': phone.get( 'devicePoolName' ),
+        'location': phone.get( 'locationName' ),
+        'mediaResourceList': phone.get( 'mediaResourceListName' ),
+        'css': phone.get( 'callingSearchSpaceName' ),
+        # a second agent line gets a new DN, a second line with a DID has to be done by hand
+        'second_line': bool( second ) and second[0]['dirn']['pattern'][0:3] == '121',
+        'second_line_did': bool( second ) and second[0]['dirn']['pattern'][0:3] != '121',
+    }
+
+
+def _resolve_all( values, resolve, workers ):
+    """{ value: resolve( value ) or the exception it raised } for each distinct value."""
+    values = sorted( { value for value in values if value } )
+
+    def attempt( value ):
+        try:
+            return resolve( value )
+        except Exception as err:
+            return err
+
+    with ThreadPoolExecutor( max_workers = max( 1, workers ) ) as pool:
+        return dict( zip( values, pool.map( attempt, values ) ) )
+
+
+def onboard_agents( service, agents, allocator, catalog, workers = 1, mirror = None ):
+    """Onboard every agent row from prefetch.read_manifest() and return one result dict per agent.
+
+    End users are looked up in `mirror` (see mirror.py) when there is one."""
+    device_pools = _resolve_all( [ agent.get( 'device_pool' ) for agent in agents ], lambda value: resolve_device_pool( catalog, value ), 1 )
+    examples = _resolve_all( [ agent.get( 'example_csf', '' ).upper() for agent in agents ], lambda value: example_settings( service, value ), workers )
+
+    try:
+        users = prefetch_users( service, [ agent['enumber'] for agent in agents ], mirror = mirror )
+    except Fault as err:
+        print( f'Zeep error: executeSQLQuery: { err }. Looking users up one at a time instead.' )
+        users = None
+
+    # reserve a primary DN for everyone up front, lowest free numbers first
+    try:
+        reserved = allocator.reserve( len( agents ) )
+    except NoFreeDnError as err:
+        print( err )
+        reserved = [ ]
+
+    def run( position ):
+        agent = agents[ position ]
+        dn = reserved[ position ] if position < len( reserved ) else None
+        user = users[ agent['enumber'] ] if users is not None else LOOKUP
+        try:
+            return onboard_agent( service, agent, dn, user, device_pools, examples, allocator )
+        except Exception as err:
+            print( agent['enumber'] + ': onboarding stopped: ' + str( err ) )
+            return { 'enumber': agent['enumber'], 'status': 'failed', 'device': None, 'device_pool': None, 'primary_dn': None,
+                     'secondary_dn': None, 'completed': [ ], 'failed': [ 'unexpected error' ], 'error': str( err ), 'seconds': 0 }
+
+    with ThreadPoolExecutor( max_workers = max( 1, workers ) ) as pool:
+        results = list( pool.map( run, range( len( agents ) ) ) )
+
+    # give back the DNs of agents that failed before their line was created
+    for position, result in enumerate( results ):
+        if position < len( reserved ) and result['primary_dn'] is None:
+            allocator.release( reserved[ position ] )
+
+    # pguser and zoomjtapi for all new CSFs at once
+    created = [ result for result in results if 'addPhone' in result['completed'] ]
+    for chunk in chunks( created, 200 ):
+        try:
+            mapped = associate_devices( service, [ result['device'] for result in chunk ] )
+        except Fault as err:
+            print( f'Zeep error: executeSQLUpdate: { err }' )
+            mapped = { }
+        for result in chunk:
+            for app_user in ( 'pguser', 'zoomjtapi' ):
+                ( result['completed'] if app_user in mapped.get( result['device'], () ) else result['failed'] ).append( app_user )
+            if result['failed'] and result['status'] == 'ok':
+                result['status'] = 'partial'
+    return results
+
+
+def onboard_agent( service, agent, dn, user, device_pools, examples, allocator ):
+    """Create the lines and CSF of one agent and update the end user, in order.
+
+    `user` is the agent's prefetch_users() row, None if the user doesn't exist, or
+    LOOKUP to fetch it with getUser."""
+    started = time.perf_counter()
+    enumber = agent['enumber']
+    result = { 'enumber': enumber, 'status': 'ok', 'device': None, 'device_pool': None,
+               'primary_dn': None, 'secondary_dn': None, 'completed': [ ], 'failed': [ ], 'error': None, 'seconds': 0 }
+
+    def fail( step, err ):
+        result['failed'].append( step )
+        result['status'] = 'failed'
+        result['error'] = f'{ step }: { err }'
+        print( enumber + ': ' + result['error'] )
+
+    try:
+        #workday search and local end user check to verify AD status
+        if user is None:
+            raise ValueError( 'No End User found for ' + enumber )
+        if user is LOOKUP:
+            try:
+                resp = read( service, 'end_user', 'getUser', userid = enumber )
+            except Fault:
+                raise ValueError( 'No End User found for ' + enumber )
+            user = { 'firstname': resp.get( 'firstName' ), 'lastname': resp.get( 'lastName' ), 'telephonenumber': resp.get( 'telephoneNumber' ) or '',
+                     'ldapdirectoryname': resp.get( 'ldapDirectoryName' ) or '' }
+        caller_id = agent.get( 'caller_id' )
+        if not caller_id:
+            if not user['ldapdirectoryname']:
+                raise ValueError( enumber + ' is a local user, add a caller_id to the manifest' )
+            caller_id = user['telephonenumber']
+            if '-' in caller_id or not caller_id:
+                raise ValueError( 'the caller ID from LDAP is not usable, add a caller_id to the manifest' )
+
+        settings = DEFAULT_SETTINGS
+        if agent.get( 'example_csf' ):
+            settings = examples[ agent['example_csf'].upper() ]
+            if isinstance( settings, Exception ):
+                raise ValueError( "Couldn't copy settings from " + agent['example_csf'] + ": " + str( settings ) )
+        dp = settings['devicePool']
+        if agent.get( 'device_pool' ):
+            dp = device_pools[ agent['device_pool'] ]
+            if isinstance( dp, Exception ):
+                raise dp
+        result['device_pool'] = dp
+    except ( Fault, ValueError ) as err:
+        fail( 'resolve', err )
+        result['seconds'] = round( time.perf_counter() - started, 2 )
+        return result
+
+    first_name = user['firstname']
+    last_name = user['lastname']
+
+    def describe( number ):
+        return first_name + " " + last_name + " " + str( number )
+
+    def remove_line( number, uuid, key ):
+        # don't leave a line behind without a phone, and give its DN back
+        try:
+            service.removeLine( uuid = uuid )
+        except Fault as err:
+            print( f'{ enumber }: Zeep error: removeLine { number }: { err }' )
+            return
+        allocator.release( number )
+        result[ key ] = None
+        if key == 'primary_dn':
+            result['completed'].remove( 'addLine' )
+
+    try:
+        if dn is None:
+            raise NoFreeDnError( 'no DN reserved' )
+        try:
+            primary_uuid = service.addLine( fill_new_line( dn, describe( dn ) ) )['return']
+        except Fault as err:
+            # someone took the reserved DN in the meantime, take the next free one
+            if 'duplicate' not in str( err ).lower():
+                raise
+            dn, primary_uuid = allocator.add_line( lambda number: fill_new_line( number, describe( number ) ) )
+        result['primary_dn'] = dn
+        result['completed'].append( 'addLine' )
+    except ( Fault, NoFreeDnError ) as err:
+        fail( 'addLine', err )
+        result['seconds'] = round( time.perf_counter() - started, 2 )
+        return result
+
+    agent_description = describe( dn )
+    lines = [ fill_line_appearance( 1, dn, primary_uuid, agent_description, caller_id, enumber ) ]
+    if settings.get( 'second_line_did' ):
+        print( enumber + ": this phone will need a DID assigned to it for it's second line." )
+    if settings['second_line']:
+        secondary_dn = dn + 1000
+        if not allocator.claim( secondary_dn ):
+            # someone else has it, the CSF goes ahead with the primary line only
+            result['failed'].append( 'addLine secondary' )
+            result['status'] = 'partial'
+            print( f'{ enumber }: secondary DN { secondary_dn } is already taken, skipping the second line' )
+        else:
+            try:
+                secondary_uuid = service.addLine( fill_new_line( secondary_dn, agent_description ) )['return']
+            except Fault as err:
+                allocator.release( secondary_dn )
+                fail( 'addLine secondary', err )
+                remove_line( dn, primary_uuid, 'primary_dn' )
+                result['seconds'] = round( time.perf_counter() - started, 2 )
+                return result
+            result['secondary_dn'] = secondary_dn
+            lines.append( fill_line_appearance( 2, secondary_dn, secondary_uuid, agent_description, caller_id, enumber ) )
+
+    owner_user_name = enumber.capitalize()
+    device_name = "CSF" + enumber.capitalize()
+    try:
+        service.addPhone( fill_csf_info( device_name, owner_user_name, agent_description, dp, settings['location'],
+                                         settings['mediaResourceList'], settings['css'], lines ) )
+        result['device'] = device_name
+        result['completed'].append( 'addPhone' )
+    except Fault as err:
+        fail( 'addPhone', err )
+        remove_line( dn, primary_uuid, 'primary_dn' )
+        if result['secondary_dn'] is not None:
+            remove_line( result['secondary_dn'], secondary_uuid, 'secondary_dn' )
+        result['seconds'] = round( time.perf_counter() - started, 2 )
+        return result
+
+    #update end user with ACG and Line info, and ensure that user is a home user.
+    try:
+        service.updateUser( userid = owner_user_name, associatedDevices = device_name,
+                            primaryExtension = { 'pattern': dn, 'routePartitionName': AGENT_PARTITION },
+                            associatedGroups = ACCESS_CONTROL_GROUPS, homeCluster = True, imAndPresenceEnable = False )
+        result['completed'].append( 'updateUser' )
+    except Fault as err:
+        result['failed'].append( 'updateUser' )
+        result['status'] = 'partial'
+        print( f'{ enumber }: Zeep error: updateUser: { err }' )
+
+    print( enumber + ': onboarded as ' + device_name + ' on ' + str( dn ) )
+    result['seconds'] = round( time.perf_counter() - started, 2 )
+    return result
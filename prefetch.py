@@ -0,0 +1,161 @@
+"""Look up the end users, device profiles and CIPCs for a whole agent list up front.
+
+Instead of a getUser, one or two getDeviceProfile and a listPhone call per agent,
+the bulk scripts run a couple of executeSQLQuery calls per chunk of agents and
+hand each worker a ready-made record. getDeviceProfile is still called once per
+agent for the line appearances, since those can't be rebuilt from SQL, but the
+8841/8851 guess is already settled so it never has to be retried.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import csv
+import json
+
+import axl_sql
+
+PROFILE_SUFFIXES = ( '_EM_8841', '_EM_8851' )
+
+# ldapdirectoryname of agents synced from Workday
+LDAP_DIRECTORY = 'Memorial Hermann Directory Sync'
+
+USERS_SQL = '''select e.userid, e.firstname, e.lastname, e.telephonenumber, dpc.name as ldapdirectoryname
+    from enduser e left join directorypluginconfig dpc on dpc.pkid = e.fkdirectorypluginconfig
+    where lower(e.userid) in ({userids})'''
+
+DEVICES_SQL = '''select d.name, dp.name as devicepool, mrl.name as mediaresourcelist,
+    css.name as callingsearchspace, loc.name as location
+    from device d
+    left join devicepool dp on dp.pkid = d.fkdevicepool
+    left join mediaresourcelist mrl on mrl.pkid = d.fkmediaresourcelist
+    left join callingsearchspace css on css.pkid = d.fkcallingsearchspace
+    left join location loc on loc.pkid = d.fklocation
+    where lower(d.name) in ({names})'''
+
+CIPC_TAGS = { 'name': '', 'devicePoolName': '', 'mediaResourceListName': '', 'callingSearchSpaceName': '', 'locationName': '' }
+
+# where the CSF goes when the CIPC it replaces can't be found
+CSF_DEFAULTS = { 'devicepool': 'Default', 'mediaresourcelist': 'MC_MRGL', 'callingsearchspace': '06_Device', 'location': 'Hub_None' }
+
+
+def lookup_cipc( service, name ):
+    """The prefetch_agents() 'phone' row for the device `name`, from listPhone. None
+    when there is no such device."""
+    return cipc_row( service.listPhone( searchCriteria = { 'name': name }, returnedTags = CIPC_TAGS ) )
+
+
+def cipc_row( resp ):
+    """listPhone response with CIPC_TAGS -> the 'phone' row of its first phone, or None."""
+    if resp['return'] is None or not resp['return']['phone']:
+        return None
+    phone = resp['return']['phone'][0]
+    fk = lambda value: value['_value_1'] if value is not None else None
+    return { 'name': phone['name'], 'devicepool': fk( phone['devicePoolName'] ), 'mediaresourcelist': fk( phone['mediaResourceListName'] ),
+             'callingsearchspace': fk( phone['callingSearchSpaceName'] ), 'location': fk( phone['locationName'] ) }
+
+
+def csf_placement( cipc, device_pool = None, keep_location = False ):
+    """Device pool, MRL, CSS and location for the CSF that replaces `cipc` (a 'phone'
+    row, None when the CIPC wasn't found), as addPhone arguments.
+
+    `device_pool` is the one the admin picked, if any. The location is only taken
+    from the CIPC with `keep_location`, the EM profile migrations use Hub_None."""
+    row = cipc or CSF_DEFAULTS
+    return {
+        'devicePoolName': device_pool or row['devicepool'] or CSF_DEFAULTS['devicepool'],
+        'mediaResourceListName': row['mediaresourcelist'],
+        'callingSearchSpaceName': row['callingsearchspace'],
+        'locationName': ( row['location'] if keep_location else None ) or CSF_DEFAULTS['location'],
+    }
+
+
+def read_agents( filename ):
+    """E#s from the first column of `filename`, skipping blank rows."""
+    with open( filename, 'r' ) as csvfile:
+        return [ row[0].strip() for row in csv.reader( csvfile ) if row and row[0].strip() ]
+
+
+def read_manifest( filename ):
+    """Agents to onboard from a .json list of objects or a CSV file with a header row."""
+    with open( filename, 'r', newline = '' ) as f:
+        if filename.lower().endswith( '.json' ):
+            rows = json.load( f )
+        else:
+            rows = list( csv.DictReader( f ) )
+    return manifest_rows( rows )
+
+
+def manifest_rows( rows ):
+    """Manifest rows (dicts) with lower case keys and stripped values, rows without an E# dropped."""
+    agents = [ ]
+    for row in rows:
+        row = { key.strip().lower(): ( value or '' ).strip() for key, value in row.items() if key }
+        if row.get( 'enumber' ):
+            agents.append( row )
+    return agents
+
+
+def prefetch_users( service, agents, chunk_size = 200, mirror = None ):
+    """Return { agent: end user row or None } for every E# in `agents`.
+
+    The rows have userid, firstname, lastname, telephonenumber and ldapdirectoryname
+    ('' for local users). With a `mirror` (see mirror.py) they come from there."""
+    if mirror is not None:
+        return mirror.users( agents )
+    users = { agent: None for agent in agents }
+    for chunk in axl_sql.chunks( agents, chunk_size ):
+        by_userid = { agent.lower(): agent for agent in chunk }
+        for row in axl_sql.query( service, USERS_SQL.format( userids = axl_sql.in_list( by_userid ) ) ):
+            agent = by_userid.get( row['userid'].lower() )
+            if agent is not None:
+                users[ agent ] = row
+    return users
+
+
+def prefetch_agents( service, agents, chunk_size = 200, mirror = None ):
+    """Return { agent: { 'user', 'profile', 'phone' } } for every E# in `agents`.
+
+    'user' is the prefetch_users() row, 'profile' the name of the agent's EM device
+    profile and 'phone' the CIPC row (name, devicepool, mediaresourcelist,
+    callingsearchspace, location). Anything that doesn't exist in CUCM is None."""
+    users = prefetch_users( service, agents, chunk_size, mirror )
+    records = { agent: { 'user': users[ agent ], 'profile': None, 'phone': None } for agent in agents }
+
+    if mirror is not None:
+        for agent in agents:
+            records[ agent ]['phone'] = mirror.device( agent )
+            profiles = ( mirror.device( agent + suffix ) for suffix in PROFILE_SUFFIXES )
+            records[ agent ]['profile'] = next( ( profile['name'] for profile in profiles if profile is not None ), None )
+        return records
+
+    # each agent needs 3 names (CIPC + both profiles), keep the in ( ... ) list the same size
+    for chunk in axl_sql.chunks( agents, max( 1, chunk_size // 3 ) ):
+        by_name = { agent.lower(): agent for agent in chunk }
+        names = list( by_name )
+        for name in by_name:
+            names.extend( name + suffix.lower() for suffix in PROFILE_SUFFIXES )
+        devices = { row['name'].lower(): row for row in axl_sql.query( service, DEVICES_SQL.format( names = axl_sql.in_list( names ) ) ) }
+
+        for name, agent in by_name.items():
+            records[ agent ]['phone'] = devices.get( name )
+            for suffix in PROFILE_SUFFIXES:
+                profile = devices.get( name + suffix.lower() )
+                if profile is not None:
+                    records[ agent ]['profile'] = profile['name']
+                    break
+    return records
@@ -0,0 +1,239 @@
+"""Deadlines learned per AXL operation, and retries that know which calls are safe to repeat.
+
+Without this AXL calls have no deadline at all: the transport's timeout=10 only
+covers loading the WSDL, zeep sends operations with operation_timeout None, so a
+call to a hung node waits forever. One fixed timeout doesn't fit AXL either: a
+getUser answers in a fraction of a second, a page of a cluster wide listPhone can
+take many seconds. CallPolicy keeps the latencies of the last calls of every
+operation it may retry and gives each call a deadline of `multiplier` times their
+`quantile`, at least MIN_TIMEOUT for reads and WRITE_MIN_TIMEOUT for writes (a
+write cut short is one more write to verify and resend) and at most MAX_TIMEOUT;
+until an operation has `min_samples` calls it gets DEFAULT_TIMEOUT, or
+LIST_TIMEOUT for list* and executeSQLQuery. Each retry doubles the deadline. The deadline is the
+requests timeout, so it bounds connecting and every wait for response bytes, not
+the whole transfer of a large answer that keeps arriving.
+
+When a call times out, loses its connection or gets an HTTP error other than
+throttling (which AimdController in throttle.py handles), what happens next
+depends on the operation:
+
+  reads (get*, list*, executeSQLQuery)   sent again, after a jittered backoff
+  updatePhone, updateUser                 sent again, setting the same values twice is harmless
+  addPhone, addLine, removePhone,         first checked with a read: when the first attempt
+  removeDeviceProfile                     did go through, its result is returned instead
+                                          of sending it again (which would fault)
+  anything else (executeSQLUpdate,        not retried, the error is raised as before
+  doDeviceLogout)
+
+Operations that are never retried get no deadline, as before: cutting them short
+would only turn a slow answer (e.g. a large executeSQLUpdate batch) into an error
+without knowing whether it ran. Faults are answers from CUCM and are raised right
+away. create_service() in axl_client.py puts every service behind the process wide
+default_policy(), set AXL_ADAPTIVE_TIMEOUTS=0 to send every call without a deadline
+and without retries.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import time
+import random
+import threading
+from collections import deque
+from contextvars import ContextVar
+
+from requests.exceptions import ConnectionError, Timeout
+from zeep.exceptions import Fault, TransportError
+
+from throttle import is_read, is_throttled
+
+DEFAULT_TIMEOUT = 10
+LIST_TIMEOUT = 60
+MIN_TIMEOUT = 1.0
+WRITE_MIN_TIMEOUT = 10.0
+MAX_TIMEOUT = 120
+
+# writes that leave CUCM the same whether they ran once or twice
+IDEMPOTENT_WRITES = ( 'updatePhone', 'updateUser' )
+
+# deadline of the AXL call running in this thread, read by axl_client.DeadlineAdapter
+_timeout = ContextVar( 'axl_timeout', default = None )
+
+
+def current_timeout():
+    """Deadline in seconds for the AXL request being sent, None outside of CallPolicy.call()."""
+    return _timeout.get()
+
+
+def _argument( args, kwargs, name ):
+    # addPhone( phone ) and addPhone( phone = phone ) are both used
+    return args[0] if args else kwargs[ name ]
+
+
+def _exists( lookup ):
+    try:
+        return lookup()
+    except Fault as err:
+        if 'not found' in str( err.message ).lower():
+            return None
+        raise
+
+
+def _added_phone( service, args, kwargs ):
+    phone = _exists( lambda: service.getPhone( name = _argument( args, kwargs, 'phone' )[ 'name' ], returnedTags = { 'name': '' } ) )
+    return { 'return': phone[ 'return' ][ 'phone' ][ 'uuid' ] } if phone else None
+
+
+def _added_line( service, args, kwargs ):
+    line = _argument( args, kwargs, 'line' )
+    found = _exists( lambda: service.getLine( pattern = line[ 'pattern' ], routePartitionName = line.get( 'routePartitionName' ),
+                                              returnedTags = { 'pattern': '' } ) )
+    return { 'return': found[ 'return' ][ 'line' ][ 'uuid' ] } if found else None
+
+
+def _removed( get ):
+    def check( service, args, kwargs ):
+        # removePhone( name ), removePhone( name = name ) and removePhone( uuid = uuid )
+        key = { 'uuid': kwargs[ 'uuid' ] } if 'uuid' in kwargs else { 'name': _argument( args, kwargs, 'name' ) }
+        return None if _exists( lambda: getattr( service, get )( **key, returnedTags = { 'name': '' } ) ) else { 'return': '' }
+    return check
+
+
+# operation: function( service, args, kwargs ) returning the response of an attempt
+# that went through, None when it didn't
+VERIFY = {
+    'addPhone': _added_phone,
+    'addLine': _added_line,
+    'removePhone': _removed( 'getPhone' ),
+    'removeDeviceProfile': _removed( 'getDeviceProfile' ),
+}
+
+
+def is_transient( err ):
+    """True for failures where CUCM may not have answered: timeouts, lost connections
+    and HTTP errors other than throttling."""
+    if isinstance( err, ( Timeout, ConnectionError ) ):
+        return True
+    return isinstance( err, TransportError ) and not is_throttled( err ) and err.status_code >= 500
+
+
+class CallPolicy:
+    """Deadlines and retries for AXL calls, shared by every thread of a process."""
+
+    def __init__( self, quantile = 0.99, multiplier = 3.0, min_samples = 20, window = 500, retries = 3, backoff = 0.2 ):
+        self.quantile = quantile
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self.window = window
+        self.retries = retries
+        self.backoff = backoff
+        self.retried = 0
+        self.verified = 0
+        self._latencies = { }
+        self._lock = threading.Lock()
+
+    def timeout( self, name ):
+        """Deadline for the next call of the AXL operation `name`, None for operations
+        that are never retried."""
+        if not self._may_retry( name ):
+            return None
+        with self._lock:
+            samples = sorted( self._latencies.get( name, ( ) ) )
+        if len( samples ) < self.min_samples:
+            return LIST_TIMEOUT if name.startswith( ( 'list', 'executeSQLQuery' ) ) else DEFAULT_TIMEOUT
+        seconds = samples[ min( len( samples ) - 1, int( self.quantile * len( samples ) ) ) ]
+        return min( MAX_TIMEOUT, max( MIN_TIMEOUT if is_read( name ) else WRITE_MIN_TIMEOUT, self.multiplier * seconds ) )
+
+    def record( self, name, seconds ):
+        if not self._may_retry( name ):
+            return
+        with self._lock:
+            self._latencies.setdefault( name, deque( maxlen = self.window ) ).append( seconds )
+
+    def call( self, name, operation, args, kwargs, service ):
+        """operation( *args, **kwargs ), `name` being the AXL operation it calls and
+        `service` what VERIFY reads from to check on a write."""
+        timeout = self.timeout( name )
+        for attempt in range( self.retries + 1 ):
+            token = _timeout.set( min( MAX_TIMEOUT, timeout * 2 ** attempt ) if timeout is not None else None )
+            started = time.perf_counter()
+            try:
+                result = operation( *args, **kwargs )
+            except Exception as err:
+                if not is_transient( err ) or attempt == self.retries or not self._may_retry( name ):
+                    raise
+                failure = err
+            else:
+                self.record( name, time.perf_counter() - started )
+                return result
+            finally:
+                _timeout.reset( token )
+            time.sleep( self.backoff * 2 ** attempt * random.uniform( 0.5, 1.5 ) )
+            self.retried += 1
+            if name in VERIFY:
+                try:
+                    committed = VERIFY[ name ]( service, args, kwargs )
+                except Exception:
+                    # can't tell whether it went through, sending it again could do it twice
+                    raise failure
+                if committed is not None:
+                    self.verified += 1
+                    return committed
+
+    def _may_retry( self, name ):
+        return is_read( name ) or name in IDEMPOTENT_WRITES or name in VERIFY
+
+    def describe( self ):
+        """The learned deadlines and how many calls were retried, '' when there is neither."""
+        with self._lock:
+            names = sorted( self._latencies )
+        parts = [ ', '.join( f'{ name } { self.timeout( name ):.1f}s' for name in names ) ] if names else [ ]
+        if self.retried:
+            parts.append( f'{ self.retried } retried, { self.verified } writes found done' )
+        return '; '.join( parts )
+
+
+class PolicyService:
+    """Wraps a zeep service proxy so every AXL operation goes through `policy`."""
+
+    def __init__( self, service, policy ):
+        self._service = service
+        self._policy = policy
+
+    def __getattr__( self, name ):
+        operation = getattr( self._service, name )
+
+        def call( *args, **kwargs ):
+            return self._policy.call( name, operation, args, kwargs, self._service )
+
+        return call
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_policy():
+    """The CallPolicy of this process, None when AXL_ADAPTIVE_TIMEOUTS=0."""
+    global _default
+    if os.getenv( 'AXL_ADAPTIVE_TIMEOUTS', '1' ) == '0':
+        return None
+    with _default_lock:
+        if _default is None:
+            _default = CallPolicy()
+        return _default
@@ -0,0 +1,175 @@
+"""Tests for axl_async.py against axl_simulator.py, in process.
+
+    python3 -m pytest tests
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from zeep.exceptions import TransportError
+from zeep.proxy import AsyncServiceProxy
+
+from axl_async import AsyncLimitedService, create_async_client, migrate_agent
+from axl_client import BINDING_NAME
+from axl_simulator import AxlSimulator, AxlState, fk_name, new_uuid, serve
+from journal import MigrationJournal
+from tracing import TracingPlugin
+
+
+class EmptyErrorTest( unittest.TestCase ):
+    """HTTP 503 with an empty body, as CUCM's web server sends while AXL restarts."""
+
+    @classmethod
+    def setUpClass( cls ):
+        os.environ.setdefault( 'AXL_USERNAME', 'test' )
+        os.environ.setdefault( 'AXL_PASSWORD', 'test' )
+        state = AxlState()
+        cls.enumbers = state.seed( 2 )
+        cls.simulator = AxlSimulator( state, error_rate = { 'getPhone': 1.0 } )
+        cls.server = serve( cls.simulator, port = 0 )
+        cls.url = f'http://127.0.0.1:{ cls.server.server_address[1] }/axl/'
+
+    @classmethod
+    def tearDownClass( cls ):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def call( self, operation, **kwargs ):
+        async def run():
+            client = create_async_client( tracer = self.tracer )
+            service = AsyncLimitedService( AsyncServiceProxy( client, client.wsdl.bindings[ BINDING_NAME ], address = self.url ),
+                                           retries = 2, backoff = 0 )
+            try:
+                return await getattr( service, operation )( **kwargs )
+            finally:
+                await client.transport.client.aclose()
+        return asyncio.run( run() )
+
+    def setUp( self ):
+        self.tracer = TracingPlugin()
+        self.simulator.calls.clear()
+
+    def test_retried_then_raised( self ):
+        with self.assertRaises( TransportError ) as caught:
+            self.call( 'getPhone', name = self.enumbers[0].capitalize() )
+        self.assertEqual( caught.exception.status_code, 503 )
+        self.assertEqual( self.simulator.calls[ 'getPhone' ], 3 )
+
+    def test_traced_as_error( self ):
+        with self.assertRaises( TransportError ):
+            self.call( 'getPhone', name = self.enumbers[0].capitalize() )
+        records = list( self.tracer.records )
+        self.assertEqual( len( records ), 3 )
+        self.assertTrue( all( record.status == 503 and record.error for record in records ) )
+
+    def test_other_operations_answer( self ):
+        response = self.call( 'getUser', userid = self.enumbers[0] )
+        self.assertEqual( response[ 'return' ][ 'user' ][ 'userid' ].lower(), self.enumbers[0] )
+
+    def test_cancelled_request_closes_connection( self ):
+        async def run():
+            client = create_async_client()
+            transport = client.transport.client._transport
+            service = AsyncServiceProxy( client, client.wsdl.bindings[ BINDING_NAME ], address = self.url )
+            try:
+                await service.getUser( userid = self.enumbers[0] )
+                ( connection, ) = [ connection for idle in transport._idle.values() for connection in idle ]
+                self.simulator.latency = { 'getUser': 1 }
+                task = asyncio.ensure_future( service.getUser( userid = self.enumbers[0] ) )
+                await asyncio.sleep( 0.2 )
+                task.cancel()
+                with self.assertRaises( asyncio.CancelledError ):
+                    await task
+                return connection[1].is_closing(), sum( len( idle ) for idle in transport._idle.values() )
+            finally:
+                self.simulator.latency = { }
+                await client.transport.client.aclose()
+
+        closed, idle = asyncio.run( run() )
+        self.assertTrue( closed )
+        self.assertEqual( idle, 0 )
+
+
+class MigrateAgentTest( unittest.TestCase ):
+    """Resuming from journals bulk_agent_migrator.py writes."""
+
+    @classmethod
+    def setUpClass( cls ):
+        os.environ.setdefault( 'AXL_USERNAME', 'test' )
+        os.environ.setdefault( 'AXL_PASSWORD', 'test' )
+        cls.state = AxlState()
+        cls.enumbers = cls.state.seed( 3 )
+        cls.simulator = AxlSimulator( cls.state )
+        cls.server = serve( cls.simulator, port = 0 )
+        cls.url = f'http://127.0.0.1:{ cls.server.server_address[1] }/axl/'
+
+    @classmethod
+    def tearDownClass( cls ):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp( self ):
+        self.dir = tempfile.TemporaryDirectory()
+        self.journal = MigrationJournal( os.path.join( self.dir.name, 'journal.jsonl' ) )
+        self.simulator.calls.clear()
+
+    def tearDown( self ):
+        self.journal.close()
+        self.dir.cleanup()
+
+    def migrate( self, enumber ):
+        async def run():
+            client = create_async_client()
+            service = AsyncLimitedService( AsyncServiceProxy( client, client.wsdl.bindings[ BINDING_NAME ], address = self.url ) )
+            try:
+                return await migrate_agent( service, enumber, journal = self.journal )
+            finally:
+                await client.transport.client.aclose()
+        return asyncio.run( run() )
+
+    def add_csf( self, enumber ):
+        """The CSF as an earlier run created it, in the Default device pool."""
+        name = 'CSF' + enumber.capitalize()
+        self.state.phones[ name.lower() ] = { 'uuid': new_uuid(), 'name': name, 'devicePoolName': 'Default' }
+        return name
+
+    def journal_csf( self, enumber, device, **data ):
+        profile = next( profile[ 'name' ] for key, profile in self.state.profiles.items() if key.startswith( enumber ) )
+        self.journal.done( enumber, 'addPhone', profile = profile, device = device, **data )
+
+    def test_csf_created_but_not_journaled( self ):
+        enumber = self.enumbers[0]
+        device = self.add_csf( enumber )
+        result = self.migrate( enumber )
+        self.assertEqual( result[ 'status' ], 'ok' )
+        self.assertEqual( self.journal.steps( enumber )[ 'addPhone' ][ 'device' ], device )
+        self.assertTrue( self.journal.steps( enumber )[ 'addPhone' ][ 'placed' ] )
+
+    def test_app_user_mapped_by_the_last_run( self ):
+        enumber = self.enumbers[1]
+        device = self.add_csf( enumber )
+        self.journal_csf( enumber, device, placed = True )
+        self.state.app_user_devices[ 'pguser' ].add( device.lower() )
+        result = self.migrate( enumber )
+        self.assertEqual( result[ 'status' ], 'ok' )
+        self.assertIn( 'pguser', self.journal.steps( enumber ) )
+        self.assertEqual( self.simulator.calls[ 'addPhone' ], 0 )
+
+    def test_journal_without_placed_csf( self ):
+        enumber = self.enumbers[2]
+        device = self.add_csf( enumber )
+        self.journal_csf( enumber, device )
+        result = self.migrate( enumber )
+        self.assertEqual( result[ 'status' ], 'ok' )
+        self.assertIn( 'updatePhone', self.journal.steps( enumber ) )
+        cipc = self.state.phones[ enumber ]
+        self.assertEqual( fk_name( self.state.phones[ device.lower() ][ 'devicePoolName' ] ), fk_name( cipc[ 'devicePoolName' ] ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
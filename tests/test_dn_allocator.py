@@ -0,0 +1,138 @@
+"""Tests for dn_allocator.py, against a fake CUCM.
+
+    python3 -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from zeep.exceptions import Fault
+
+import dn_allocator
+from dn_allocator import DnAllocator, NoFreeDnError
+
+FIRST = 121605300
+
+
+class FakeCucm:
+    """The lines of the block, listLine, the existing DN query and addLine."""
+
+    def __init__( self, used = ( ) ):
+        self.lines = set( used )
+        self.list_calls = 0
+        self.sql = True
+        # DNs the existing DN query misses, as if created right after it ran
+        self.hidden = set()
+
+    def iter_list( self, service, operation, criteria, tags ):
+        self.list_calls += 1
+        return [ { 'pattern': str( dn ) } for dn in sorted( self.lines ) ]
+
+    def existing_dns( self, service, dns ):
+        if not self.sql:
+            raise Fault( 'executeSQLQuery is not allowed for this user' )
+        return { dn for dn in dns if dn in self.lines and dn not in self.hidden }
+
+    def addLine( self, line ):
+        dn = int( line[ 'pattern' ] )
+        if dn in self.lines:
+            raise Fault( 'Could not insert new row - duplicate value in a UNIQUE INDEX column' )
+        self.lines.add( dn )
+        return { 'return': f'{{{ dn }}}' }
+
+
+class DnAllocatorTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cucm = FakeCucm( { FIRST, FIRST + 1, FIRST + 3 } )
+        for name in ( 'iter_list', 'existing_dns' ):
+            patcher = mock.patch.object( dn_allocator, name, getattr( self.cucm, name ) )
+            patcher.start()
+            self.addCleanup( patcher.stop )
+
+    def tearDown( self ):
+        self.dir.cleanup()
+
+    def allocator( self, ttl = 3600 ):
+        return DnAllocator( self.cucm, '1216053', 9, ttl = ttl, cache_dir = self.dir.name )
+
+    def test_lowest_free_first( self ):
+        allocator = self.allocator()
+        self.assertEqual( allocator.reserve( 2 ), [ FIRST + 2, FIRST + 4 ] )
+        self.assertEqual( allocator.reserve(), [ FIRST + 5 ] )
+        self.assertEqual( allocator.free_count(), 100 - 6 )
+
+    def test_skips_numbers_taken_since_load( self ):
+        allocator = self.allocator()
+        self.cucm.lines.add( FIRST + 2 )
+        self.assertEqual( allocator.reserve(), [ FIRST + 4 ] )
+
+    def test_release( self ):
+        allocator = self.allocator()
+        dn = allocator.reserve()[0]
+        allocator.release( dn )
+        self.assertEqual( allocator.reserve(), [ dn ] )
+
+    def test_block_full( self ):
+        self.cucm.lines = set( range( FIRST, FIRST + 99 ) )
+        allocator = self.allocator()
+        self.assertEqual( allocator.reserve(), [ FIRST + 99 ] )
+        with self.assertRaises( NoFreeDnError ):
+            allocator.reserve()
+
+    def test_claim( self ):
+        allocator = self.allocator()
+        self.assertTrue( allocator.claim( FIRST + 2 ) )
+        self.assertEqual( allocator.reserve(), [ FIRST + 4 ] )
+        self.assertFalse( allocator.claim( FIRST + 2 ) )
+        self.assertFalse( allocator.claim( FIRST + 3 ) )
+        # outside the block only CUCM is asked
+        self.cucm.lines.add( FIRST + 1001 )
+        self.assertTrue( allocator.claim( FIRST + 1000 ) )
+        self.assertFalse( allocator.claim( FIRST + 1001 ) )
+
+    def test_add_line_moves_on_from_a_duplicate( self ):
+        allocator = self.allocator()
+        self.cucm.lines.add( FIRST + 2 )
+        self.cucm.hidden.add( FIRST + 2 )
+        dn, uuid = allocator.add_line( lambda number: { 'pattern': str( number ) } )
+        self.assertEqual( dn, FIRST + 4 )
+        self.assertIn( dn, self.cucm.lines )
+
+    def test_add_line_releases_on_other_faults( self ):
+        allocator = self.allocator()
+
+        def broken( number ):
+            raise Fault( 'Route partition not found' )
+
+        self.cucm.addLine = lambda line: broken( line )
+        with self.assertRaises( Fault ):
+            allocator.add_line( lambda number: { 'pattern': str( number ) } )
+        self.assertEqual( allocator.reserve(), [ FIRST + 2 ] )
+
+    def test_cached_index( self ):
+        self.allocator()
+        self.allocator()
+        self.assertEqual( self.cucm.list_calls, 1 )
+
+    def test_reloads_after_ttl( self ):
+        allocator = self.allocator()
+        mine = allocator.reserve()[0]
+        # another tool takes the next free number, and the existing DN query isn't allowed
+        self.cucm.lines.add( FIRST + 4 )
+        self.cucm.sql = False
+        allocator._loaded_at -= 3600
+        self.assertEqual( allocator.reserve(), [ FIRST + 5 ] )
+        self.assertEqual( self.cucm.list_calls, 2 )
+        # the reservation that isn't in CUCM yet survived the reload
+        self.assertNotIn( mine, allocator.reserve( 2 ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
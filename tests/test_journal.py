@@ -0,0 +1,76 @@
+"""Tests for journal.py.
+
+    python3 -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from journal import MigrationJournal
+
+
+class MigrationJournalTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join( self.dir.name, 'journal.jsonl' )
+
+    def tearDown( self ):
+        self.dir.cleanup()
+
+    def test_resume( self ):
+        journal = MigrationJournal( self.path )
+        journal.done( 'e100001', 'addPhone', uuid = 'abc' )
+        journal.finish( 'e100001', 'ok' )
+        journal.close()
+
+        journal = MigrationJournal( self.path )
+        self.assertEqual( journal.steps( 'E100001' ), { 'addPhone': { 'uuid': 'abc' } } )
+        self.assertEqual( journal.status( 'e100001' ), 'ok' )
+        journal.close()
+
+    def test_truncated_last_line( self ):
+        journal = MigrationJournal( self.path )
+        journal.done( 'e100001', 'addPhone', uuid = 'abc' )
+        journal.close()
+        # killed halfway through writing the next entry
+        with open( self.path, 'a', encoding = 'utf-8' ) as f:
+            f.write( '{"agent": "e100001", "step": "updateUser", "da' )
+
+        journal = MigrationJournal( self.path )
+        self.assertEqual( journal.steps( 'e100001' ), { 'addPhone': { 'uuid': 'abc' } } )
+        journal.done( 'e100001', 'updateUser' )
+        journal.close()
+
+        # the entry written after the partial line is still readable
+        journal = MigrationJournal( self.path )
+        self.assertEqual( journal.steps( 'e100001' ), { 'addPhone': { 'uuid': 'abc' }, 'updateUser': { } } )
+        journal.close()
+        with open( self.path, encoding = 'utf-8' ) as f:
+            self.assertEqual( len( f.read().splitlines() ), 3 )
+
+    def test_failed_step_stays_to_do( self ):
+        journal = MigrationJournal( self.path )
+        journal.done( 'e100001', 'retire', cipc = 'SEP1', profile = 'E100001_EM_8841' )
+        journal.failed( 'e100001', 'removePhone', 'ConnectionError: refused' )
+        journal.close()
+
+        journal = MigrationJournal( self.path )
+        self.assertEqual( list( journal.steps( 'e100001' ) ), [ 'retire' ] )
+        journal.close()
+
+    def test_empty_file( self ):
+        open( self.path, 'w' ).close()
+        journal = MigrationJournal( self.path )
+        journal.done( 'e100001', 'addPhone' )
+        journal.close()
+        with open( self.path, encoding = 'utf-8' ) as f:
+            self.assertEqual( len( f.read().splitlines() ), 1 )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+"""Tests for metrics.py.
+
+    python3 -m pytest tests
+"""
+
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from metrics import OperationStats
+
+
+def record( seconds ):
+    return SimpleNamespace( seconds = seconds, request_bytes = 100, response_bytes = 200, fault_code = None, error = None )
+
+
+class OperationStatsTest( unittest.TestCase ):
+
+    def test_percentiles_of_the_last_samples( self ):
+        stats = OperationStats( 'getPhone', samples = 100 )
+        for n in range( 1000 ):
+            stats.add( record( 5.0 if n < 900 else 0.1 ) )
+        self.assertEqual( len( stats.latencies ), 100 )
+        summary = stats.summary()
+        self.assertEqual( summary[ 'p99' ], 0.1 )
+        # count, max, total and averages still cover every call
+        self.assertEqual( summary[ 'count' ], 1000 )
+        self.assertEqual( summary[ 'max' ], 5.0 )
+        self.assertAlmostEqual( summary[ 'total_seconds' ], 900 * 5.0 + 100 * 0.1 )
+        self.assertEqual( summary[ 'avg_response_bytes' ], 200 )
+
+    def test_empty( self ):
+        summary = OperationStats( 'getPhone' ).summary()
+        self.assertEqual( ( summary[ 'count' ], summary[ 'p50' ], summary[ 'max' ], summary[ 'total_seconds' ] ), ( 0, None, None, 0 ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+"""Tests for retry_policy.py.
+
+    python3 -m pytest tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from requests.exceptions import ConnectionError, Timeout
+from zeep.exceptions import Fault, TransportError
+
+from retry_policy import DEFAULT_TIMEOUT, LIST_TIMEOUT, MIN_TIMEOUT, WRITE_MIN_TIMEOUT, CallPolicy, current_timeout, is_transient
+
+
+class FakeCucm:
+    """Phones and lines, with writes that time out after CUCM committed them."""
+
+    def __init__( self ):
+        self.phones = { }
+        self.lines = { }
+        self.calls = [ ]
+        # errors the next writes raise once they have committed, or before with `commit` False
+        self.timeouts = [ ]
+        self.commit = True
+        self.reads_fail = False
+
+    def _write( self, name, change ):
+        self.calls.append( name )
+        if self.timeouts and not self.commit:
+            raise self.timeouts.pop( 0 )
+        result = change()
+        if self.timeouts:
+            raise self.timeouts.pop( 0 )
+        return { 'return': result }
+
+    def _read( self, table, key, what ):
+        if self.reads_fail:
+            raise ConnectionError( 'connection refused' )
+        if key not in table:
+            raise Fault( f'Item not valid: The specified { what } was not found' )
+        return table[ key ]
+
+    def addPhone( self, phone ):
+        return self._write( 'addPhone', lambda: self.phones.setdefault( phone[ 'name' ], '{%s}' % phone[ 'name' ] ) )
+
+    def addLine( self, line ):
+        return self._write( 'addLine', lambda: self.lines.setdefault( line[ 'pattern' ], '{%s}' % line[ 'pattern' ] ) )
+
+    def removePhone( self, name = None, uuid = None ):
+        if uuid is not None:
+            name = next( key for key, value in self.phones.items() if value == uuid )
+        return self._write( 'removePhone', lambda: self.phones.pop( name ) and '' )
+
+    def executeSQLUpdate( self, sql ):
+        return self._write( 'executeSQLUpdate', lambda: { 'rowsUpdated': 1 } )
+
+    def doDeviceLogout( self, deviceName ):
+        return self._write( 'doDeviceLogout', lambda: '' )
+
+    def getPhone( self, name = None, uuid = None, returnedTags = None ):
+        if uuid is not None:
+            name = next( ( key for key, value in self.phones.items() if value == uuid ), None )
+        return { 'return': { 'phone': { 'uuid': self._read( self.phones, name, 'Phone' ) } } }
+
+    def getLine( self, pattern, routePartitionName = None, returnedTags = None ):
+        return { 'return': { 'line': { 'uuid': self._read( self.lines, pattern, 'Line' ) } } }
+
+
+class CallPolicyTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.policy = CallPolicy( min_samples = 5 )
+
+    def learn( self, name, seconds ):
+        for n in range( 10 ):
+            self.policy.record( name, seconds )
+
+    def test_not_retried_has_no_deadline( self ):
+        for name in ( 'executeSQLUpdate', 'doDeviceLogout' ):
+            self.learn( name, 0.01 )
+            self.assertIsNone( self.policy.timeout( name ) )
+        seen = [ ]
+        self.policy.call( 'executeSQLUpdate', lambda: seen.append( current_timeout() ), ( ), { }, None )
+        self.assertEqual( seen, [ None ] )
+
+    def test_defaults_before_enough_samples( self ):
+        self.assertEqual( self.policy.timeout( 'getPhone' ), DEFAULT_TIMEOUT )
+        self.assertEqual( self.policy.timeout( 'listPhone' ), LIST_TIMEOUT )
+        self.assertEqual( self.policy.timeout( 'addPhone' ), DEFAULT_TIMEOUT )
+
+    def test_learned_deadline_floors( self ):
+        self.learn( 'getPhone', 0.01 )
+        self.learn( 'addPhone', 0.01 )
+        self.learn( 'listPhone', 2.0 )
+        self.assertEqual( self.policy.timeout( 'getPhone' ), MIN_TIMEOUT )
+        self.assertEqual( self.policy.timeout( 'addPhone' ), WRITE_MIN_TIMEOUT )
+        self.assertAlmostEqual( self.policy.timeout( 'listPhone' ), 6.0 )
+
+
+class RetryTest( unittest.TestCase ):
+    """Calls that time out, see FakeCucm."""
+
+    def setUp( self ):
+        self.policy = CallPolicy( backoff = 0 )
+        self.cucm = FakeCucm()
+
+    def call( self, operation, *args, **kwargs ):
+        return self.policy.call( operation, getattr( self.cucm, operation ), args, kwargs, self.cucm )
+
+    def test_committed_add_is_not_sent_again( self ):
+        self.cucm.timeouts = [ Timeout( 'read timed out' ) ]
+        self.assertEqual( self.call( 'addPhone', { 'name': 'CSFE100001' } ), { 'return': '{CSFE100001}' } )
+        self.cucm.timeouts = [ ConnectionError( 'connection reset' ) ]
+        self.assertEqual( self.call( 'addLine', line = { 'pattern': '121605302' } ), { 'return': '{121605302}' } )
+        self.assertEqual( self.cucm.calls, [ 'addPhone', 'addLine' ] )
+        self.assertEqual( ( self.policy.retried, self.policy.verified ), ( 2, 2 ) )
+
+    def test_committed_remove_is_not_sent_again( self ):
+        for args, kwargs in ( ( ( 'SEP1', ), { } ), ( ( ), { 'name': 'SEP2' } ), ( ( ), { 'uuid': '{SEP3}' } ) ):
+            self.cucm.phones = { 'SEP1': '{SEP1}', 'SEP2': '{SEP2}', 'SEP3': '{SEP3}' }
+            self.cucm.calls.clear()
+            self.cucm.timeouts = [ Timeout( 'read timed out' ) ]
+            self.assertEqual( self.call( 'removePhone', *args, **kwargs ), { 'return': '' } )
+            self.assertEqual( self.cucm.calls, [ 'removePhone' ] )
+
+    def test_add_that_did_not_commit_is_sent_again( self ):
+        self.cucm.commit = False
+        self.cucm.timeouts = [ Timeout( 'read timed out' ) ]
+        self.assertEqual( self.call( 'addPhone', { 'name': 'CSFE100001' } ), { 'return': '{CSFE100001}' } )
+        self.assertEqual( self.cucm.calls, [ 'addPhone', 'addPhone' ] )
+        self.assertEqual( self.policy.verified, 0 )
+
+    def test_original_error_when_the_check_fails( self ):
+        timeout = Timeout( 'read timed out' )
+        self.cucm.timeouts = [ timeout ]
+        self.cucm.reads_fail = True
+        with self.assertRaises( Timeout ) as caught:
+            self.call( 'addPhone', { 'name': 'CSFE100001' } )
+        self.assertIs( caught.exception, timeout )
+        self.assertEqual( self.cucm.calls, [ 'addPhone' ] )
+
+    def test_throttling_is_left_to_aimd( self ):
+        self.assertFalse( is_transient( TransportError( status_code = 503 ) ) )
+        self.assertFalse( is_transient( TransportError( status_code = 429 ) ) )
+        self.assertFalse( is_transient( Fault( 'Could not insert new row - duplicate value in a UNIQUE INDEX column' ) ) )
+        self.assertTrue( is_transient( TransportError( status_code = 500 ) ) )
+        self.assertTrue( is_transient( Timeout() ) )
+        self.cucm.commit = False
+        self.cucm.timeouts = [ TransportError( status_code = 503 ) ]
+        with self.assertRaises( TransportError ):
+            self.call( 'addPhone', { 'name': 'CSFE100001' } )
+        self.assertEqual( ( self.cucm.calls, self.policy.retried ), ( [ 'addPhone' ], 0 ) )
+
+    def test_sql_updates_and_logouts_are_never_retried( self ):
+        for name, args in ( ( 'executeSQLUpdate', ( 'insert into applicationuserdevicemap ...', ) ), ( 'doDeviceLogout', ( 'SEP1', ) ) ):
+            self.cucm.calls.clear()
+            self.cucm.commit = False
+            self.cucm.timeouts = [ Timeout( 'read timed out' ) ]
+            with self.assertRaises( Timeout ):
+                self.call( name, *args )
+            self.assertEqual( self.cucm.calls, [ name ] )
+        self.assertEqual( self.policy.retried, 0 )
+
+    def test_describe( self ):
+        self.assertEqual( self.policy.describe(), '' )
+        self.policy.record( 'getPhone', 0.1 )
+        self.assertEqual( self.policy.describe(), f'getPhone { DEFAULT_TIMEOUT:.1f}s' )
+        self.cucm.timeouts = [ Timeout( 'read timed out' ) ]
+        self.call( 'addPhone', { 'name': 'CSFE100001' } )
+        self.assertEqual( self.policy.describe(), f'getPhone { DEFAULT_TIMEOUT:.1f}s; 1 retried, 1 writes found done' )
+
+
+if __name__ == '__main__':
+    unittest.main()
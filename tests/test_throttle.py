@@ -0,0 +1,165 @@
+"""Tests for the AIMD concurrency limits in throttle.py, on a fake clock.
+
+    python3 -m pytest tests
+"""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from zeep.exceptions import Fault, TransportError
+
+import throttle
+from throttle import AimdController, AimdLimit
+
+
+class FakeClock:
+    """Stands in for the time module, sleep() only moves the clock."""
+
+    def __init__( self ):
+        self.now = 1000.0
+        self.slept = [ ]
+
+    def monotonic( self ):
+        return self.now
+
+    perf_counter = monotonic
+
+    def sleep( self, seconds ):
+        self.slept.append( seconds )
+        self.now += seconds
+
+
+class FakeOperation:
+    """An AXL operation taking `seconds`, raising the queued errors first."""
+
+    def __init__( self, clock, errors = ( ), seconds = 0.1 ):
+        self.clock = clock
+        self.errors = list( errors )
+        self.seconds = seconds
+        self.calls = 0
+
+    def __call__( self, *args, **kwargs ):
+        self.calls += 1
+        self.clock.now += self.seconds
+        if self.errors:
+            raise self.errors.pop( 0 )
+        return { 'return': 'ok' }
+
+
+class AimdTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.clock = FakeClock()
+        patcher = mock.patch.object( throttle, 'time', self.clock )
+        patcher.start()
+        self.addCleanup( patcher.stop )
+
+    def respond( self, limit, seconds = 0.1, congested = False, count = 1 ):
+        for n in range( count ):
+            limit.acquire()
+            self.clock.now += seconds
+            limit.release( seconds, congested = congested )
+
+    def test_additive_increase_per_window( self ):
+        limit = AimdLimit( initial = 4 )
+        self.respond( limit, count = 3 )
+        self.assertEqual( limit.limit, 4 )
+        self.respond( limit )
+        self.assertEqual( limit.limit, 5 )
+        # the next window is one response longer
+        self.respond( limit, count = 5 )
+        self.assertEqual( limit.limit, 6 )
+        self.assertEqual( limit.peak, 6 )
+
+    def test_increase_stops_at_maximum( self ):
+        limit = AimdLimit( initial = 4, maximum = 5 )
+        self.respond( limit, count = 50 )
+        self.assertEqual( limit.limit, 5 )
+
+    def test_cut_at_most_once_per_round_trip( self ):
+        limit = AimdLimit( initial = 16 )
+        self.respond( limit, count = 3 )
+        # the requests in flight during the overload all come back congested
+        for n in range( 4 ):
+            limit.release( 0.1, congested = True )
+        self.assertEqual( limit.limit, 8 )
+        self.assertEqual( limit.cuts, 1 )
+        self.clock.now += 0.2
+        limit.release( 0.1, congested = True )
+        self.assertEqual( limit.limit, 4 )
+        self.assertEqual( limit.cuts, 2 )
+
+    def test_cut_stops_at_minimum( self ):
+        limit = AimdLimit( initial = 2, minimum = 1 )
+        for n in range( 5 ):
+            self.clock.now += 1
+            limit.release( 0.1, congested = True )
+        self.assertEqual( limit.limit, 1 )
+
+    def test_latency_spike_is_congestion( self ):
+        limit = AimdLimit( initial = 32 )
+        self.respond( limit, count = 10 )
+        self.respond( limit, seconds = 0.25 )
+        self.assertEqual( limit.cuts, 0 )
+        self.respond( limit, seconds = 0.5 )
+        self.assertEqual( limit.cuts, 1 )
+        self.assertEqual( limit.limit, 16 )
+
+    def test_no_spike_before_ten_samples( self ):
+        limit = AimdLimit( initial = 32 )
+        self.respond( limit, count = 9 )
+        self.respond( limit, seconds = 5 )
+        self.assertEqual( limit.cuts, 0 )
+
+    def test_retries_throttled_errors( self ):
+        controller = AimdController( retries = 4, backoff = 0.5 )
+        operation = FakeOperation( self.clock, [ TransportError( status_code = 503 ),
+                                                 Fault( 'AXL request throttled, try again later' ) ] )
+        self.assertEqual( controller.call( 'addPhone', operation, ( ), { } ), { 'return': 'ok' } )
+        self.assertEqual( operation.calls, 3 )
+        self.assertEqual( len( self.clock.slept ), 2 )
+        # the pause before the retry is longer than a round trip, so both count
+        self.assertEqual( ( controller.write.cuts, controller.read.cuts ), ( 2, 0 ) )
+
+    def test_gives_up_after_retries( self ):
+        controller = AimdController( retries = 2, backoff = 0 )
+        operation = FakeOperation( self.clock, [ TransportError( status_code = 429 ) ] * 5 )
+        with self.assertRaises( TransportError ):
+            controller.call( 'getPhone', operation, ( ), { } )
+        self.assertEqual( operation.calls, 3 )
+
+    def test_other_errors_are_not_retried( self ):
+        controller = AimdController( backoff = 0 )
+        for err in ( Fault( 'Could not insert new row - duplicate value in a UNIQUE INDEX column' ),
+                     TransportError( status_code = 500 ) ):
+            operation = FakeOperation( self.clock, [ err ] )
+            with self.assertRaises( type( err ) ):
+                controller.call( 'addLine', operation, ( ), { } )
+            self.assertEqual( operation.calls, 1 )
+        self.assertEqual( controller.write.cuts, 0 )
+
+    def test_separate_read_and_write_limits( self ):
+        controller = AimdController( maximum = 32 )
+        self.assertEqual( ( controller.read.maximum, controller.write.maximum ), ( 32, 16 ) )
+        seen = [ ]
+
+        def operation():
+            seen.append( ( controller.read.in_flight, controller.write.in_flight ) )
+
+        controller.call( 'listPhone', operation, ( ), { } )
+        controller.call( 'executeSQLQuery', operation, ( ), { } )
+        controller.call( 'updatePhone', operation, ( ), { } )
+        self.assertEqual( seen, [ ( 1, 0 ), ( 1, 0 ), ( 0, 1 ) ] )
+
+        write_limit = controller.write.limit
+        controller.call( 'getPhone', FakeOperation( self.clock, [ TransportError( status_code = 503 ) ] ), ( ), { } )
+        self.assertEqual( controller.read.cuts, 1 )
+        self.assertEqual( ( controller.write.cuts, controller.write.limit ), ( 0, write_limit ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
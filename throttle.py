@@ -0,0 +1,218 @@
+"""Rate limiting for AXL calls shared by concurrent migration workers.
+
+CUCM throttles AXL when too many requests arrive at once, so every worker goes
+through one RateLimiter. RateLimitedService wraps the zeep service proxy so the
+migration code keeps calling service.getPhone(...) etc. exactly as before.
+
+AimdController adapts instead of relying on a fixed rate: it lets one more request
+be in flight every time a full window of requests came back healthy, and halves
+the number when CUCM answers with a throttling fault (HTTP 503, "AXL throttle",
+"Maximum AXL Memory Allocation Consumed"), a timeout or a latency spike. Reads and
+writes get separate limits, CUCM throttles writes much earlier. AdaptiveService
+puts it in front of the zeep service proxy.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import re
+import time
+import asyncio
+import random
+import threading
+
+from requests.exceptions import Timeout
+from zeep.exceptions import Fault, TransportError
+
+# Fault text CUCM uses when it sheds AXL load
+THROTTLE_RE = re.compile( r'throttl|memory allocation|maximum axl|too many requests|try again later', re.IGNORECASE )
+
+READ_PREFIXES = ( 'get', 'list', 'executeSQLQuery' )
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` calls per second, shared between threads.
+
+    A rate of 0 (or None) disables limiting."""
+
+    def __init__( self, rate, burst = None ):
+        self.rate = rate
+        self.capacity = burst or max( 1, rate or 1 )
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire( self ):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min( self.capacity, self._tokens + ( now - self._updated ) * self.rate )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = ( 1 - self._tokens ) / self.rate
+            time.sleep( wait )
+
+    async def acquire_async( self ):
+        """acquire() for coroutines, waits without blocking the event loop. Threads
+        and coroutines share the same budget."""
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min( self.capacity, self._tokens + ( now - self._updated ) * self.rate )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = ( 1 - self._tokens ) / self.rate
+            await asyncio.sleep( wait )
+
+
+class RateLimitedService:
+    """Wraps a zeep service proxy so every AXL operation waits on `limiter` first."""
+
+    def __init__( self, service, limiter ):
+        self._service = service
+        self._limiter = limiter
+
+    def __getattr__( self, name ):
+        operation = getattr( self._service, name )
+
+        def call( *args, **kwargs ):
+            self._limiter.acquire()
+            return operation( *args, **kwargs )
+
+        return call
+
+
+def is_read( operation ):
+    return operation.startswith( READ_PREFIXES )
+
+
+def is_throttled( err ):
+    """True when `err` means CUCM rejected the request because it is overloaded."""
+    if isinstance( err, TransportError ):
+        return err.status_code in ( 429, 503 )
+    if isinstance( err, Fault ):
+        return bool( THROTTLE_RE.search( str( err.message ) ) )
+    return False
+
+
+class AimdLimit:
+    """Number of requests allowed in flight, additive increase/multiplicative decrease.
+
+    The limit grows by one after `limit` healthy responses in a row (about once per
+    round trip) and is multiplied by `decrease` on congestion, at most once per
+    round trip since the requests already in flight saw the same overload. A
+    response slower than `spike` times the usual latency counts as congestion."""
+
+    def __init__( self, initial = 4, minimum = 1, maximum = 32, decrease = 0.5, spike = 3.0 ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float( max( minimum, min( initial, maximum ) ) )
+        self.decrease = decrease
+        self.spike = spike
+        self.in_flight = 0
+        self.latency = None
+        self.peak = self.limit
+        self.cuts = 0
+        self._samples = 0
+        self._healthy = 0
+        self._last_cut = 0
+        self._cond = threading.Condition()
+
+    def acquire( self ):
+        with self._cond:
+            while self.in_flight >= int( self.limit ):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release( self, seconds, congested = False ):
+        with self._cond:
+            self.in_flight -= 1
+            if not congested and self._samples >= 10 and seconds > self.spike * self.latency:
+                congested = True
+            if congested:
+                now = time.monotonic()
+                if now - self._last_cut > ( self.latency or seconds ):
+                    self.limit = max( self.minimum, self.limit * self.decrease )
+                    self._last_cut = now
+                    self._healthy = 0
+                    self.cuts += 1
+            else:
+                self._samples += 1
+                self.latency = seconds if self.latency is None else 0.95 * self.latency + 0.05 * seconds
+                self._healthy += 1
+                if self._healthy >= int( self.limit ):
+                    self.limit = min( self.maximum, self.limit + 1 )
+                    self.peak = max( self.peak, self.limit )
+                    self._healthy = 0
+            self._cond.notify_all()
+
+
+class AimdController:
+    """Separate AimdLimits for reads and writes. Calls rejected by throttling are
+    retried (CUCM didn't run them) up to `retries` times with growing pauses."""
+
+    def __init__( self, maximum = 32, write_maximum = None, retries = 4, backoff = 0.5 ):
+        self.read = AimdLimit( maximum = maximum )
+        self.write = AimdLimit( initial = 2, maximum = write_maximum or max( 1, maximum // 2 ) )
+        self.retries = retries
+        self.backoff = backoff
+
+    def call( self, name, operation, args, kwargs ):
+        """operation( *args, **kwargs ), `name` being the AXL operation it calls."""
+        limit = self.read if is_read( name ) else self.write
+        for attempt in range( self.retries + 1 ):
+            limit.acquire()
+            started = time.perf_counter()
+            try:
+                result = operation( *args, **kwargs )
+            except Exception as err:
+                throttled = is_throttled( err )
+                limit.release( time.perf_counter() - started, congested = throttled or isinstance( err, Timeout ) )
+                if throttled and attempt < self.retries:
+                    time.sleep( self.backoff * 2 ** attempt * random.uniform( 0.5, 1.5 ) )
+                    continue
+                raise
+            limit.release( time.perf_counter() - started )
+            return result
+
+    def describe( self ):
+        return ( f'reads { int( self.read.limit ) } (peak { int( self.read.peak ) }, { self.read.cuts } cuts), '
+                 f'writes { int( self.write.limit ) } (peak { int( self.write.peak ) }, { self.write.cuts } cuts)' )
+
+
+class AdaptiveService:
+    """Wraps a zeep service proxy so every AXL operation goes through `controller`."""
+
+    def __init__( self, service, controller ):
+        self._service = service
+        self._controller = controller
+
+    def __getattr__( self, name ):
+        operation = getattr( self._service, name )
+
+        def call( *args, **kwargs ):
+            return self._controller.call( name, operation, args, kwargs )
+
+        return call
@@ -0,0 +1,251 @@
+"""Low overhead tracing of AXL calls.
+
+TracingPlugin replaces pretty-printing every envelope to the terminal and the
+HistoryPlugin that was never attached to the client. For every AXL call it records
+the operation, start time, duration, request/response size, HTTP status and the
+SOAP/AXL fault code in a bounded ring buffer. The envelopes themselves are only
+kept as references for the most recent calls and are serialized when somebody
+asks for them. With a trace file
+configured, records are written as JSON lines by a background thread, so the
+calls never wait on disk or the terminal.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+import contextvars
+from collections import deque
+
+from lxml import etree
+from zeep import Plugin
+from zeep.transports import AsyncTransport, Transport
+
+SOAP_ENV_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+
+# Trace file used when AXL_TRACE_FILE is not set and the script runs with DEBUG on
+DEBUG_TRACE_FILE = 'axl trace.jsonl'
+
+
+def _to_xml( envelope, pretty_print = False ):
+    if envelope is None:
+        return None
+    return etree.tostring( envelope, encoding = 'unicode', pretty_print = pretty_print )
+
+
+class TraceRecord:
+    """One AXL call. The envelopes are lxml elements, serialized only on request."""
+
+    __slots__ = ( 'operation', 'started', 'seconds', 'request_bytes', 'response_bytes', 'status',
+                  'fault_code', 'fault_message', 'error', 'sent', 'received', '_start' )
+
+    def __init__( self, operation, sent ):
+        self.operation = operation
+        self.started = time.time()
+        self.seconds = None
+        self.request_bytes = None
+        self.response_bytes = None
+        self.status = None
+        self.fault_code = None
+        self.fault_message = None
+        self.error = None
+        self.sent = sent
+        self.received = None
+        self._start = time.perf_counter()
+
+    def finish( self ):
+        self.seconds = time.perf_counter() - self._start
+
+    def to_dict( self ):
+        return { name: getattr( self, name ) for name in self.__slots__[ :9 ] }
+
+    def sent_xml( self, pretty_print = False ):
+        return _to_xml( self.sent, pretty_print )
+
+    def received_xml( self, pretty_print = False ):
+        return _to_xml( self.received, pretty_print )
+
+
+class TracingPlugin( Plugin ):
+    """zeep plugin keeping the last `maxlen` TraceRecords.
+
+    Envelopes are kept for the last `keep_envelopes` calls only. When `path` is
+    given every record is appended to it as a JSON line from a background thread,
+    including the serialized envelopes when `envelopes` is True.
+
+    Every finished record is also passed to the callables in `listeners`.
+    last_sent/last_received work like HistoryPlugin's, so show_history() keeps working."""
+
+    def __init__( self, maxlen = 1000, keep_envelopes = 20, path = None, envelopes = False ):
+        self.records = deque( maxlen = maxlen )
+        self.keep_envelopes = keep_envelopes
+        self.path = path
+        self.envelopes = envelopes
+        self.listeners = [ ]
+        # the call in progress, per thread and per asyncio task
+        self._current = contextvars.ContextVar( 'axl_trace_record', default = None )
+        self._lock = threading.Lock()
+        self._queue = None
+        if path:
+            self._queue = queue.Queue()
+            self._writer = threading.Thread( target = self._write, name = 'axl-trace-writer', daemon = True )
+            self._writer.start()
+            atexit.register( self.close )
+
+    # zeep plugin hooks
+
+    def egress( self, envelope, http_headers, operation, binding_options ):
+        self._current.set( TraceRecord( operation.name, envelope ) )
+        return envelope, http_headers
+
+    def ingress( self, envelope, http_headers, operation ):
+        record = self._current.get()
+        if record is None:
+            return envelope, http_headers
+        record.received = envelope
+        fault = envelope.find( f'{{{SOAP_ENV_NS}}}Body/{{{SOAP_ENV_NS}}}Fault' )
+        if fault is not None:
+            record.fault_code = next( ( node.text for node in fault.iter( 'axlcode' ) ), None ) or fault.findtext( 'faultcode' )
+            record.fault_message = fault.findtext( 'faultstring' )
+        self._finish( record )
+        return envelope, http_headers
+
+    # called by TracingTransport around the HTTP request
+
+    def note_response( self, request_bytes, response_bytes, status, content = None ):
+        record = self._current.get()
+        if record is not None:
+            record.request_bytes = request_bytes
+            record.response_bytes = response_bytes
+            record.status = status
+            # zeep raises TransportError for an error status without a SOAP body and
+            # ingress() never runs, so the call ends here
+            if status >= 400 and content is not None and not content.lstrip().startswith( b'<' ):
+                record.error = f'TransportError: HTTP { status } without a SOAP response'
+                self._finish( record )
+
+    def note_error( self, request_bytes, err ):
+        record = self._current.get()
+        if record is not None:
+            record.request_bytes = request_bytes
+            record.error = f'{type( err ).__name__}: {err}'
+            self._finish( record )
+
+    def _finish( self, record ):
+        record.finish()
+        self._current.set( None )
+        with self._lock:
+            self.records.append( record )
+            # drop the envelopes of older calls so memory stays bounded
+            if len( self.records ) > self.keep_envelopes:
+                old = self.records[ -self.keep_envelopes - 1 ]
+                old.sent = old.received = None
+        for listener in self.listeners:
+            listener( record )
+        if self._queue is not None:
+            # the writer gets its own references, the ring may drop them before it runs
+            if self.envelopes:
+                self._queue.put( ( record, record.sent, record.received ) )
+            else:
+                self._queue.put( ( record, None, None ) )
+
+    def _write( self ):
+        with open( self.path, 'a', encoding = 'utf-8' ) as f:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    f.flush()
+                    self._queue.task_done()
+                    return
+                record, sent, received = item
+                line = record.to_dict()
+                if self.envelopes:
+                    line['sent'] = _to_xml( sent )
+                    line['received'] = _to_xml( received )
+                f.write( json.dumps( line ) + '\n' )
+                if self._queue.empty():
+                    f.flush()
+                self._queue.task_done()
+
+    def close( self ):
+        """Write out everything still queued and stop the writer thread."""
+        if self._queue is not None and self._writer.is_alive():
+            self._queue.put( None )
+            self._writer.join()
+
+    # HistoryPlugin compatible
+
+    def _last( self, attr ):
+        for record in reversed( self.records ):
+            envelope = getattr( record, attr )
+            if envelope is not None:
+                return { 'envelope': envelope, 'http_headers': None }
+        return None
+
+    @property
+    def last_sent( self ):
+        return self._last( 'sent' )
+
+    @property
+    def last_received( self ):
+        return self._last( 'received' )
+
+
+class TracingTransport( Transport ):
+    """zeep Transport that tells `tracer` the request/response size and HTTP status."""
+
+    def __init__( self, tracer, *args, **kwargs ):
+        super().__init__( *args, **kwargs )
+        self.tracer = tracer
+
+    def post( self, address, message, headers ):
+        try:
+            response = super().post( address, message, headers )
+        except Exception as err:
+            self.tracer.note_error( len( message ), err )
+            raise
+        self.tracer.note_response( len( message ), len( response.content ), response.status_code, response.content )
+        return response
+
+
+class AsyncTracingTransport( AsyncTransport ):
+    """TracingTransport for zeep's httpx based AsyncTransport, see axl_async.py."""
+
+    def __init__( self, tracer, *args, **kwargs ):
+        super().__init__( *args, **kwargs )
+        self.tracer = tracer
+
+    async def post( self, address, message, headers ):
+        try:
+            response = await super().post( address, message, headers )
+        except Exception as err:
+            self.tracer.note_error( len( message ), err )
+            raise
+        self.tracer.note_response( len( message ), len( response.content ), response.status_code, response.content )
+        return response
+
+
+def create_tracer( debug = False ):
+    """TracingPlugin for the scripts. Records go to AXL_TRACE_FILE when it is set; with
+    `debug` the full request/response XML is written too (to DEBUG_TRACE_FILE by default)."""
+    path = os.getenv( 'AXL_TRACE_FILE' ) or ( DEBUG_TRACE_FILE if debug else None )
+    return TracingPlugin( path = path, envelopes = debug )